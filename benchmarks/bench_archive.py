@@ -0,0 +1,58 @@
+"""
+Cost of the daily archive rebuild as the ledger grows.
+
+For each number of years of daily sends, builds a synthetic card store and
+posted ledger, times a full archive build, then times the incremental
+build after one more card is posted (what the daily run pays).
+Thumbnails are left out; they are only made for new cards.
+
+    python -m benchmarks.bench_archive
+    python -m benchmarks.bench_archive --years 1 10 30
+"""
+import argparse
+import tempfile
+import time
+import uuid
+from datetime import date, timedelta
+from pathlib import Path
+
+from benchmarks.bench_selection import synthetic_cards
+from build_archive import ArchiveBuilder, load_cards
+from card_store import CardStore, compile_cards
+from posted_ledger import PostedLedger
+
+
+def timed_build(workdir, full=False):
+    """Seconds to load the ledger and cards and build the archive, and the pages written."""
+    started = time.perf_counter()
+    cards = load_cards(PostedLedger(workdir / 'posted_cards.json'), CardStore(workdir / 'cards.db'))
+    builder = ArchiveBuilder(workdir / 'archive', cards)
+    builder.build_thumbnails(None)
+    card_pages, pages = builder.build(full)
+    return time.perf_counter() - started, card_pages + pages
+
+
+def bench_years(years, workdir):
+    sends = years * 365
+    compile_cards(synthetic_cards(sends + 1), workdir / 'cards.db')
+    ledger = PostedLedger(workdir / 'posted_cards.json')
+    first_day = date(2025, 1, 1)
+    for i in range(sends):
+        ledger.append(str(uuid.UUID(int=i + 1)), first_day + timedelta(days=i))
+
+    full_seconds, _ = timed_build(workdir, full=True)
+    ledger.append(str(uuid.UUID(int=sends + 1)), first_day + timedelta(days=sends))
+    daily_seconds, written = timed_build(workdir)
+    return sends, full_seconds, daily_seconds, written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark full and incremental archive builds.")
+    parser.add_argument('--years', type=int, nargs='+', default=[1, 5, 10])
+    args = parser.parse_args()
+
+    print(f"{'years':>6}{'cards':>8}{'full s':>10}{'daily s':>10}{'pages written':>15}")
+    for years in args.years:
+        with tempfile.TemporaryDirectory() as workdir:
+            sends, full_seconds, daily_seconds, written = bench_years(years, Path(workdir))
+            print(f"{years:>6}{sends:>8}{full_seconds:>10.3f}{daily_seconds:>10.3f}{written:>15}")
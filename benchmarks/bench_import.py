@@ -0,0 +1,139 @@
+"""
+Cold-start cost of the scripts, measured with `python -X importtime`.
+
+Each module is imported `--runs` times, each time in a fresh interpreter.
+The script reports the median cumulative import time and the heaviest
+modules pulled in. It also warns if a client that broadcast_card.py imports
+lazily (requests, resend, dotenv, ...) has crept back into module load, or
+into NYPLCardFetcher start-up: that is checked in a fresh interpreter
+against a small card store with a validity cache and posted ledger next to
+it, as on the scheduled runner.
+Results are appended to the output file and compared with the previous run,
+like run_benchmarks.py.
+
+    python -m benchmarks.bench_import
+    python -m benchmarks.bench_import --modules broadcast_card download_metadata
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+
+from benchmarks.run_benchmarks import compare, current_commit
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+LAZY_MODULES = ('requests', 'resend', 'dotenv', 'http_client', 'validate_cards', 'download_metadata')
+
+FETCHER_STARTUP = f"""
+import json, sys, time
+started = time.perf_counter()
+from broadcast_card import NYPLCardFetcher
+NYPLCardFetcher.from_env().get_random_unposted_card()
+print(json.dumps({{'seconds': time.perf_counter() - started,
+                  'eager': [name for name in {LAZY_MODULES!r} if name in sys.modules]}}))
+"""
+
+
+def import_profile(module):
+    """
+    Import `module` in a fresh interpreter and return {name: (self_us, cumulative_us)}
+    from -X importtime for it and everything it pulled in (interpreter start-up excluded).
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True, cwd=REPO_ROOT, check=True)
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        if not name.startswith('  ') and name.strip() != module:
+            # A finished top-level import that isn't ours (site, encodings, ...): drop it and its children
+            timings = {}
+            continue
+        timings[name.strip()] = (int(self_us), int(cumulative_us))
+    return timings
+
+
+def bench_module(module, runs, top):
+    profiles = [import_profile(module) for _ in range(runs)]
+    seconds = statistics.median(profile[module][1] for profile in profiles) / 1e6
+
+    heaviest = sorted(profiles[-1].items(), key=lambda item: item[1][1], reverse=True)
+    print(f"\n{module}: {seconds * 1000:.1f} ms (median of {runs})")
+    for name, (_, cumulative_us) in [item for item in heaviest if item[0] != module][:top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+    if module == 'broadcast_card':
+        eager = [name for name in LAZY_MODULES if name in profiles[-1]]
+        if eager:
+            print(f"  WARNING: imported at module load, should be lazy: {', '.join(eager)}")
+    return {'import': seconds}
+
+
+def bench_fetcher_startup(runs):
+    """Median seconds to import broadcast_card and pick a card, with every local cache present."""
+    from benchmarks.bench_selection import synthetic_cards
+    from card_store import compile_cards
+    from posted_ledger import PostedLedger
+    from validity_cache import ValidityCache
+
+    with tempfile.TemporaryDirectory() as workdir:
+        workdir = Path(workdir)
+        compile_cards(synthetic_cards(1000), workdir / 'cards.db')
+        cache = ValidityCache(workdir / 'card_validity.db')
+        cache.record('1000000', 'ok')
+        cache.finish_pass(complete=False)
+        cache.close()
+        PostedLedger(workdir / 'posted_cards.json').append('00000000-0000-0000-0000-000000000001')
+        env = dict(os.environ, PYTHONPATH=str(REPO_ROOT), CARD_STORE_PATH=str(workdir / 'cards.db'),
+                   VALIDITY_PATH=str(workdir / 'card_validity.db'), POSTED_PATH=str(workdir / 'posted_cards.json'),
+                   METADATA_PATH=str(workdir / 'metadata.json'), IMAGE_CACHE_DIR=str(workdir / 'image_cache'),
+                   DEDUP_PATH=str(workdir / 'card_dups.db'), SEND_QUEUE_PATH=str(workdir / 'send_queue.jsonl'))
+        results = [json.loads(subprocess.run([sys.executable, '-c', FETCHER_STARTUP], capture_output=True, text=True,
+                                             cwd=workdir, env=env, check=True).stdout.splitlines()[-1])
+                   for _ in range(runs)]
+
+    seconds = statistics.median(result['seconds'] for result in results)
+    print(f"\nNYPLCardFetcher start-up and first pick: {seconds * 1000:.1f} ms (median of {runs})")
+    if results[-1]['eager']:
+        print(f"  WARNING: imported during fetcher start-up, should be lazy: {', '.join(results[-1]['eager'])}")
+    return {'fetcher_startup': seconds}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure import (cold-start) time of the scripts.")
+    parser.add_argument('--modules', nargs='+', default=['broadcast_card'])
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--top', type=int, default=10, help="heaviest imported modules to list")
+    parser.add_argument('--output', default='benchmarks/import_results.jsonl')
+    args = parser.parse_args()
+
+    results = {module: bench_module(module, args.runs, args.top) for module in args.modules}
+    if 'broadcast_card' in args.modules:
+        results['fetcher_startup'] = bench_fetcher_startup(args.runs)
+
+    output_path = Path(args.output)
+    previous = None
+    if output_path.exists():
+        lines = output_path.read_text().splitlines()
+        previous = json.loads(lines[-1])['results'] if lines else None
+
+    record = {
+        'commit': current_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'results': results,
+    }
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with output_path.open('a') as f:
+        f.write(json.dumps(record) + '\n')
+    print(f"\nResults appended to {output_path}")
+
+    if previous:
+        compare(previous, results)
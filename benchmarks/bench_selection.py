@@ -0,0 +1,74 @@
+"""
+Per-pick cost of card selection as the catalogue grows.
+
+Builds synthetic card stores from 1k to 1M cards and times a random pick,
+a lookup by UUID and a mark-as-posted (pool retire) against each, plus a
+title search, a random pick filtered by title word and collection, and a
+pick from a collection with all but five of its cards posted.
+
+    python -m benchmarks.bench_selection
+    python -m benchmarks.bench_selection --sizes 1000 100000 --picks 2000
+"""
+import argparse
+import random
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+from card_store import CardStore, compile_cards
+
+SUBJECTS = ['aeroplane', 'footballer', 'cricketer', 'flag', 'ship', 'bird', 'flower', 'actress', 'locomotive', 'dog',
+            'soldier', 'butterfly', 'boxer', 'castle', 'motor car', 'golfer', 'uniform', 'fish', 'jockey', 'map']
+COLLECTIONS = [str(uuid.UUID(int=(i + 1) << 64)) for i in range(47)]
+
+
+def synthetic_cards(count):
+    """Yield (capture, collection_uuid) pairs for a catalogue of the given size."""
+    for i in range(count):
+        yield {
+            'uuid': str(uuid.UUID(int=i + 1)),
+            'imageID': str(1000000 + i),
+            'title': f"{SUBJECTS[i % len(SUBJECTS)].title()}s, No. {i % 50 + 1} (series {i // 1000})",
+        }, COLLECTIONS[i % len(COLLECTIONS)]
+
+
+def time_per_call(fn, calls):
+    started = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - started) / calls * 1e6
+
+
+def bench_size(size, picks, workdir):
+    store_path = Path(workdir) / f"cards_{size}.db"
+    compile_cards(synthetic_cards(size), store_path)
+    store = CardStore(store_path)
+
+    pick_us = time_per_call(store.random_card, picks)
+    lookup_us = time_per_call(lambda: store.get(store.random_card()['uuid']), picks) - pick_us
+    retire_us = time_per_call(lambda: store.retire(store.random_card()['uuid']), picks) - pick_us
+    search_us = time_per_call(lambda: store.search(random.choice(SUBJECTS), limit=20), picks)
+    filtered_us = time_per_call(
+        lambda: store.random_matching(random.choice(SUBJECTS), collection=random.choice(COLLECTIONS)), picks)
+    sparse = COLLECTIONS[0]
+    store.retire_many([row[0] for row in store.conn.execute("SELECT uuid FROM cards WHERE collection = ?", (sparse,))][:-5])
+    sparse_us = time_per_call(lambda: store.random_matching(collection=sparse), picks)
+
+    store.close()
+    store_path.unlink()
+    return pick_us, lookup_us, retire_us, search_us, filtered_us, sparse_us
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark card selection against synthetic stores.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--picks', type=int, default=1000, help="operations timed per size")
+    args = parser.parse_args()
+
+    columns = ['pick us', 'lookup us', 'retire us', 'search us', 'filtered us', 'sparse us']
+    print(f"{'cards':>10}" + ''.join(f"{column:>12}" for column in columns))
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            timings = bench_size(size, min(args.picks, size // 2), workdir)
+            print(f"{size:>10}" + ''.join(f"{us:>12.1f}" for us in timings))
@@ -0,0 +1,169 @@
+"""
+Benchmark suite for the fetch/select/send pipeline, run entirely against
+local stand-ins (stub_servers.py) and synthetic metadata.
+
+For each catalogue size it times:
+  store_build   compiling metadata JSONL into the card store (s)
+  fetcher_init  NYPLCardFetcher.__init__ against the built store (s)
+  select        get_random_unposted_card (s per call)
+  verify        verify_and_get_info against the stub image server (s per call)
+  send          send_broadcast_card against the stub Resend API (s per call)
+  harvest       a full harvest of that many captures from the stub NYPL API (s)
+
+Each run appends one JSON line (commit, timestamp, results) to the output
+file and is compared with the previous line, flagging stages that got
+noticeably slower.
+
+    python -m benchmarks.run_benchmarks
+    python -m benchmarks.run_benchmarks --sizes 1000 10000 100000 1000000
+"""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import resend
+
+from broadcast_card import NYPLCardFetcher, ResendBroadcastSender
+from card_store import build_card_store
+from download_metadata import COLLECTIONS, CollectionHarvester, HarvestCheckpoints
+from stub_servers import start_stub_nypl, start_stub_resend, synthetic_capture, is_broken_image
+
+REGRESSION_RATIO = 1.25
+
+
+def write_synthetic_metadata(path, count):
+    """Write `count` captures spread across the real collection UUIDs, as harvest JSONL."""
+    with open(path, 'w') as f:
+        for i in range(count):
+            collection_uuid = COLLECTIONS[i % len(COLLECTIONS)]
+            capture = synthetic_capture(collection_uuid, i // len(COLLECTIONS))
+            capture['collection'] = collection_uuid
+            f.write(json.dumps(capture) + '\n')
+
+
+def timed(fn, calls=1):
+    """Average wall-clock seconds per call, with the pipeline's progress output silenced."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        return (time.perf_counter() - started) / calls
+
+
+def bench_catalogue(size, workdir, image_root, iterations):
+    metadata_path = workdir / f"metadata_{size}.jsonl"
+    store_path = workdir / f"cards_{size}.db"
+    write_synthetic_metadata(metadata_path, size)
+
+    results = {'store_build': timed(lambda: build_card_store([metadata_path], store_path))}
+
+    def make_fetcher():
+        return NYPLCardFetcher('stub', metadata_path, workdir / f"posted_{size}.json", store_path, image_root,
+                               validity_path=None, queue_path=None)
+    results['fetcher_init'] = timed(make_fetcher)
+    card_fetcher = make_fetcher()
+
+    results['select'] = timed(card_fetcher.get_random_unposted_card, iterations)
+
+    good_cards = []
+    while len(good_cards) < iterations:
+        card = card_fetcher.get_random_unposted_card()
+        if not is_broken_image(card['imageID']):
+            good_cards.append(card['uuid'])
+    cards = iter(good_cards)
+    results['verify'] = timed(lambda: card_fetcher.verify_and_get_info(next(cards)), iterations)
+
+    sender = ResendBroadcastSender('re_stub', 'Bench <bench@example.com>', 'audience-stub')
+    results['send'] = timed(lambda: sender.send_broadcast_card(None, "Benchmark card", f"{image_root}/index.php?id=1&t=w"),
+                            iterations)
+
+    card_fetcher.store.close()
+    return results
+
+
+def bench_harvest(size, workdir):
+    server, api_base = start_stub_nypl(items_per_collection=max(1, size // len(COLLECTIONS)))
+    try:
+        harvester = CollectionHarvester('stub', api_base=api_base, concurrency=8, rate=0)
+        checkpoints = HarvestCheckpoints(workdir / f"checkpoints_{size}")
+        return timed(lambda: harvester.sync(COLLECTIONS, checkpoints))
+    finally:
+        server.shutdown()
+
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def compare(previous, current):
+    """Print stages that are REGRESSION_RATIO times slower than the previous run."""
+    regressions = 0
+    for size, stages in current.items():
+        for stage, seconds in stages.items():
+            before = previous.get(size, {}).get(stage)
+            if before and seconds > before * REGRESSION_RATIO:
+                regressions += 1
+                print(f"  REGRESSION {size} cards / {stage}: {before:.6f}s -> {seconds:.6f}s ({seconds / before:.2f}x)")
+    if not regressions:
+        print("  No regressions against the previous run.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the card pipeline against local stubs.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--iterations', type=int, default=50, help="calls timed for per-call stages")
+    parser.add_argument('--max-harvest', type=int, default=100000, help="skip the harvest stage above this size")
+    parser.add_argument('--output', default='benchmarks/results.jsonl')
+    args = parser.parse_args()
+
+    nypl_server, api_base = start_stub_nypl()
+    resend_server, resend_url = start_stub_resend()
+    resend.api_url = resend_url
+    image_root = api_base.rsplit('/api', 1)[0]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        for size in args.sizes:
+            print(f"Benchmarking {size} cards...")
+            results[str(size)] = bench_catalogue(size, workdir, image_root, args.iterations)
+            if size <= args.max_harvest:
+                results[str(size)]['harvest'] = bench_harvest(size, workdir)
+
+    stages = ['store_build', 'fetcher_init', 'select', 'verify', 'send', 'harvest']
+    print(f"\n{'cards':>10}" + ''.join(f"{stage:>14}" for stage in stages))
+    for size, row in results.items():
+        print(f"{size:>10}" + ''.join(f"{row[stage]:>14.6f}" if stage in row else f"{'-':>14}" for stage in stages))
+
+    output_path = Path(args.output)
+    previous = None
+    if output_path.exists():
+        lines = output_path.read_text().splitlines()
+        previous = json.loads(lines[-1])['results'] if lines else None
+
+    record = {
+        'commit': current_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'results': results,
+    }
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with output_path.open('a') as f:
+        f.write(json.dumps(record) + '\n')
+    print(f"\nResults appended to {output_path}")
+
+    if previous:
+        compare(previous, results)
+
+    nypl_server.shutdown()
+    resend_server.shutdown()
@@ -1,69 +1,141 @@
-import json
-import random
-import requests
+import argparse
 import os
 import re
-import resend # Ensure resend is imported
 from pathlib import Path
-from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, date
 import time # Keep for retry delay
+from card_store import CardStore, build_card_store, store_is_stale
+from posted_ledger import PostedLedger
+from image_probe import probe_image, sniff_image, ImageProbeError, PROBE_BYTES
+from image_cache import ImageCache
+from send_queue import SendQueue
+from validity_cache import ValidityCache
+from metrics import metrics, profile
+# requests, http_client, resend and dotenv are imported where first needed:
+# they dominate cold-start time and a queued or dry-run send may never use them
 
 # --- NYPL Card Fetcher (Modified to return NYPL URL) ---
 class NYPLCardFetcher:
     """Handles fetching random card data and image URL from NYPL."""
 
-    def __init__(self, nypl_token, metadata_path='metadata.json', posted_path='posted_cards.json'):
+    def __init__(self, nypl_token, metadata_path='metadata.json', posted_path='posted_cards.json', store_path='cards.db',
+                 image_base='https://images.nypl.org', validity_path='card_validity.db', image_cache=None,
+                 dedup_path='card_dups.db', queue_path='send_queue.jsonl'):
         self.nypl_token = nypl_token
+        self.image_base = image_base.rstrip('/')
+        self.image_cache = image_cache
         self.metadata_path = Path(metadata_path)
         self.posted_path = Path(posted_path)
-        # No headers needed for public image URLs
-        self.metadata = self.load_json(self.metadata_path)
-        self.posted_cards = self.load_json(self.posted_path, default=[])
-
-    def load_json(self, path, default=None):
-        """Load JSON data from a file."""
-        try:
-            path = Path(path)
-            with path.open('r') as f: return json.load(f)
-        except FileNotFoundError: print(f"Warning: File not found {path}"); return default or {}
-        except json.JSONDecodeError: print(f"Warning: JSON decode error {path}"); return default or {}
-
-    def save_posted_cards(self):
-        """Save the list of posted cards."""
+        self.queue_path = queue_path
+        self._session = None
+        # Near-duplicate clusters from dedup_cards.py, if it has been run
+        self.dedup_path = dedup_path if dedup_path and Path(dedup_path).exists() else None
+
+        with metrics.span('metadata_load'):
+            self._load_cards(store_path, validity_path)
+
+    @property
+    def session(self):
+        # No headers needed for public image URLs; the shared client keeps probes on a warm
+        # connection and retries transient failures
+        if self._session is None:
+            from http_client import shared_client
+            self._session = shared_client()
+        return self._session
+
+    def _load_cards(self, store_path, validity_path):
+        """Open the card store and bring its selection pool up to date with the ledger, dedup and validity caches."""
+        # Cards are read from the compiled store; (re)build it only when the metadata is newer
+        if store_is_stale(store_path, [self.metadata_path]):
+            if not self.metadata_path.exists():
+                raise Exception(f"No card store at {store_path} and no metadata at {self.metadata_path} to build one")
+            print(f"Compiling card store {store_path} from {self.metadata_path}...")
+            build_card_store([self.metadata_path], store_path)
+        self.store = CardStore(store_path)
+        self.posted_cards = PostedLedger(self.posted_path)
+
+        # Keep the store's unposted pool in step with the posted list (cheap no-op for cards already retired)
+        self.retire_cards(self.posted_cards)
+        # Cards waiting in the send queue are reserved too; a rebuilt store has forgotten that
+        if self.queue_path:
+            self.retire_cards(entry['card_uuid'] for entry in SendQueue(self.queue_path).entries())
+
+        # Drop cards with known-bad images. Cards not checked yet stay selectable: verify_and_get_info
+        # probes them when picked, so new cards from a harvest are never locked out
+        self.validity = None
+        if validity_path and Path(validity_path).exists():
+            self.validity = ValidityCache(validity_path)
+            applied = str(self.validity.generation)
+            if self.store.get_meta('validity_applied') != applied:
+                retired = self.store.retire_invalid(validity_path)
+                self.store.set_meta('validity_applied', applied)
+                print(f"Validity cache applied: {retired} cards removed from selection")
+
+    @classmethod
+    def from_env(cls):
+        """Build a fetcher from the same environment variables main() uses."""
+        image_base = os.getenv("NYPL_IMAGE_BASE", "https://images.nypl.org")
+        image_cache = ImageCache(
+            os.getenv("IMAGE_CACHE_DIR", "image_cache"),
+            max_bytes=int(os.getenv("IMAGE_CACHE_MAX_MB", "512")) * 1024 * 1024,
+            image_base=image_base,
+        )
+        return cls(
+            os.getenv("NYPL_TOKEN"),
+            os.getenv("METADATA_PATH", "metadata.json"),
+            os.getenv("POSTED_PATH", "posted_cards.json"),
+            os.getenv("CARD_STORE_PATH", "cards.db"),
+            image_base,
+            os.getenv("VALIDITY_PATH", "card_validity.db"),
+            image_cache,
+            os.getenv("DEDUP_PATH", "card_dups.db"),
+            os.getenv("SEND_QUEUE_PATH", "send_queue.jsonl"),
+        )
+
+    def retire_cards(self, card_uuids):
+        """Take cards out of the selection pool, along with their near-duplicates. Returns how many were removed."""
+        card_uuids = list(card_uuids)
+        retired = self.store.retire_many(card_uuids)
+        if self.dedup_path:
+            retired += self.store.retire_siblings(self.dedup_path, card_uuids)
+        return retired
+
+    def mark_posted(self, card_uuid):
+        """Record a card as posted and take it (and any near-duplicates) out of the selection pool."""
+        self.posted_cards.append(card_uuid)
+        self.retire_cards([card_uuid])
+
+    @metrics.span('select')
+    def get_random_unposted_card(self, query='', **facets):
+        """
+        Get data for a random unposted card, optionally restricted to cards
+        whose title matches query and/or facets such as collection=<uuid>.
+        """
         try:
-            with self.posted_path.open('w') as f: json.dump(self.posted_cards, f, indent=2)
-        except Exception as e: print(f"Error saving posted cards to {self.posted_path}: {e}")
+            card = self.store.random_matching(query, **facets) if query or facets else self.store.random_card()
+        except Exception as e: raise Exception(f"Error reading card store: {e}")
 
-    def get_random_unposted_card(self):
-        """Get data for a random unposted card."""
-        try:
-            captures = self.metadata.get('nyplAPI', {}).get('response', {}).get('capture', [])
-            if not captures: raise ValueError("Metadata invalid or 'capture' empty.")
-
-            available_cards = []
-            for card in captures:
-                 if (isinstance(card, dict) and
-                     'uuid' in card and
-                     'imageID' in card and
-                     'title' in card and
-                     card['uuid'] not in self.posted_cards):
-                     available_cards.append(card)
-        except Exception as e: raise Exception(f"Error processing metadata: {e}")
-
-        if not available_cards:
+        if not card:
+            if query or facets:
+                raise Exception(f"No unposted cards match {query!r} {facets or ''}".rstrip())
             raise Exception("No valid, unposted cards with imageID remaining!")
 
-        return random.choice(available_cards)
+        return card
+
+    def search(self, query='', limit=20, **facets):
+        """Cards (posted or not) whose title matches query and/or facets such as collection=<uuid>."""
+        return self.store.search(query, limit, **facets)
 
-    def download_and_get_info(self, card_uuid):
+    @metrics.span('verify')
+    def verify_and_get_info(self, card_uuid, offline=False):
         """
-        Downloads card image locally for verification, gets title,
-        and returns the direct NYPL image URL along with local path and title.
+        Verifies the card image exists by probing its first few KB (no full
+        download, no temp file), and returns the probe info, title and the
+        direct NYPL image URL. With offline=True only the validity and image
+        caches are consulted; image_info is None if neither knows the image.
         """
         try:
-            captures = self.metadata.get('nyplAPI', {}).get('response', {}).get('capture', [])
-            card = next((i for i in captures if isinstance(i, dict) and i.get('uuid') == card_uuid), None)
+            card = self.store.get(card_uuid)
 
             if not card: raise Exception(f"Card {card_uuid} not found in metadata")
 
@@ -74,62 +146,94 @@ class NYPLCardFetcher:
             print(f"Found imageID: {image_id} for card: {card_title}")
 
             # Construct the direct NYPL image URL (this is what we'll use in the email)
-            nypl_image_url = f"https://images.nypl.org/index.php?id={image_id}&t=w"
+            nypl_image_url = f"{self.image_base}/index.php?id={image_id}&t=w"
             print(f"Image URL for email: {nypl_image_url}")
 
-            # --- Download Step (for verification) ---
-            print(f"Attempting download for verification from: {nypl_image_url}")
-            response = requests.get(nypl_image_url, timeout=30)
-            response.raise_for_status() # Check for HTTP errors
-
-            content_type = response.headers.get('Content-Type', '')
-            if not content_type.startswith('image/'):
-                raise Exception(f"Verification failed: Response is not an image. Content-Type: {content_type}")
+            # Images already validated by validate_cards.py need no network check
+            known = self.validity.get(image_id) if self.validity else None
+            if known and known['status'] == 'ok':
+                print(f"Image {image_id} already validated ({known['width']}x{known['height']}), skipping probe")
+                metrics.count('verify_validity_hits')
+                return known, card_title, nypl_image_url
+
+            # A copy in the local image cache can be checked without the network too
+            cached_path = self.image_cache.peek(image_id, 'w') if self.image_cache else None
+            if cached_path:
+                with cached_path.open('rb') as f: image_info = sniff_image(f.read(PROBE_BYTES))
+                if image_info:
+                    image_info['bytes'] = cached_path.stat().st_size
+                    print(f"Image {image_id} found in local cache ({image_info['width']}x{image_info['height']}), skipping probe")
+                    metrics.count('verify_cache_hits')
+                    return image_info, card_title, nypl_image_url
+
+            if offline:
+                print(f"Offline: image {image_id} not in any local cache, skipping probe")
+                return None, card_title, nypl_image_url
+
+            # --- Verification Step (Range request, header bytes only) ---
+            image_info = self._probe(card_uuid, image_id, nypl_image_url)
+            print(f"Verified {image_info['format']} image "
+                  f"({image_info['width']}x{image_info['height']}, {image_info['bytes'] or 'unknown'} bytes)")
+            if self.validity:
+                self.validity.record(image_id, 'ok', image_info)
+
+            return image_info, card_title, nypl_image_url
 
-            # Save temporarily (optional, but confirms download works)
-            temp_path = f"temp_card_{re.sub(r'[^a-zA-Z0-9_-]', '_', card_uuid)}.jpg"
-            with open(temp_path, 'wb') as f:
-                f.write(response.content)
-            print(f"Successfully verified and saved image locally to {temp_path}")
-            # --- End Download Step ---
+        except Exception as e:
+            raise Exception(f"Failed to verify image for card {card_uuid}: {str(e)}") from e
 
-            # Return temp path (for cleanup), title, AND the public URL
-            return temp_path, card_title, nypl_image_url
+    def _probe(self, card_uuid, image_id, nypl_image_url):
+        """Range-probe the image, retiring the card if the host says it is gone or not an image."""
+        import requests
 
+        print(f"Probing image for verification: {nypl_image_url}")
+        try:
+            return probe_image(nypl_image_url, session=self.session)
+        except ImageProbeError:
+            self.discard_card(card_uuid, image_id, 'non-image')
+            raise
         except requests.exceptions.RequestException as e:
-             raise Exception(f"Network error verifying/downloading image {nypl_image_url}: {str(e)}")
-        except Exception as e:
-            raise Exception(f"Failed to verify/download image for card {card_uuid}: {str(e)}")
+            if isinstance(e, requests.exceptions.HTTPError) and e.response is not None \
+                    and e.response.status_code in (404, 410):
+                self.discard_card(card_uuid, image_id, 'missing')
+            raise Exception(f"Network error verifying image {nypl_image_url}: {str(e)}") from e
+
+    def discard_card(self, card_uuid, image_id, status):
+        """Take a card with a broken image out of selection, remembering why."""
+        self.store.retire(card_uuid)
+        if self.validity:
+            self.validity.record(image_id, status)
 
 
 # --- Resend Broadcast Sender (Using direct NYPL URL) ---
 class ResendBroadcastSender:
     """Handles creating and sending emails via Resend Broadcast API"""
 
-    def __init__(self, api_key, from_email, audience_id):
+    def __init__(self, api_key, from_email, audience_id, http=None):
+        import resend
+        from http_client import ResendTransport, shared_client
+
         self.api_key = api_key
         resend.api_key = api_key # Initialize resend globally
+        # Resend calls go through the shared client too: retries, Retry-After and a circuit breaker
+        resend.default_http_client = ResendTransport(http or shared_client())
         self.from_email = from_email
         self.audience_id = audience_id
 
-    def _clean_tag_value(self, value):
+    @staticmethod
+    def _clean_tag_value(value):
         """Clean tag value"""
         cleaned = re.sub(r'[^\w-]', '_', str(value))
         cleaned = re.sub(r'_+', '_', cleaned)
         return cleaned[:49]
 
-    # Modified to accept nypl_image_url, image_path is now just for logging/reference
-    def send_broadcast_card(self, image_path, card_title, nypl_image_url):
-        """Creates AND immediately sends a broadcast email linking to the NYPL image."""
-        created_broadcast_id = None # Initialize
-
-        try:
-            # === STEP 1: Create the Broadcast Definition ===
-
-            # 1a. Image embedding/processing NO LONGER NEEDED here
+    @classmethod
+    def render_broadcast(cls, card_title, nypl_image_url, send_date=None):
+        """Render the subject, HTML and tags for a card email. Needs no network or API key."""
+        send_date = send_date or datetime.now()
 
-            # 1b. Create HTML content using the direct NYPL URL
-            html_content = f"""
+        # Create HTML content using the direct NYPL URL
+        html_content = f"""
             <html>
             <head>
                 <title>A little card to brighten your day</title>
@@ -144,7 +248,7 @@ class ResendBroadcastSender:
             </head>
             <body>
                 <h1>A little card to brighten your day</h1>
-                <div class="date">{datetime.now().strftime("%A, %B %d, %Y")}</div>
+                <div class="date">{send_date.strftime("%A, %B %d, %Y")}</div>
                 <p>Hello!</p>
                 <p>I hope this card brings a little joy.</p>
                 <div class="card-container">
@@ -161,42 +265,40 @@ class ResendBroadcastSender:
             </html>
             """
 
-            # 1c. Prepare 'create' parameters
-            create_params: resend.Broadcasts.CreateParams = {
-                "audience_id": self.audience_id,
-                "from": self.from_email,
-                "subject": f"today's cigarette card",
-                "html": html_content,
-                "tags": [
-                    {"name": "content_type", "value": "cigarette_card"},
-                    {"name": "card_title", "value": self._clean_tag_value(card_title)}
-                ]
-            }
-
-            # 1d. Call 'create' API
-            print(f"Creating broadcast definition for audience ID: {self.audience_id}...")
-            created_broadcast = resend.Broadcasts.create(create_params)
-            created_broadcast_id = created_broadcast.get('id')
+        return {
+            "subject": f"today's cigarette card",
+            "html": html_content,
+            "tags": [
+                {"name": "content_type", "value": "cigarette_card"},
+                {"name": "card_title", "value": cls._clean_tag_value(card_title)}
+            ]
+        }
+
+    # Modified to accept nypl_image_url, image_info is now just for logging/reference
+    def send_broadcast_card(self, image_info, card_title, nypl_image_url):
+        """Creates AND immediately sends a broadcast email linking to the NYPL image."""
+        return self.send_rendered(self.render_broadcast(card_title, nypl_image_url))
+
+    def send_rendered(self, rendered):
+        """Creates AND immediately sends a broadcast from pre-rendered subject/html/tags."""
+        created_broadcast_id = None # Initialize
 
-            if not created_broadcast_id:
-                 error_info = created_broadcast.get('error')
-                 if error_info: raise Exception(f"Failed to create broadcast: {error_info.get('message', 'Unknown Resend error')}")
-                 else: raise Exception("Failed to create broadcast: No ID or error received.")
+        try:
+            # === STEP 1: Create the Broadcast Definition ===
+            print(f"Creating broadcast definition for audience ID: {self.audience_id}...")
+            created_broadcast_id = self.create_broadcast(rendered)
             print(f"Broadcast definition created successfully! ID: {created_broadcast_id}")
 
             # === STEP 2: Send the Created Broadcast Immediately ===
-            send_params: resend.Broadcasts.SendParams = {
-                "broadcast_id": created_broadcast_id
-            }
             print(f"Initiating sending for broadcast ID: {created_broadcast_id}...")
-            send_response = resend.Broadcasts.send(send_params)
+            send_response = self.send_broadcast(created_broadcast_id)
 
             if isinstance(send_response, dict) and send_response.get('id') == created_broadcast_id:
                  print(f"Broadcast sending initiated successfully! Response ID: {send_response.get('id')}")
             else:
                  print(f"Broadcast sending initiated. Response: {send_response}")
 
-            return created_broadcast # Return create response
+            return {"id": created_broadcast_id}
 
         # ----- Generic Error Handling -----
         except Exception as e:
@@ -206,93 +308,212 @@ class ResendBroadcastSender:
                  print(f"Error during broadcast creation step: {str(e)}")
             raise
 
-# --- Main Execution Logic ---
-def main():
-    """Fetches card, verifies image, sends broadcast linking to NYPL image."""
+    def create_broadcast(self, rendered, audience_id=None, name=None):
+        """Create a broadcast definition (not sent yet) for an audience, by default this sender's. Returns its ID."""
+        import resend
+
+        create_params: resend.Broadcasts.CreateParams = {
+            "audience_id": audience_id or self.audience_id,
+            "from": self.from_email,
+            "subject": rendered["subject"],
+            "html": rendered["html"],
+            "tags": rendered["tags"]
+        }
+        if name:
+            create_params["name"] = name
+
+        with metrics.span('broadcast_create'):
+            created_broadcast = resend.Broadcasts.create(create_params)
+        created_broadcast_id = created_broadcast.get('id')
+
+        if not created_broadcast_id:
+             error_info = created_broadcast.get('error')
+             if error_info: raise Exception(f"Failed to create broadcast: {error_info.get('message', 'Unknown Resend error')}")
+             else: raise Exception("Failed to create broadcast: No ID or error received.")
+        return created_broadcast_id
+
+    def send_broadcast(self, broadcast_id, scheduled_at=None):
+        """Send a created broadcast now, or at scheduled_at (ISO 8601). Returns Resend's response."""
+        import resend
+
+        send_params: resend.Broadcasts.SendParams = {
+            "broadcast_id": broadcast_id
+        }
+        if scheduled_at:
+            send_params["scheduled_at"] = scheduled_at
+
+        with metrics.span('broadcast_send'):
+            return resend.Broadcasts.send(send_params)
+
+    def broadcast_status(self, broadcast_id):
+        """Resend's status for a broadcast: 'draft' until it has been sent or scheduled."""
+        import resend
+
+        return resend.Broadcasts.get(broadcast_id).get('status')
+
+    def find_broadcast(self, name):
+        """ID of the broadcast created with this name, or None."""
+        import resend
+
+        for broadcast in resend.Broadcasts.list().get('data', []):
+            if broadcast.get('name') == name:
+                return broadcast['id']
+        return None
+
+# --- Configuration ---
+def load_config(argv=None):
+    """
+    Read and validate every setting before the card store, the queue or the
+    network is touched, so a misconfigured run fails in milliseconds.
+    """
+    parser = argparse.ArgumentParser(description="Send today's cigarette card.")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="pick and render a card without sending it or using the network (same as MODE=test)")
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
     load_dotenv()
 
-    # Get config from .env
-    nypl_token = os.getenv("NYPL_TOKEN") # Keep handy if needed later
-    resend_api_key = os.getenv("RESEND_API_KEY")
-    resend_audience_id = os.getenv("RESEND_AUDIENCE_ID") # For Broadcast
-    from_email = os.getenv("FROM_EMAIL")
-    metadata_path = os.getenv("METADATA_PATH", "metadata.json")
-    posted_path = os.getenv("POSTED_PATH", "posted_cards.json")
-
-    # Validate required vars for broadcast
-    required_vars = {
-        "RESEND_API_KEY": resend_api_key,
-        "RESEND_AUDIENCE_ID": resend_audience_id,
-        "FROM_EMAIL": from_email
+    # Get config from .env (card paths are read by NYPLCardFetcher.from_env)
+    config = {
+        "dry_run": args.dry_run or os.getenv("MODE") == "test",
+        "resend_api_key": os.getenv("RESEND_API_KEY"),
+        "resend_audience_id": os.getenv("RESEND_AUDIENCE_ID"), # For Broadcast
+        "from_email": os.getenv("FROM_EMAIL"),
+        "queue_path": os.getenv("SEND_QUEUE_PATH", "send_queue.jsonl"),
     }
-    missing_vars = [name for name, value in required_vars.items() if not value]
-    if missing_vars:
-        raise Exception(f"Missing env variables for broadcast: {', '.join(missing_vars)}!")
 
-    # Initialize
-    card_fetcher = NYPLCardFetcher(nypl_token, metadata_path, posted_path)
-    broadcast_sender = ResendBroadcastSender(resend_api_key, from_email, resend_audience_id)
+    # Validate required vars for broadcast (a dry run never reaches Resend)
+    if not config["dry_run"]:
+        required_vars = {
+            "RESEND_API_KEY": config["resend_api_key"],
+            "RESEND_AUDIENCE_ID": config["resend_audience_id"],
+            "FROM_EMAIL": config["from_email"]
+        }
+        missing_vars = [name for name, value in required_vars.items() if not value]
+        if missing_vars:
+            raise Exception(f"Missing env variables for broadcast: {', '.join(missing_vars)}!")
 
-    # Retry logic
+    if not os.getenv("IMAGE_CACHE_MAX_MB", "512").isdigit():
+        raise Exception(f"IMAGE_CACHE_MAX_MB must be a whole number of megabytes, got {os.getenv('IMAGE_CACHE_MAX_MB')!r}")
+    return config
+
+
+# --- Main Execution Logic ---
+def main(argv=None):
+    """Sends the next prepared card from the queue, or fetches and verifies one live, then broadcasts it."""
+    config = load_config(argv)
+    dry_run = config["dry_run"]
+
+    # Initialize (a dry run creates no Resend client at all)
+    card_fetcher = NYPLCardFetcher.from_env()
+    broadcast_sender = None if dry_run else ResendBroadcastSender(
+        config["resend_api_key"], config["from_email"], config["resend_audience_id"])
+    send_queue = SendQueue(config["queue_path"])
+
+    # Retry logic: HTTP calls already retry transient failures themselves, so an attempt
+    # fails only when an upstream stays down or rejects us. State is kept across attempts:
+    # the same card is retried unless its image turned out to be bad, and a broadcast
+    # that was created but not sent is sent rather than created again.
     max_attempts = 5
-    image_path = None # To store temp path for cleanup
+    card_uuid = None
+    broadcast_id = None
 
     for attempt in range(1, max_attempts + 1):
         print(f"\nAttempt {attempt} of {max_attempts}")
-        card_uuid = None # Ensure defined in scope
+        stage = 'select'
 
         try:
-            # 1. Get random card data
-            card_data = card_fetcher.get_random_unposted_card()
-            card_uuid = card_data.get('uuid')
-            if not card_uuid:
-                 print("Skipping card with missing UUID.")
-                 continue # Try next attempt directly
-
-            # Check if failed previously this run (optional, depends on retry strategy)
-            # if card_uuid in failed_cards: continue
-
-            print(f"Selected card: {card_data.get('title', 'N/A')} (UUID: {card_uuid})")
-
-            # 2. Verify/download image and get its direct NYPL URL
-            #    We download locally mainly to confirm the image exists and is valid
-            image_path, fetched_card_title, nypl_image_url = card_fetcher.download_and_get_info(card_uuid)
-            print(f"Verified image is accessible at: {nypl_image_url}")
+            queued = send_queue.peek()
+            while queued and queued['card_uuid'] in card_fetcher.posted_cards:
+                # Sent by another run (or another tool) since it was queued: never send a card twice
+                print(f"Dropping queued card {queued['card_uuid']} ({queued['card_title']}): already posted")
+                send_queue.pop()
+                queued = send_queue.peek()
+            if queued:
+                # Prepared ahead of time by prepare_queue.py: already picked, verified and rendered
+                card_uuid, fetched_card_title = queued['card_uuid'], queued['card_title']
+                print(f"Sending queued card: {fetched_card_title} (UUID: {card_uuid}, prepared for {queued['send_date']})")
+                metrics.count('queue_hits')
+                rendered = queued['rendered']
+                if queued['send_date'] != date.today().isoformat():
+                    # Only the date line is stale; re-rendering is local and cheap
+                    rendered = ResendBroadcastSender.render_broadcast(fetched_card_title, queued['image_url'])
+            else:
+                # 1. Get random card data (or keep the one a transient failure interrupted)
+                if card_uuid is None:
+                    card_data = card_fetcher.get_random_unposted_card()
+                    card_uuid = card_data.get('uuid')
+                    if not card_uuid:
+                         print("Skipping card with missing UUID.")
+                         continue # Try next attempt directly
+                    print(f"Selected card: {card_data.get('title', 'N/A')} (UUID: {card_uuid})")
+                else:
+                    print(f"Retrying card {card_uuid}")
+
+                # 2. Verify image and get its direct NYPL URL
+                #    Only the first few KB are fetched, enough to confirm it is a real image
+                stage = 'verify'
+                image_info, fetched_card_title, nypl_image_url = card_fetcher.verify_and_get_info(card_uuid, offline=dry_run)
+                if image_info:
+                    print(f"Verified image is accessible at: {nypl_image_url}")
+                rendered = ResendBroadcastSender.render_broadcast(fetched_card_title, nypl_image_url)
+
+            if dry_run:
+                print(f"Dry run: would send '{rendered['subject']}' for card '{fetched_card_title}' "
+                      f"(UUID: {card_uuid}, {len(rendered['html'])} bytes of HTML). Nothing sent or marked as posted.")
+                break
 
             # 3. Create AND Send broadcast linking to the NYPL URL
-            #    Pass image_path mainly for reference/logging if needed inside sender
-            broadcast_sender.send_broadcast_card(image_path, fetched_card_title, nypl_image_url)
+            stage = 'send'
+            if broadcast_id is None:
+                print(f"Creating broadcast definition for audience ID: {config['resend_audience_id']}...")
+                broadcast_id = broadcast_sender.create_broadcast(rendered)
+                print(f"Broadcast definition created successfully! ID: {broadcast_id}")
+                already_sent = False
+            else:
+                # An earlier attempt created it; its send may have gone through despite the error
+                already_sent = broadcast_sender.broadcast_status(broadcast_id) not in (None, 'draft')
+            if already_sent:
+                print(f"Broadcast {broadcast_id} was already sent by an earlier attempt.")
+            else:
+                print(f"Initiating sending for broadcast ID: {broadcast_id}...")
+                broadcast_sender.send_broadcast(broadcast_id)
 
             # 4. Record card as posted
-            if os.getenv("MODE") != "test":
-                card_fetcher.posted_cards.append(card_uuid)
-                card_fetcher.save_posted_cards()
-                print(f"Marked card {card_uuid} as posted.")
-            else:
-                 print("Test mode: Card not marked as posted.")
+            card_fetcher.mark_posted(card_uuid)
+            if queued:
+                send_queue.pop()
+            print(f"Marked card {card_uuid} as posted.")
 
             # Success!
+            metrics.count('cards_sent')
             print(f"Broadcast for card '{fetched_card_title}' created and sent successfully!")
             break # Exit retry loop
 
         except Exception as e:
-            print(f"Error during attempt {attempt}: {str(e)}")
-            # Simple retry, add card UUID to failed list if needed
+            from http_client import backoff_delay, is_transient
+
+            transient = is_transient(e)
+            print(f"Error during attempt {attempt} ({'transient' if transient else 'permanent'} {stage} failure): {str(e)}")
+            metrics.count('send_failures')
+            if not transient and stage == 'send':
+                # Resend rejected the request itself (bad key, audience, quota): retrying won't help
+                print("Not retrying a broadcast that Resend rejected.")
+                break
+            if not transient and stage == 'verify':
+                card_uuid = None  # this card's image is bad (and retired): pick another one
             if attempt == max_attempts:
                 print("All attempts failed for this run.")
             else:
-                 print("Retrying...")
-                 time.sleep(2)
-
-        finally:
-            # Cleanup temporary image file if it was created
-            if image_path and os.path.exists(image_path):
-                try:
-                    os.remove(image_path)
-                    print(f"Cleaned up temporary file: {image_path}")
-                    image_path = None # Reset path
-                except OSError as e:
-                    print(f"Warning: Could not remove temp file {image_path}: {e}")
+                 delay = backoff_delay(attempt, base=1.0)
+                 print(f"Retrying in {delay:.1f}s...")
+                 metrics.count('send_retries')
+                 time.sleep(delay)
 
 if __name__ == "__main__":
-    main()
+    try:
+        with profile():
+            main()
+    finally:
+        metrics.flush('daily_send')
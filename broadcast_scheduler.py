@@ -0,0 +1,248 @@
+"""
+Send a batch of broadcasts to several audiences (themed lists per
+collection, per timezone, ...) from one job.
+
+Jobs are read from a JSON list or JSON lines file, one job per entry:
+
+    {"audience_id": "...", "card_uuid": "..."}                               a specific card
+    {"audience_id": "...", "collection": "<uuid>", "query": "aeroplane"}     a random unposted card matching
+    {"audience_id": "...", "card_uuid": "...", "send_at": "2025-06-01T08:00:00+02:00"}
+
+send_at is handed to Resend as the broadcast's scheduled_at; without it the
+broadcast goes out straight away. Each job's idempotency key is its "id" if
+given, otherwise a hash of the audience, card spec and send_at. Jobs without
+send_at are keyed on the batch instead: --batch, or by default a hash of the
+jobs file, so rerunning the same file (on any day) resumes it rather than
+sending again. Give a new --batch to send the same file again. Jobs with the
+same key appear once per batch; repeats are skipped. Every state change is
+appended to a journal
+(broadcast_journal.jsonl, BROADCAST_JOURNAL_PATH):
+
+  planned   card picked and verified; reruns reuse the same card
+  creating  about to create the broadcast (named after the job key)
+  created   broadcast exists at Resend, with its ID
+  sent      send accepted; reruns skip the job
+  failed    gave up for now; a rerun picks up where it stopped
+
+Reruns never create a second broadcast for a job. A job interrupted
+mid-create is looked up by name, and a created one is checked with Resend
+before it is sent. Creates and sends go through a bounded worker pool,
+with a separate rate limit for each Resend endpoint.
+
+    python broadcast_scheduler.py jobs.jsonl --workers 4
+    RESEND_API_URL=http://127.0.0.1:8766 python broadcast_scheduler.py jobs.jsonl   # against stub_servers.py
+"""
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+from broadcast_card import NYPLCardFetcher, ResendBroadcastSender
+from card_store import FACETS
+from download_metadata import TokenBucket
+
+
+class JobJournal:
+    """Append-only log of job state changes; the last line for a job is its current state."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.states = {}
+        try:
+            with self.path.open('r') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.states.setdefault(entry['job'], {}).update(entry)
+        except FileNotFoundError:
+            pass
+
+    def get(self, job_id):
+        with self.lock:
+            return dict(self.states.get(job_id, {}))
+
+    def record(self, job_id, state, **fields):
+        """Append a state change and return the job's merged state."""
+        entry = {'job': job_id, 'state': state, 'at': datetime.now().isoformat(timespec='seconds'), **fields}
+        with self.lock:
+            with self.path.open('a') as f:
+                f.write(json.dumps(entry) + '\n')
+            merged = self.states.setdefault(job_id, {})
+            merged.update(entry)
+            return dict(merged)
+
+
+def job_key(job, batch):
+    """The job's idempotency key: its explicit "id", or a hash of what it sends to whom and when (or in which batch)."""
+    if job.get('id'):
+        return str(job['id'])
+    spec = {key: job.get(key) for key in ('audience_id', 'card_uuid', 'query', 'send_at', *FACETS)}
+    if not spec['send_at']:
+        spec['batch'] = batch
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:24]
+
+
+def plan_job(card_fetcher, journal, job_id, job, max_picks=5):
+    """Pick and verify the job's card (main thread: the card store isn't shared with workers)."""
+    facets = {field: job[field] for field in FACETS if job.get(field)}
+    for _ in range(max_picks):
+        card_uuid = job.get('card_uuid') or card_fetcher.get_random_unposted_card(job.get('query', ''), **facets)['uuid']
+        try:
+            _, card_title, image_url = card_fetcher.verify_and_get_info(card_uuid)
+        except Exception as e:
+            if job.get('card_uuid'):
+                raise
+            print(f"Job {job_id}: skipping card {card_uuid}: {e}")
+            continue
+        if not job.get('card_uuid'):
+            # Reserve it so other jobs in this batch (and later runs) pick something else
+            card_fetcher.retire_cards([card_uuid])
+        return journal.record(job_id, 'planned', audience_id=job['audience_id'], card_uuid=card_uuid,
+                              card_title=card_title, image_url=image_url, send_at=job.get('send_at'))
+    raise Exception(f"Job {job_id}: no card with a working image after {max_picks} picks")
+
+
+def run_job(sender, limiters, journal, job_id, resumed, max_attempts=3):
+    """
+    Create and send one planned job's broadcast, retrying with backoff.
+    Runs on a worker thread. Returns the job's final state.
+    """
+    for attempt in range(1, max_attempts + 1):
+        state = journal.get(job_id)
+        try:
+            broadcast_id = state.get('broadcast_id')
+            if broadcast_id is None and resumed and state['state'] in ('creating', 'failed'):
+                # A previous run may have created it and died before journaling the ID
+                limiters['lookup'].acquire()
+                broadcast_id = sender.find_broadcast(job_id)
+                if broadcast_id:
+                    state = journal.record(job_id, 'created', broadcast_id=broadcast_id)
+
+            if broadcast_id is None:
+                send_at = state.get('send_at')
+                send_date = datetime.fromisoformat(send_at) if send_at else None
+                rendered = ResendBroadcastSender.render_broadcast(state['card_title'], state['image_url'], send_date)
+                journal.record(job_id, 'creating')
+                limiters['create'].acquire()
+                broadcast_id = sender.create_broadcast(rendered, audience_id=state['audience_id'], name=job_id)
+                state = journal.record(job_id, 'created', broadcast_id=broadcast_id)
+            elif resumed:
+                # Created by an earlier run: it may have been sent before the journal heard about it
+                limiters['lookup'].acquire()
+                if sender.broadcast_status(broadcast_id) not in (None, 'draft'):
+                    return journal.record(job_id, 'sent')
+
+            limiters['send'].acquire()
+            sender.send_broadcast(broadcast_id, scheduled_at=state.get('send_at'))
+            return journal.record(job_id, 'sent')
+
+        except Exception as e:
+            print(f"Job {job_id} attempt {attempt} of {max_attempts} failed: {e}")
+            if attempt == max_attempts:
+                return journal.record(job_id, 'failed', error=str(e))
+            resumed = True  # the failed call may still have gone through
+            time.sleep(2 ** attempt)
+
+
+def run_jobs(jobs, batch, card_fetcher, sender, journal, workers=4, create_rate=1.0, send_rate=1.0, lookup_rate=2.0,
+             mark_posted=True, dry_run=False):
+    """Plan every job, then create and send them on the worker pool. Returns {state: count}."""
+    counts = {}
+    planned = []
+    seen = set()
+    for job in jobs:
+        job_id = job_key(job, batch)
+        if job_id in seen:
+            # Same key, same broadcast: running it twice would send it twice
+            print(f"Job {job_id}: duplicate of an earlier job in this batch, skipped: {job}")
+            counts['duplicate'] = counts.get('duplicate', 0) + 1
+            continue
+        seen.add(job_id)
+        state = journal.get(job_id)
+        if state.get('state') == 'sent':
+            counts['already sent'] = counts.get('already sent', 0) + 1
+            continue
+        if not state.get('card_uuid'):
+            try:
+                state = plan_job(card_fetcher, journal, job_id, job)
+            except Exception as e:
+                print(f"Could not plan job {job_id}: {e}")
+                counts['unplanned'] = counts.get('unplanned', 0) + 1
+                continue
+        planned.append((job_id, state['state'] != 'planned'))
+        print(f"Job {job_id}: '{state['card_title']}' to audience {state['audience_id']}"
+              + (f" at {state['send_at']}" if state.get('send_at') else ""))
+
+    if dry_run:
+        counts['planned'] = len(planned)
+        return counts
+
+    limiters = {'create': TokenBucket(create_rate), 'send': TokenBucket(send_rate), 'lookup': TokenBucket(lookup_rate)}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+
+        def drain(block_until):
+            while len(pending) > block_until:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job_id = pending.pop(future)
+                    state = future.result()
+                    counts[state['state']] = counts.get(state['state'], 0) + 1
+                    if state['state'] == 'sent':
+                        print(f"Job {job_id}: sent (broadcast {state.get('broadcast_id')})")
+                        if mark_posted:
+                            card_fetcher.mark_posted(state['card_uuid'])
+
+        for job_id, resumed in planned:
+            future = executor.submit(run_job, sender, limiters, journal, job_id, resumed)
+            pending[future] = job_id
+            drain(block_until=2 * workers)
+        drain(block_until=0)
+    return counts
+
+
+def load_jobs(path):
+    """Jobs from a JSON list or a JSON lines file, and the file's hash (the default batch)."""
+    text = Path(path).read_text()
+    batch = hashlib.sha256(text.encode()).hexdigest()[:16]
+    if text.lstrip().startswith('['):
+        return json.loads(text), batch
+    return [json.loads(line) for line in text.splitlines() if line.strip()], batch
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create and send broadcasts for a batch of (audience, card, send time) jobs.")
+    parser.add_argument('jobs', help="JSON or JSON lines file of jobs")
+    parser.add_argument('--journal', default=os.getenv("BROADCAST_JOURNAL_PATH", "broadcast_journal.jsonl"))
+    parser.add_argument('--batch', help="key for jobs without send_at (default: a hash of the jobs file); "
+                                        "reruns with the same batch never send them twice")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--create-rate', type=float, default=1.0, help="broadcast creates per second (0 = unlimited)")
+    parser.add_argument('--send-rate', type=float, default=1.0, help="broadcast sends per second (0 = unlimited)")
+    parser.add_argument('--no-mark-posted', action='store_true', help="don't add sent cards to the posted ledger")
+    parser.add_argument('--dry-run', action='store_true', help="plan the jobs (picking and reserving their cards) without creating broadcasts")
+    args = parser.parse_args()
+
+    load_dotenv()
+    jobs, file_hash = load_jobs(args.jobs)
+    batch = args.batch or file_hash
+    missing_audience = [job for job in jobs if not job.get('audience_id')]
+    if missing_audience:
+        raise Exception(f"{len(missing_audience)} job(s) have no audience_id, e.g. {missing_audience[0]}")
+    resend_api_key, from_email = os.getenv("RESEND_API_KEY"), os.getenv("FROM_EMAIL")
+    if not args.dry_run and not (resend_api_key and from_email):
+        raise Exception("RESEND_API_KEY and FROM_EMAIL must be set")
+
+    card_fetcher = NYPLCardFetcher.from_env()
+    sender = None if args.dry_run else ResendBroadcastSender(resend_api_key, from_email, None)
+    counts = run_jobs(jobs, batch, card_fetcher, sender, JobJournal(args.journal), args.workers, args.create_rate,
+                      args.send_rate, mark_posted=not args.no_mark_posted, dry_run=args.dry_run)
+    print(f"Done: {counts} (batch {batch}, journal: {args.journal})")
@@ -0,0 +1,372 @@
+"""
+Static archive of every card sent so far, written next to the landing
+page (public/archive/ by default, ARCHIVE_DIR):
+
+  index.html            the newest cards, plus links to every page
+  page/<n>.html         PER_PAGE cards each, numbered from the first card sent
+  cards/<uuid>.html     one page per card, with the full-size NYPL image
+  thumbs/<imageID>.jpg  thumbnails resized from the image cache
+  build.json            what the last build rendered
+
+Pages are numbered from the oldest card, so a new send only changes the
+last page (and the one before it, when a new page starts). build.json
+records each card as it was rendered: title, image, send date, and whether
+it had a local thumbnail. Each build compares against that record. It
+rewrites only the pages and card pages whose content changed, plus the
+index, and it only makes thumbnails that are missing.
+
+Thumbnail sources come from the image cache. Images that are not cached
+yet are downloaded into it, unless --offline is given. The resizing runs
+in a process pool. Until a card has a local thumbnail, its pages use
+NYPL's own. Sources that are not images, or that cannot be decoded, are
+recorded in build.json and only retried by a --full build.
+
+Thumbnails need Pillow (in requirements.txt).
+
+    python build_archive.py
+    python build_archive.py --offline --full
+"""
+import argparse
+import html
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+from card_store import CardStore
+from image_cache import ImageCache
+from image_probe import ImageProbeError
+from metrics import metrics
+from posted_ledger import PostedLedger
+
+TEMPLATE_VERSION = 1  # bump when the markup changes: the next build rewrites every page
+PER_PAGE = 48
+THUMB_WIDTH = 300
+NYPL_ITEM_URL = "https://digitalcollections.nypl.org/items/{}"
+NYPL_COLLECTION_URL = "https://digitalcollections.nypl.org/collections/{}"
+
+
+def load_cards(ledger, store):
+    """The posted cards in the order they were sent; cards no longer in the store are left out."""
+    entries = ledger.entries()
+    known = store.get_many(card_uuid for card_uuid, _ in entries)
+    cards = []
+    for card_uuid, sent_on in entries:
+        card = known.get(card_uuid)
+        if card is not None:
+            cards.append(dict(card, sent=sent_on.isoformat() if sent_on else None))
+    if len(cards) < len(entries):
+        print(f"Warning: {len(entries) - len(cards)} posted cards are not in the card store and were left out")
+    return cards
+
+
+def make_thumbnail(source, dest, width=THUMB_WIDTH):
+    """Write source, resized to `width` pixels wide, as a JPEG at dest. Returns False if it can't be decoded. Runs in worker processes."""
+    from PIL import Image
+
+    tmp_path = Path(f"{dest}.tmp")
+    try:
+        with Image.open(source) as image:
+            image.draft('RGB', (width, width))  # JPEG: let the decoder downscale (by up to 8x) for us
+            image = image.convert('RGB')
+            image.thumbnail((width, width * 4), Image.LANCZOS)
+            image.save(tmp_path, 'JPEG', quality=80, optimize=True, progressive=True)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        tmp_path.unlink(missing_ok=True)
+        return False
+    os.replace(tmp_path, dest)
+    return True
+
+
+def fetch_source(image_cache, image_id):
+    """
+    Download the full-size image into the image cache. Returns ('ok', path),
+    ('non-image', None), or ('error', None) for failures worth retrying next build.
+    """
+    try:
+        return 'ok', image_cache.fetch(image_id, 'w')
+    except ImageProbeError:
+        return 'non-image', None
+    except OSError as e:  # requests' exceptions are OSErrors too
+        print(f"Could not fetch source image {image_id} for its thumbnail: {e}")
+        return 'error', None
+
+
+class ArchiveBuilder:
+    """Renders the archive for a list of posted cards into out_dir, incrementally."""
+
+    def __init__(self, out_dir, cards, image_base='https://images.nypl.org', per_page=PER_PAGE):
+        self.out_dir = Path(out_dir)
+        self.cards = cards
+        self.image_base = image_base.rstrip('/')
+        self.per_page = per_page
+        self.thumbs = set()  # imageIDs with a local thumbnail
+        self.manifest_path = self.out_dir / 'build.json'
+        try:
+            with self.manifest_path.open('r') as f:
+                self.previous = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.previous = None
+        # Images that aren't images or can't be decoded; only retried by a full build
+        self.thumb_failures = set(self.previous.get('thumb_failures', [])) if self.previous else set()
+
+    # --- Thumbnails ---
+    def build_thumbnails(self, image_cache, workers=None, io_workers=8, offline=False, retry_failures=False):
+        """Make every missing thumbnail that has a source image. Returns how many were made."""
+        thumbs_dir = self.out_dir / 'thumbs'
+        thumbs_dir.mkdir(parents=True, exist_ok=True)
+        self.thumbs = {name[:-len('.jpg')] for name in os.listdir(thumbs_dir) if name.endswith('.jpg')}
+        if retry_failures:
+            self.thumb_failures = set()
+        todo = sorted({card['imageID'] for card in self.cards} - self.thumbs - self.thumb_failures)
+        if not todo or image_cache is None:
+            return 0
+        try:
+            import PIL  # noqa: F401
+        except ImportError:
+            print(f"Pillow is not installed: {len(todo)} cards keep NYPL's thumbnails (pip install Pillow)")
+            return 0
+
+        sources = {image_id: image_cache.peek(image_id, 'w') for image_id in todo}
+        uncached = [image_id for image_id, source in sources.items() if source is None]
+        if uncached and not offline:
+            with ThreadPoolExecutor(max_workers=io_workers) as threads:
+                fetched = list(threads.map(lambda image_id: fetch_source(image_cache, image_id), uncached))
+            sources.update((image_id, path) for image_id, (_, path) in zip(uncached, fetched))
+            self.thumb_failures |= {image_id for image_id, (status, _) in zip(uncached, fetched) if status == 'non-image'}
+        jobs = [(image_id, str(sources[image_id])) for image_id in todo if sources[image_id]]
+        dests = [str(thumbs_dir / f"{image_id}.jpg") for image_id, _ in jobs]
+        if len(jobs) <= 2:
+            # A day's worth: not worth starting a process pool for
+            results = list(map(make_thumbnail, [source for _, source in jobs], dests))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as processes:
+                results = list(processes.map(make_thumbnail, [source for _, source in jobs], dests, chunksize=8))
+        made = {image_id for (image_id, _), ok in zip(jobs, results) if ok}
+        self.thumbs |= made
+        self.thumb_failures |= {image_id for (image_id, _), ok in zip(jobs, results) if not ok}
+        if len(made) < len(todo):
+            print(f"{len(todo) - len(made)} thumbnails could not be made" + (" (offline: source not cached)" if offline else ""))
+        return len(made)
+
+    # --- Incremental planning ---
+    def rows(self):
+        """Per-card record of everything its pages show, compared between builds."""
+        return [[card['uuid'], card['title'], card['imageID'], card['collection'], card['sent'],
+                 card['imageID'] in self.thumbs] for card in self.cards]
+
+    def settings(self):
+        return {'version': TEMPLATE_VERSION, 'per_page': self.per_page, 'image_base': self.image_base}
+
+    def page_of(self, index):
+        return index // self.per_page + 1
+
+    @property
+    def page_count(self):
+        return max(1, -(-len(self.cards) // self.per_page))
+
+    def plan(self, rows, full=False):
+        """
+        Which card pages (by index) and index pages (by number) to write,
+        given the last build's manifest. None for either means everything.
+        """
+        previous = self.previous
+        if full or previous is None or previous.get('settings') != self.settings() \
+                or len(previous['cards']) > len(rows) or not (self.out_dir / 'index.html').exists():
+            return None, None
+
+        old = previous['cards']
+        changed = [i for i, row in enumerate(rows) if i >= len(old) or old[i] != row]
+        # Neighbours link to a changed card by title; pages list it in their grid
+        card_pages = {j for i in changed for j in (i - 1, i, i + 1) if 0 <= j < len(rows)}
+        pages = {self.page_of(i) for i in changed}
+        if old and changed and self.page_of(len(old) - 1) != self.page_of(len(rows) - 1):
+            pages.add(self.page_of(len(old) - 1))  # the old last page gains a "newer" link
+        return card_pages, pages
+
+    # --- Rendering ---
+    def _write(self, relative_path, text):
+        path = self.out_dir / relative_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + '.tmp')
+        tmp_path.write_text(text)
+        os.replace(tmp_path, path)
+
+    def _layout(self, title, body, root):
+        """Wrap body in the landing page's fonts, stylesheet and footer. root leads back to the archive directory."""
+        return f"""<!doctype html>
+<html lang="en">
+    <head>
+        <meta charset="UTF-8" />
+        <meta name="viewport" content="width=device-width, initial-scale=1.0" />
+        <title>{html.escape(title)} · Cigarette Card Club</title>
+        <link rel="preconnect" href="https://fonts.googleapis.com" />
+        <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin />
+        <link
+            href="https://fonts.googleapis.com/css2?family=Playfair+Display:ital,wght@0,400;0,700;1,400&family=Source+Sans+Pro:wght@400;600&display=swap"
+            rel="stylesheet"
+        />
+        <link rel="stylesheet" href="{root}../styles.css" />
+    </head>
+    <body>
+{body}
+        <footer>
+            <div class="container">
+                <div class="footer-content">
+                    <p>
+                        <a href="{root}../index.html">cigarettecard.club</a> · All cards are from the NYPL
+                        Digital Collections and are in the public domain
+                    </p>
+                </div>
+            </div>
+        </footer>
+    </body>
+</html>
+"""
+
+    def _thumb_url(self, card, root):
+        if card['imageID'] in self.thumbs:
+            return f"{root}thumbs/{card['imageID']}.jpg"
+        return f"{self.image_base}/index.php?id={card['imageID']}&t=t"
+
+    def _grid(self, cards, root):
+        items = '\n'.join(f"""                    <a class="card-item" href="{root}cards/{card['uuid']}.html">
+                        <img src="{html.escape(self._thumb_url(card, root))}" alt="{html.escape(card['title'])}" loading="lazy" />
+                        <div class="caption">{html.escape(card['title'])}</div>
+                    </a>""" for card in reversed(cards))
+        return f"""                <div class="card-grid">
+{items}
+                </div>"""
+
+    def _hero(self, heading, subtitle):
+        return f"""                <div class="hero-content">
+                    <h1>{html.escape(heading)}</h1>
+                    <p>{html.escape(subtitle)}</p>
+                </div>"""
+
+    def _nav(self, links):
+        return '                <nav class="archive-nav">\n' + '\n'.join(
+            f'                    <a href="{href}">{html.escape(label)}</a>' for href, label in links if href
+        ) + '\n                </nav>'
+
+    def render_index(self):
+        newest = self.cards[-self.per_page:]
+        pages = ' '.join(f'<a href="page/{n}.html">{n}</a>' for n in range(1, self.page_count + 1))
+        body = f"""        <section class="hero">
+            <div class="container">
+{self._hero('The Archive', f"Every card sent so far: {len(self.cards)} and counting")}
+{self._grid(newest, '')}
+                <nav class="archive-nav archive-pages">All pages: {pages}</nav>
+            </div>
+        </section>"""
+        return self._layout('The Archive', body, '')
+
+    def render_page(self, number):
+        start = (number - 1) * self.per_page
+        cards = self.cards[start:start + self.per_page]
+        nav = self._nav([
+            (f"{number - 1}.html" if number > 1 else None, '← Older'),
+            ('../index.html', 'Latest'),
+            (f"{number + 1}.html" if number < self.page_count else None, 'Newer →'),
+        ])
+        body = f"""        <section class="hero">
+            <div class="container">
+{self._hero(f'Page {number}', f'Cards {start + 1} to {start + len(cards)}')}
+{self._grid(cards, '../')}
+{nav}
+            </div>
+        </section>"""
+        return self._layout(f'Page {number}', body, '../')
+
+    def render_card(self, index):
+        card = self.cards[index]
+        older = self.cards[index - 1] if index > 0 else None
+        newer = self.cards[index + 1] if index + 1 < len(self.cards) else None
+        title = html.escape(card['title'])
+        sent = f"Sent {card['sent']}" if card['sent'] else 'Sent before send dates were recorded'
+        collection = (f' · <a href="{NYPL_COLLECTION_URL.format(card["collection"])}">From this collection</a>'
+                      if card['collection'] else '')
+        nav = self._nav([
+            (f"{older['uuid']}.html" if older else None, f"← {older['title']}" if older else ''),
+            (f"../page/{self.page_of(index)}.html", f"Page {self.page_of(index)}"),
+            (f"{newer['uuid']}.html" if newer else None, f"{newer['title']} →" if newer else ''),
+        ])
+        body = f"""        <section class="hero">
+            <div class="container">
+{self._hero(card['title'], sent)}
+                <div class="card-detail">
+                    <img src="{self.image_base}/index.php?id={card['imageID']}&amp;t=w" alt="{title}" />
+                    <p>
+                        <a href="{NYPL_ITEM_URL.format(card['uuid'])}">View in the NYPL Digital Collections</a>{collection}
+                    </p>
+                </div>
+{nav}
+            </div>
+        </section>"""
+        return self._layout(card['title'], body, '../')
+
+    # --- Build ---
+    def build(self, full=False):
+        """Write whatever changed since the last build. Returns (card pages, index pages) written."""
+        rows = self.rows()
+        card_pages, pages = self.plan(rows, full)
+        if card_pages is None:
+            card_pages, pages = range(len(self.cards)), range(1, self.page_count + 1)
+            self._remove_stale()
+
+        for index in sorted(card_pages):
+            self._write(f"cards/{self.cards[index]['uuid']}.html", self.render_card(index))
+        for number in sorted(pages):
+            self._write(f"page/{number}.html", self.render_page(number))
+        if card_pages or pages or not (self.out_dir / 'index.html').exists():
+            self._write('index.html', self.render_index())
+        self._write('build.json', json.dumps({'settings': self.settings(), 'cards': rows,
+                                              'thumb_failures': sorted(self.thumb_failures)}))
+        return len(card_pages), len(pages)
+
+    def _remove_stale(self):
+        """Before a full build: drop card pages and page files the new build won't write."""
+        uuids = {card['uuid'] for card in self.cards}
+        for path in (self.out_dir / 'cards').glob('*.html'):
+            if path.stem not in uuids:
+                path.unlink()
+        for path in (self.out_dir / 'page').glob('*.html'):
+            if not path.stem.isdigit() or int(path.stem) > self.page_count:
+                path.unlink()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the static archive of posted cards.")
+    parser.add_argument('--out', default=os.getenv("ARCHIVE_DIR", "public/archive"))
+    parser.add_argument('--posted', default=os.getenv("POSTED_PATH", "posted_cards.json"))
+    parser.add_argument('--store', default=os.getenv("CARD_STORE_PATH", "cards.db"))
+    parser.add_argument('--image-base', default=os.getenv("NYPL_IMAGE_BASE", "https://images.nypl.org"))
+    parser.add_argument('--image-cache', default=os.getenv("IMAGE_CACHE_DIR", "image_cache"))
+    parser.add_argument('--per-page', type=int, default=PER_PAGE)
+    parser.add_argument('--workers', type=int, default=None, help="thumbnail processes (default: one per CPU)")
+    parser.add_argument('--io-workers', type=int, default=8, help="threads downloading missing source images")
+    parser.add_argument('--offline', action='store_true', help="only make thumbnails from images already cached")
+    parser.add_argument('--full', action='store_true',
+                        help="rewrite every page, not just the ones that changed, and retry failed thumbnails")
+    args = parser.parse_args()
+
+    if not Path(args.store).exists():
+        raise SystemExit(f"No card store at {args.store}: run download_metadata.py (or broadcast_card.py) first")
+
+    started = time.monotonic()
+    try:
+        with metrics.span('archive_load'):
+            cards = load_cards(PostedLedger(args.posted), CardStore(args.store))
+        builder = ArchiveBuilder(args.out, cards, args.image_base, args.per_page)
+        image_cache = ImageCache(args.image_cache, max_bytes=int(os.getenv("IMAGE_CACHE_MAX_MB", "512")) * 1024 * 1024,
+                                 image_base=args.image_base)
+        with metrics.span('archive_thumbnails'):
+            thumbnails = builder.build_thumbnails(image_cache, args.workers, args.io_workers, args.offline,
+                                                  retry_failures=args.full)
+        with metrics.span('archive_render'):
+            card_pages, pages = builder.build(args.full)
+        print(f"Archive of {len(cards)} cards in {args.out}: {card_pages} card pages, {pages} index pages and "
+              f"{thumbnails} thumbnails written in {time.monotonic() - started:.2f}s")
+    finally:
+        metrics.flush('archive')
@@ -0,0 +1,440 @@
+"""
+Compact SQLite card store compiled from harvested metadata.
+
+The harvester's JSON files carry every field NYPL returns; the daily job
+only needs uuid, imageID and title. Compiling them into an indexed store
+lets NYPLCardFetcher open the file lazily and read just the rows it uses.
+
+Unposted cards are kept in a dense `pool` table (slot 0..n-1), used like a
+swap-remove array: a random pick is one slot lookup, and retiring a card
+moves the last slot into the hole, so neither ever scans the catalogue.
+
+Titles and collections are also compiled into an inverted index: each key
+(a title word, or a facet such as "collection:<uuid>") has a dense list of
+postings (pos 0..n-1), so search() walks only the rarest key's postings.
+Each key also has its own swap-remove pool of unposted cards (`key_pool`),
+kept in step with `pool`, so random_matching() picks uniformly from a
+filtered set with one indexed lookup, however much of it has been posted.
+
+    python card_store.py metadata_all_collections.jsonl --out cards.db
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import sqlite3
+from pathlib import Path
+
+SCHEMA_VERSION = 5
+
+# Capture fields indexed as facets (exact match), besides the title words
+FACETS = ('collection',)
+# Random slots random_matching() samples before listing a multi-key query's matches
+MATCH_SAMPLE = 64
+
+SCHEMA = """
+CREATE TABLE cards (
+    id INTEGER PRIMARY KEY,
+    uuid TEXT NOT NULL UNIQUE,
+    image_id TEXT NOT NULL,
+    title TEXT NOT NULL,
+    collection TEXT
+);
+CREATE INDEX cards_image_id ON cards (image_id);
+CREATE TABLE pool (
+    slot INTEGER PRIMARY KEY,
+    card_id INTEGER NOT NULL UNIQUE REFERENCES cards (id)
+);
+CREATE TABLE terms (key TEXT PRIMARY KEY, count INTEGER NOT NULL) WITHOUT ROWID;
+CREATE TABLE postings (
+    key TEXT NOT NULL,
+    pos INTEGER NOT NULL,
+    card_id INTEGER NOT NULL,
+    PRIMARY KEY (key, pos)
+) WITHOUT ROWID;
+CREATE UNIQUE INDEX postings_card ON postings (key, card_id);
+CREATE TABLE key_pool (
+    key TEXT NOT NULL,
+    slot INTEGER NOT NULL,
+    card_id INTEGER NOT NULL,
+    PRIMARY KEY (key, slot)
+) WITHOUT ROWID;
+CREATE UNIQUE INDEX key_pool_card ON key_pool (card_id, key);
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def tokenize(text):
+    """Lower-case title words with a plural 's' dropped, so "Aeroplanes" and "aeroplane" match."""
+    words = re.findall(r'[a-z0-9]+', str(text).lower())
+    return [word[:-1] if len(word) > 3 and word.endswith('s') and not word.endswith('ss') else word for word in words]
+
+
+def index_keys(query='', **facets):
+    """Index keys a card must have to match: its title words plus "field:value" for each facet."""
+    unknown = set(facets) - set(FACETS)
+    if unknown:
+        raise ValueError(f"Unknown facet(s): {', '.join(sorted(unknown))} (known: {', '.join(FACETS)})")
+    keys = list(dict.fromkeys(tokenize(query)))
+    keys += [f"{field}:{value}" for field, value in facets.items() if value]
+    return keys
+
+
+def iter_captures(path):
+    """
+    Yield (capture, collection_uuid) from a metadata file in any of the
+    harvester's formats: JSONL (streamed), a single collection's JSON, or
+    the combined {collection_uuid: {...}} JSON.
+    """
+    path = Path(path)
+    if path.suffix == '.jsonl':
+        with path.open('r') as f:
+            for line in f:
+                if line.strip():
+                    capture = json.loads(line)
+                    yield capture, capture.get('collection')
+        return
+
+    with path.open('r') as f: data = json.load(f)
+    if 'nyplAPI' in data:
+        sections = [(None, data)]
+    else:
+        sections = data.items()
+    for collection_uuid, section in sections:
+        for capture in section.get('nyplAPI', {}).get('response', {}).get('capture', []):
+            yield capture, collection_uuid
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """SHA-256 of a file, read in chunks so memory stays flat however large it is."""
+    digest = hashlib.sha256()
+    with Path(path).open('rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def build_card_store(source_paths, store_path):
+    """Compile metadata files into a fresh store at store_path. Returns the card count."""
+    def captures():
+        for source_path in source_paths:
+            yield from iter_captures(source_path)
+
+    source_hashes = {str(p): file_hash(p) for p in source_paths}
+    return compile_cards(captures(), store_path, sources=[str(p) for p in source_paths], source_hashes=source_hashes)
+
+
+def compile_cards(captures, store_path, sources=(), source_hashes=None):
+    """Write (capture, collection_uuid) pairs into a fresh store at store_path. Returns the card count."""
+    store_path = Path(store_path)
+    tmp_path = store_path.with_name(store_path.name + '.tmp')
+    tmp_path.unlink(missing_ok=True)
+
+    def rows():
+        for card, collection_uuid in captures:
+            if (isinstance(card, dict) and
+                card.get('uuid') and
+                card.get('imageID') and
+                'title' in card):
+                yield card['uuid'], str(card['imageID']), card['title'], collection_uuid
+
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.executescript(SCHEMA)
+        conn.executemany("INSERT OR IGNORE INTO cards (uuid, image_id, title, collection) VALUES (?, ?, ?, ?)", rows())
+        # Every card starts in the pool; slots must be dense from 0
+        conn.execute("INSERT INTO pool (slot, card_id) SELECT ROW_NUMBER() OVER (ORDER BY id) - 1, id FROM cards")
+        _build_index(conn)
+        conn.execute("INSERT INTO meta VALUES ('sources', ?)", (json.dumps(list(sources)),))
+        conn.execute("INSERT INTO meta VALUES ('source_hashes', ?)", (json.dumps(source_hashes or {}),))
+        conn.execute("INSERT INTO meta VALUES ('schema_version', ?)", (str(SCHEMA_VERSION),))
+        conn.commit()
+        count = conn.execute("SELECT COUNT(*) FROM cards").fetchone()[0]
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+    os.replace(tmp_path, store_path)
+    return count
+
+
+def _build_index(conn, batch=10000):
+    """Fill terms/postings from the cards table, reading it in id-ordered batches."""
+    conn.execute("CREATE TEMP TABLE raw_postings (key TEXT NOT NULL, card_id INTEGER NOT NULL)")
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, title, collection FROM cards WHERE id > ? ORDER BY id LIMIT ?", (last_id, batch)
+        ).fetchall()
+        if not rows:
+            break
+        conn.executemany("INSERT INTO raw_postings VALUES (?, ?)", (
+            (key, card_id)
+            for card_id, title, collection in rows
+            for key in index_keys(title, collection=collection)
+        ))
+        last_id = rows[-1][0]
+
+    conn.execute(
+        "INSERT INTO postings (key, pos, card_id) "
+        "SELECT key, ROW_NUMBER() OVER (PARTITION BY key ORDER BY card_id) - 1, card_id FROM raw_postings"
+    )
+    conn.execute("INSERT INTO terms SELECT key, COUNT(*) FROM raw_postings GROUP BY key")
+    conn.execute("DROP TABLE raw_postings")
+    # Every card starts unposted, so each key's pool starts as a copy of its postings
+    conn.execute("INSERT INTO key_pool (key, slot, card_id) SELECT key, pos, card_id FROM postings")
+
+
+def store_is_stale(store_path, source_paths):
+    """
+    True if the store is missing, from an older schema, or built from
+    different source files. A source newer than the store is hashed and
+    compared with the hash recorded at build time, so a store restored
+    next to a fresh checkout of the same metadata (as in CI) stays valid.
+    """
+    store_path = Path(store_path)
+    if not store_path.exists():
+        return True
+    conn = sqlite3.connect(store_path)
+    try:
+        meta = dict(conn.execute("SELECT key, value FROM meta WHERE key IN ('schema_version', 'source_hashes')"))
+    except sqlite3.DatabaseError:
+        meta = {}
+    finally:
+        conn.close()
+    if int(meta.get('schema_version', 0)) != SCHEMA_VERSION:
+        return True
+    built = store_path.stat().st_mtime
+    newer = [Path(p) for p in source_paths if Path(p).exists() and Path(p).stat().st_mtime > built]
+    if not newer:
+        return False
+    recorded = json.loads(meta.get('source_hashes', '{}'))
+    if any(recorded.get(str(p)) != file_hash(p) for p in newer):
+        return True
+    os.utime(store_path)  # same content: skip the hashing next time
+    return False
+
+
+class CardStore:
+    """Read access to a compiled card store. The file is opened on first use."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._conn = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            if not self.path.exists():
+                raise FileNotFoundError(f"Card store not found: {self.path}")
+            self._conn = sqlite3.connect(self.path)
+            self._conn.row_factory = sqlite3.Row
+        return self._conn
+
+    def _card(self, row):
+        """Shape a row like the metadata capture it was compiled from."""
+        if row is None:
+            return None
+        return {'uuid': row['uuid'], 'imageID': row['image_id'], 'title': row['title'], 'collection': row['collection']}
+
+    def get(self, card_uuid):
+        """Return the card with this UUID, or None."""
+        row = self.conn.execute("SELECT * FROM cards WHERE uuid = ?", (card_uuid,)).fetchone()
+        return self._card(row)
+
+    def get_many(self, card_uuids, batch=500):
+        """Return {uuid: card} for the UUIDs that exist in the store."""
+        card_uuids = list(card_uuids)
+        cards = {}
+        for offset in range(0, len(card_uuids), batch):
+            chunk = card_uuids[offset:offset + batch]
+            rows = self.conn.execute(f"SELECT * FROM cards WHERE uuid IN ({','.join('?' * len(chunk))})", chunk)
+            cards.update((row['uuid'], self._card(row)) for row in rows)
+        return cards
+
+    def pool_size(self):
+        """Number of cards still in the pool (slots are dense, so this is max slot + 1)."""
+        return self.conn.execute("SELECT COALESCE(MAX(slot), -1) + 1 FROM pool").fetchone()[0]
+
+    def random_card(self):
+        """Return a random card from the pool, or None if it is empty."""
+        size = self.pool_size()
+        if not size:
+            return None
+        row = self.conn.execute(
+            "SELECT cards.* FROM pool JOIN cards ON cards.id = pool.card_id WHERE pool.slot = ?",
+            (random.randrange(size),),
+        ).fetchone()
+        return self._card(row)
+
+    def _key_counts(self, keys):
+        """Postings count per key, or None if any key matches no card at all."""
+        counts = dict(self.conn.execute(
+            f"SELECT key, count FROM terms WHERE key IN ({','.join('?' * len(keys))})", keys
+        ).fetchall())
+        return counts if len(counts) == len(keys) else None
+
+    @staticmethod
+    def _match_sql(others):
+        """Conditions requiring postings row p to also carry every key in others."""
+        return "".join(" AND EXISTS (SELECT 1 FROM postings o WHERE o.key = ? AND o.card_id = p.card_id)" for _ in others)
+
+    def search(self, query='', limit=20, **facets):
+        """
+        Cards whose title has every word in query and which match every facet
+        (e.g. collection=<uuid>), posted or not, in catalogue order.
+        """
+        keys = index_keys(query, **facets)
+        counts = self._key_counts(keys) if keys else None
+        if not counts:
+            return []
+        # Walk the rarest key's postings and check the others against the (key, card_id) index
+        driver = min(keys, key=counts.get)
+        others = [key for key in keys if key != driver]
+        rows = self.conn.execute(
+            "SELECT cards.* FROM postings p JOIN cards ON cards.id = p.card_id "
+            f"WHERE p.key = ?{self._match_sql(others)} ORDER BY p.pos LIMIT ?",
+            (driver, *others, limit),
+        )
+        return [self._card(row) for row in rows]
+
+    def facet_counts(self, field):
+        """{value: card count} for a facet, e.g. facet_counts('collection')."""
+        if field not in FACETS:
+            raise ValueError(f"Unknown facet: {field} (known: {', '.join(FACETS)})")
+        prefix = f"{field}:"
+        rows = self.conn.execute("SELECT key, count FROM terms WHERE key >= ? AND key < ?", (prefix, f"{field};"))
+        return {key[len(prefix):]: count for key, count in rows}
+
+    def key_pool_size(self, key):
+        """Number of unposted cards carrying an index key."""
+        return self.conn.execute("SELECT COALESCE(MAX(slot), -1) + 1 FROM key_pool WHERE key = ?", (key,)).fetchone()[0]
+
+    def random_matching(self, query='', **facets):
+        """
+        Return a uniformly random pool card matching query and facets (see
+        search()), or None if no unposted card matches. Samples MATCH_SAMPLE
+        random slots in the key pool of the rarest key and takes the first
+        one, in sampling order, that carries the other keys too. If none does,
+        the matches are listed from that key pool (unposted cards only) and
+        one is chosen from them.
+        """
+        keys = index_keys(query, **facets)
+        if not keys:
+            return self.random_card()
+        sizes = {key: self.key_pool_size(key) for key in keys}
+        driver = min(keys, key=sizes.get)
+        if not sizes[driver]:
+            return None
+        others = [key for key in keys if key != driver]
+        base = ("SELECT p.slot, cards.* FROM key_pool p JOIN cards ON cards.id = p.card_id "
+                f"WHERE p.key = ?{self._match_sql(others)}")
+
+        slots = [random.randrange(sizes[driver]) for _ in range(MATCH_SAMPLE if others else 1)]
+        matched = {row['slot']: row for row in self.conn.execute(
+            f"{base} AND p.slot IN ({','.join('?' * len(slots))})", (driver, *others, *slots))}
+        for slot in slots:
+            if slot in matched:
+                return self._card(matched[slot])
+        rows = self.conn.execute(base, (driver, *others)).fetchall()
+        return self._card(random.choice(rows)) if rows else None
+
+    def _retire(self, card_uuid):
+        row = self.conn.execute(
+            "SELECT pool.slot, cards.id FROM cards JOIN pool ON pool.card_id = cards.id WHERE cards.uuid = ?", (card_uuid,)
+        ).fetchone()
+        if row is None:
+            return False
+        slot, card_id = row
+        last_slot, last_card_id = self.conn.execute("SELECT slot, card_id FROM pool ORDER BY slot DESC LIMIT 1").fetchone()
+        self.conn.execute("DELETE FROM pool WHERE slot = ?", (last_slot,))
+        if slot != last_slot:
+            self.conn.execute("UPDATE pool SET card_id = ? WHERE slot = ?", (last_card_id, slot))
+
+        # Same swap-remove in the pool of every key the card carries
+        for key, slot in self.conn.execute("SELECT key, slot FROM key_pool WHERE card_id = ?", (card_id,)).fetchall():
+            last_slot, last_card_id = self.conn.execute(
+                "SELECT slot, card_id FROM key_pool WHERE key = ? ORDER BY slot DESC LIMIT 1", (key,)
+            ).fetchone()
+            self.conn.execute("DELETE FROM key_pool WHERE key = ? AND slot = ?", (key, last_slot))
+            if slot != last_slot:
+                self.conn.execute("UPDATE key_pool SET card_id = ? WHERE key = ? AND slot = ?", (last_card_id, key, slot))
+        return True
+
+    def retire(self, card_uuid):
+        """Remove a card from the pool (swap-remove). Returns False if it was not there."""
+        with self.conn:
+            return self._retire(card_uuid)
+
+    def retire_many(self, card_uuids):
+        """Remove several cards from the pool in one transaction. Returns how many were removed."""
+        with self.conn:
+            return sum(self._retire(card_uuid) for card_uuid in card_uuids)
+
+    def retire_invalid(self, validity_path):
+        """
+        Retire pool cards whose image the validity cache (see validate_cards.py)
+        marks missing or non-image. Cards whose image has not been checked yet
+        stay in the pool; they are probed when picked. Returns how many were retired.
+        """
+        self.conn.execute("ATTACH DATABASE ? AS validity", (str(validity_path),))
+        try:
+            card_uuids = [row[0] for row in self.conn.execute(
+                "SELECT cards.uuid FROM pool JOIN cards ON cards.id = pool.card_id "
+                "JOIN validity.images v ON v.image_id = cards.image_id WHERE v.status IN ('missing', 'non-image')"
+            )]
+        finally:
+            self.conn.execute("DETACH DATABASE validity")
+        return self.retire_many(card_uuids)
+
+    def retire_siblings(self, dedup_path, card_uuids, batch=500):
+        """
+        Retire pool cards whose image is in the same near-duplicate cluster
+        (see dedup_cards.py) as the image of any of card_uuids. Returns how
+        many were retired.
+        """
+        card_uuids = list(card_uuids)
+        siblings = set()
+        self.conn.execute("ATTACH DATABASE ? AS dedup", (str(dedup_path),))
+        try:
+            for offset in range(0, len(card_uuids), batch):
+                chunk = card_uuids[offset:offset + batch]
+                siblings.update(row[0] for row in self.conn.execute(
+                    "SELECT sibling.uuid FROM cards AS card "
+                    "JOIN dedup.clusters AS c1 ON c1.image_id = card.image_id "
+                    "JOIN dedup.clusters AS c2 ON c2.cluster = c1.cluster "
+                    "JOIN cards AS sibling ON sibling.image_id = c2.image_id "
+                    "JOIN pool ON pool.card_id = sibling.id "
+                    f"WHERE card.uuid IN ({','.join('?' * len(chunk))})", chunk
+                ))
+        finally:
+            self.conn.execute("DETACH DATABASE dedup")
+        return self.retire_many(siblings)
+
+    def get_meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, str(value)))
+
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM cards").fetchone()[0]
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile harvested metadata into a card store.")
+    parser.add_argument('sources', nargs='+', help="metadata .json or .jsonl files")
+    parser.add_argument('--out', default=os.getenv("CARD_STORE_PATH", "cards.db"))
+    args = parser.parse_args()
+
+    count = build_card_store(args.sources, args.out)
+    print(f"Compiled {count} cards into {args.out}")
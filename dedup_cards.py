@@ -0,0 +1,276 @@
+"""
+Find near-identical card images (front/back scans of the same card, reprints
+across sets) so subscribers don't get effectively the same card twice.
+
+Every distinct imageID's thumbnail is fetched through the image cache by a
+pool of I/O threads. A difference hash (64-bit dHash) of each one is then
+computed in a process pool, and the hashes are kept in a SQLite file
+(DEDUP_PATH, default card_dups.db), so later runs only hash new images.
+
+Near-duplicates are found with multi-index hashing rather than pairwise
+comparison. Each hash is split into max_distance + 1 chunks, and two hashes
+that differ in at most max_distance bits must agree exactly on at least one
+chunk. So only hashes sharing a chunk value are ever compared. Matching
+images are merged into clusters around a representative hash (see
+cluster_pairs), and the clusters are written back to the same file. NYPLCardFetcher then retires every sibling of a card
+once that card is posted or queued.
+
+Needs Pillow (in requirements.txt).
+
+    python dedup_cards.py --workers 8 --json duplicates.json
+"""
+import argparse
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+from card_store import CardStore
+from image_cache import ImageCache
+from image_probe import ImageProbeError
+# requests (and http_client and download_metadata, which import it) are imported by the hashing
+# functions that use them, so DuplicateClusters and the clustering helpers work without them
+
+HASH_SIZE = 8         # dHash grid: 8x8 comparisons -> 64-bit hash
+MAX_DISTANCE = 4      # bits two hashes may differ by and still count as the same card
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (image_id TEXT PRIMARY KEY, hash TEXT, checked_at REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS clusters (image_id TEXT PRIMARY KEY, cluster INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS clusters_cluster ON clusters (cluster);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+class DuplicateClusters:
+    """Persistent image hashes and the near-duplicate clusters computed from them."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._conn = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path)
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def hashed_ids(self):
+        return {row[0] for row in self.conn.execute("SELECT image_id FROM hashes")}
+
+    def record_hashes(self, results):
+        """Store (image_id, hash int or None) pairs; None marks an image that could not be decoded."""
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?)", (
+                (image_id, None if image_hash is None else f"{image_hash:016x}", time.time())
+                for image_id, image_hash in results
+            ))
+
+    def hashes(self):
+        """{image_id: hash int} for every image that was hashed successfully."""
+        return {image_id: int(image_hash, 16)
+                for image_id, image_hash in self.conn.execute("SELECT image_id, hash FROM hashes WHERE hash IS NOT NULL")}
+
+    def write_clusters(self, clusters):
+        """Replace the stored clusters with `clusters`, a list of image_id lists."""
+        with self.conn:
+            self.conn.execute("DELETE FROM clusters")
+            self.conn.executemany("INSERT INTO clusters VALUES (?, ?)", (
+                (image_id, number) for number, image_ids in enumerate(clusters) for image_id in image_ids
+            ))
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('generation', ?)", (str(self.generation + 1),))
+
+    @property
+    def generation(self):
+        """Bumped every time the clusters are rewritten."""
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        return int(row[0]) if row else 0
+
+    def clusters(self):
+        """List of image_id lists, one per cluster."""
+        grouped = {}
+        for image_id, number in self.conn.execute("SELECT image_id, cluster FROM clusters ORDER BY cluster"):
+            grouped.setdefault(number, []).append(image_id)
+        return list(grouped.values())
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def dhash(path, hash_size=HASH_SIZE):
+    """
+    Difference hash: shrink to (hash_size + 1) x hash_size greyscale and record
+    whether each pixel is brighter than its right-hand neighbour. Returns an
+    int, or None if the file cannot be decoded. Runs in worker processes.
+    """
+    from PIL import Image
+
+    try:
+        with Image.open(path) as image:
+            image.draft('L', (hash_size * 8, hash_size * 8))  # JPEG: let the decoder downscale for us
+            pixels = image.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS).tobytes()
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left, right = pixels[row * (hash_size + 1) + col], pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def near_duplicate_pairs(hashes, max_distance=MAX_DISTANCE):
+    """
+    Yield (image_id, image_id) pairs whose 64-bit hashes differ in at most
+    max_distance bits, using one exact-match index per hash chunk. A pair may
+    be yielded more than once.
+    """
+    by_hash = {}
+    for image_id, image_hash in hashes.items():
+        by_hash.setdefault(image_hash, []).append(image_id)
+    for image_ids in by_hash.values():
+        for other in image_ids[1:]:
+            yield image_ids[0], other
+
+    chunks = max_distance + 1
+    width = 64 // chunks
+    for chunk in range(chunks):
+        shift = chunk * width
+        mask = (1 << (width if chunk < chunks - 1 else 64 - shift)) - 1
+        buckets = {}
+        for image_hash in by_hash:
+            buckets.setdefault((image_hash >> shift) & mask, []).append(image_hash)
+        for bucket in buckets.values():
+            for i, a in enumerate(bucket):
+                for b in bucket[i + 1:]:
+                    if (a ^ b).bit_count() <= max_distance:
+                        yield by_hash[a][0], by_hash[b][0]
+
+
+def cluster_pairs(pairs, hashes, max_distance=MAX_DISTANCE):
+    """
+    Merge near-duplicate pairs into clusters, closest pairs first. Each cluster
+    keeps the hash of the image it started from as its representative and only
+    takes in images within max_distance bits of it, so a chain of small
+    differences (A~B~C~...) can't pull unrelated cards together: no two images
+    in a cluster differ by more than 2 x max_distance bits. Returns a list of
+    image_id lists, largest first.
+    """
+    def distance(a, b):
+        return (hashes[a] ^ hashes[b]).bit_count()
+
+    root = {}     # image_id -> its cluster's representative
+    members = {}  # representative -> image_ids in its cluster
+    for a, b in sorted(set(pairs), key=lambda pair: distance(*pair)):
+        root_a, root_b = root.get(a, a), root.get(b, b)
+        if root_a == root_b:
+            continue
+        group_a, group_b = members.get(root_a, [root_a]), members.get(root_b, [root_b])
+        if all(distance(root_a, image_id) <= max_distance for image_id in group_b):
+            keep, absorb = root_a, root_b
+        elif all(distance(root_b, image_id) <= max_distance for image_id in group_a):
+            keep, absorb = root_b, root_a
+        else:
+            continue
+        absorbed = members.pop(absorb, [absorb])
+        members[keep] = members.get(keep, [keep]) + absorbed
+        for image_id in absorbed:
+            root[image_id] = keep
+
+    return sorted((sorted(group) for group in members.values()), key=len, reverse=True)
+
+
+def fetch_thumbnail(image_cache, image_id):
+    """
+    Fetch one thumbnail into the image cache. Returns ('ok', path), ('non-image', None),
+    or ('error', None) for failures worth retrying on the next run.
+    """
+    import requests
+
+    try:
+        return 'ok', image_cache.fetch(image_id, 't')
+    except ImageProbeError:
+        return 'non-image', None
+    except requests.exceptions.RequestException as e:
+        print(f"Could not fetch thumbnail for {image_id}: {e}")
+        return 'error', None
+
+
+def hash_catalogue(store, dups, image_cache, workers=None, io_workers=16, rate=0.0, batch=500, rehash=False):
+    """
+    Hash every image in the store that has no recorded hash yet: thumbnails
+    are fetched by io_workers threads, then hashed by `workers` processes
+    (default: one per CPU). Returns the number of images hashed.
+    """
+    from download_metadata import TokenBucket
+    from http_client import HttpClient
+
+    # The rate limit applies to every attempt, retries included
+    image_cache.session = HttpClient(pool_size=io_workers, limiter=TokenBucket(rate))
+
+    done = set() if rehash else dups.hashed_ids()
+    todo = [row[0] for row in store.conn.execute("SELECT DISTINCT image_id FROM cards") if row[0] not in done]
+    print(f"{len(todo)} images to hash ({len(done)} already hashed)")
+
+    hashed = 0
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=io_workers) as threads, ProcessPoolExecutor(max_workers=workers) as processes:
+        for offset in range(0, len(todo), batch):
+            image_ids = todo[offset:offset + batch]
+            fetched = list(zip(image_ids, threads.map(lambda image_id: fetch_thumbnail(image_cache, image_id), image_ids)))
+            # Decode and hash on every core; non-images are recorded without a hash so they aren't fetched again
+            images = [(image_id, str(path)) for image_id, (status, path) in fetched if status == 'ok']
+            image_hashes = processes.map(dhash, [path for _, path in images], chunksize=16)
+            results = list(zip((image_id for image_id, _ in images), image_hashes))
+            results += [(image_id, None) for image_id, (status, _) in fetched if status == 'non-image']
+            dups.record_hashes(results)
+            hashed += len(results)
+            print(f"Hashed {hashed}/{len(todo)} images ({hashed / (time.monotonic() - started):.1f}/s)")
+    return hashed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hash every card image and cluster near-duplicates.")
+    parser.add_argument('--store', default=os.getenv("CARD_STORE_PATH", "cards.db"))
+    parser.add_argument('--dups', default=os.getenv("DEDUP_PATH", "card_dups.db"))
+    parser.add_argument('--image-base', default=os.getenv("NYPL_IMAGE_BASE", "https://images.nypl.org"))
+    parser.add_argument('--image-cache', default=os.getenv("IMAGE_CACHE_DIR", "image_cache"))
+    parser.add_argument('--workers', type=int, default=None, help="hashing processes (default: one per CPU)")
+    parser.add_argument('--io-workers', type=int, default=16, help="threads fetching thumbnails")
+    parser.add_argument('--rate', type=float, default=0.0, help="max thumbnail downloads per second (0 = unlimited)")
+    parser.add_argument('--max-distance', type=int, default=MAX_DISTANCE, help="max differing hash bits for a duplicate")
+    parser.add_argument('--rehash', action='store_true', help="hash images that already have a hash")
+    parser.add_argument('--json', help="also write the clusters, with card UUIDs and titles, to this file")
+    args = parser.parse_args()
+
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        raise SystemExit("dedup_cards.py needs Pillow: pip install Pillow")
+
+    store, dups = CardStore(args.store), DuplicateClusters(args.dups)
+    image_cache = ImageCache(args.image_cache, max_bytes=int(os.getenv("IMAGE_CACHE_MAX_MB", "512")) * 1024 * 1024,
+                             image_base=args.image_base)
+    hash_catalogue(store, dups, image_cache, args.workers, args.io_workers, args.rate, rehash=args.rehash)
+
+    started = time.monotonic()
+    hashes = dups.hashes()
+    clusters = cluster_pairs(near_duplicate_pairs(hashes, args.max_distance), hashes, args.max_distance)
+    dups.write_clusters(clusters)
+    print(f"Found {len(clusters)} duplicate clusters covering {sum(map(len, clusters))} of {len(hashes)} images "
+          f"in {time.monotonic() - started:.1f}s; saved to {args.dups}")
+
+    if args.json:
+        report = []
+        for image_ids in clusters:
+            cards = store.conn.execute(
+                f"SELECT uuid, image_id, title FROM cards WHERE image_id IN ({','.join('?' * len(image_ids))})", image_ids
+            ).fetchall()
+            report.append([{'uuid': uuid, 'imageID': image_id, 'title': title} for uuid, image_id, title in cards])
+        with open(args.json, 'w') as f: json.dump(report, f, indent=2)
+        print(f"Clusters written to {args.json}")
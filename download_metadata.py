@@ -2,167 +2,449 @@ import json
 import requests
 from pathlib import Path
 from dotenv import load_dotenv, find_dotenv
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import os
+import sys
+import threading
 import time
+from card_store import build_card_store
+from http_client import HttpClient, is_transient
+from metrics import metrics, profile
 
-def download_metadata():
-    # Load environment variables
-    dotenv_path = find_dotenv()
-    print(f"Loading .env from: {dotenv_path}")
-    load_dotenv(dotenv_path)
+NYPL_API_BASE = "https://api.repo.nypl.org/api/v2"
 
-    # Get token from environment
-    token = os.getenv("NYPL_TOKEN")
-    if not token:
-        raise ValueError("NYPL_TOKEN not found in .env file")
+COLLECTIONS = [
+    "b686cfd0-c52b-012f-c9e6-58d385a7bc34",  # ABC of Sports collection
+    "b2d37b40-c52d-012f-f8ec-58d385a7bc34",  # aeroplanes
+    "1615ed60-c52e-012f-6579-58d385a7bc34",  # subcollection 1
+    "53249090-c52e-012f-65dd-58d385a7bc34",  # subcollection 2
+    "66052980-c52e-012f-6d83-58d385a7bc34",  # subcollection 3
+    "70423dd0-c52e-012f-7733-58d385a7bc34",  # subcollection 4
+    "161d80e0-c52f-012f-c7a8-58d385a7bc34",  # subcollection 5
+    "4b853b70-c52f-012f-8f45-58d385a7bc34",  # subcollection 6
+    "6a3d3310-c52f-012f-5440-58d385a7bc34",  # subcollection 7
+    "949f5dd0-c52f-012f-ddb5-58d385a7bc34",  # subcollection 8
+    "b893ce70-c52f-012f-e3f5-58d385a7bc34",  # subcollection 9
+    "d3194c20-c52f-012f-afdd-58d385a7bc34",  # subcollection 10
+    "1b587dd0-c530-012f-90d8-58d385a7bc34",  # subcollection 11
+    "e79eb2f0-c52f-012f-457c-58d385a7bc34",  # subcollection 12
+    "dc5124e0-c530-012f-32bb-58d385a7bc34",  # subcollection 13
+    "462cc620-c531-012f-3e1e-58d385a7bc34",  # subcollection 14
+    "5ac13e00-c531-012f-bfa4-58d385a7bc34",  # subcollection 15
+    "dd0a2fe0-c531-012f-cfa6-58d385a7bc34",  # subcollection 16
+    "392972e0-c532-012f-5aa1-58d385a7bc34",  # subcollection 17
+    "97b79410-c536-012f-b383-58d385a7bc34",  # subcollection 18
+    "d2e1ded0-c538-012f-c313-58d385a7bc34",  # subcollection 19
+    "342d4e10-c53a-012f-fd64-58d385a7bc34",  # subcollection 20
+    "58ed9c40-c53b-012f-6ce6-58d385a7bc34",  # subcollection 21
+    "e8dbd7b0-c53d-012f-33ad-58d385a7bc34",  # subcollection 22
+    "8ee1f5e0-c540-012f-2b4a-58d385a7bc34",  # subcollection 23
+    "f810dc20-c540-012f-9860-58d385a7bc34",  # subcollection 24
+    "59ea7730-c541-012f-6b46-58d385a7bc34",  # subcollection 25
+    "c78c1e00-c541-012f-136c-58d385a7bc34",  # subcollection 26
+    "c91d85e0-c542-012f-d78f-58d385a7bc34",  # subcollection 27
+    "7e984420-c543-012f-faab-58d385a7bc34",  # subcollection 28
+    "8e6c5710-c546-012f-a0d9-58d385a7bc34",  # subcollection 29
+    "02335b50-c54b-012f-023e-58d385a7bc34",  # subcollection 30
+    "bbd87f50-c54f-012f-1287-58d385a7bc34",  # subcollection 31
+    "cdde0960-c54f-012f-7496-58d385a7bc34",  # subcollection 32
+    "e0b102e0-c54f-012f-b5c7-58d385a7bc34",  # subcollection 33
+    "f2c8f600-c54f-012f-21c0-58d385a7bc34",  # subcollection 34
+    "a77d95e0-c550-012f-22a4-58d385a7bc34",  # subcollection 35
+    "55b6ffe0-c552-012f-3cf9-58d385a7bc34",  # subcollection 36
+    "0e7fc620-c566-012f-9810-58d385a7bc34",  # subcollection 37
+    "14a20990-c566-012f-4d9d-58d385a7bc34",  # subcollection 38
+    "6f502ef0-c569-012f-b7a6-58d385a7bc34",  # subcollection 39
+    "c3b91e70-c569-012f-5457-58d385a7bc34",  # subcollection 40
+    "57089220-c56e-012f-5ac6-58d385a7bc34",  # subcollection 41
+    "0f260db0-c56f-012f-e9ba-58d385a7bc34",  # subcollection 42
+    "553c9d60-c56f-012f-bf7f-58d385a7bc34",  # subcollection 43
+    "13eabc60-c573-012f-f721-58d385a7bc34",  # subcollection 44
+    "79c06ed0-c5a0-012f-c9d7-58d385a7bc34",  # subcollection 45
+]
 
-    # API configuration
-    headers = {
-        'Authorization': f'Token token="{token}"'
-    }
-
-    collections = [
-        "b686cfd0-c52b-012f-c9e6-58d385a7bc34",  # ABC of Sports collection
-        "b2d37b40-c52d-012f-f8ec-58d385a7bc34",  # aeroplanes
-        "1615ed60-c52e-012f-6579-58d385a7bc34",  # subcollection 1
-        "53249090-c52e-012f-65dd-58d385a7bc34",  # subcollection 2
-        "66052980-c52e-012f-6d83-58d385a7bc34",  # subcollection 3
-        "70423dd0-c52e-012f-7733-58d385a7bc34",  # subcollection 4
-        "161d80e0-c52f-012f-c7a8-58d385a7bc34",  # subcollection 5
-        "4b853b70-c52f-012f-8f45-58d385a7bc34",  # subcollection 6
-        "6a3d3310-c52f-012f-5440-58d385a7bc34",  # subcollection 7
-        "949f5dd0-c52f-012f-ddb5-58d385a7bc34",  # subcollection 8
-        "b893ce70-c52f-012f-e3f5-58d385a7bc34",  # subcollection 9
-        "d3194c20-c52f-012f-afdd-58d385a7bc34",  # subcollection 10
-        "1b587dd0-c530-012f-90d8-58d385a7bc34",  # subcollection 11
-        "e79eb2f0-c52f-012f-457c-58d385a7bc34",  # subcollection 12
-        "dc5124e0-c530-012f-32bb-58d385a7bc34",  # subcollection 13
-        "462cc620-c531-012f-3e1e-58d385a7bc34",  # subcollection 14
-        "5ac13e00-c531-012f-bfa4-58d385a7bc34",  # subcollection 15
-        "dd0a2fe0-c531-012f-cfa6-58d385a7bc34",  # subcollection 16
-        "392972e0-c532-012f-5aa1-58d385a7bc34",  # subcollection 17
-        "97b79410-c536-012f-b383-58d385a7bc34",  # subcollection 18
-        "d2e1ded0-c538-012f-c313-58d385a7bc34",  # subcollection 19
-        "342d4e10-c53a-012f-fd64-58d385a7bc34",  # subcollection 20
-        "58ed9c40-c53b-012f-6ce6-58d385a7bc34",  # subcollection 21
-        "e8dbd7b0-c53d-012f-33ad-58d385a7bc34",  # subcollection 22
-        "8ee1f5e0-c540-012f-2b4a-58d385a7bc34",  # subcollection 23
-        "f810dc20-c540-012f-9860-58d385a7bc34",  # subcollection 24
-        "59ea7730-c541-012f-6b46-58d385a7bc34",  # subcollection 25
-        "c78c1e00-c541-012f-136c-58d385a7bc34",  # subcollection 26
-        "c91d85e0-c542-012f-d78f-58d385a7bc34",  # subcollection 27
-        "7e984420-c543-012f-faab-58d385a7bc34",  # subcollection 28
-        "8e6c5710-c546-012f-a0d9-58d385a7bc34",  # subcollection 29
-        "02335b50-c54b-012f-023e-58d385a7bc34",  # subcollection 30
-        "bbd87f50-c54f-012f-1287-58d385a7bc34",  # subcollection 31
-        "cdde0960-c54f-012f-7496-58d385a7bc34",  # subcollection 32
-        "e0b102e0-c54f-012f-b5c7-58d385a7bc34",  # subcollection 33
-        "f2c8f600-c54f-012f-21c0-58d385a7bc34",  # subcollection 34
-        "a77d95e0-c550-012f-22a4-58d385a7bc34",  # subcollection 35
-        "55b6ffe0-c552-012f-3cf9-58d385a7bc34",  # subcollection 36
-        "0e7fc620-c566-012f-9810-58d385a7bc34",  # subcollection 37
-        "14a20990-c566-012f-4d9d-58d385a7bc34",  # subcollection 38
-        "6f502ef0-c569-012f-b7a6-58d385a7bc34",  # subcollection 39
-        "c3b91e70-c569-012f-5457-58d385a7bc34",  # subcollection 40
-        "57089220-c56e-012f-5ac6-58d385a7bc34",  # subcollection 41
-        "0f260db0-c56f-012f-e9ba-58d385a7bc34",  # subcollection 42
-        "553c9d60-c56f-012f-bf7f-58d385a7bc34",  # subcollection 43
-        "13eabc60-c573-012f-f721-58d385a7bc34",  # subcollection 44
-        "79c06ed0-c5a0-012f-c9d7-58d385a7bc34",  # subcollection 45
-    ]
-
-    all_collections_data = {}
+# --- Rate Limiting ---
+class TokenBucket:
+    """Thread-safe token bucket shared by every harvester worker."""
 
-    for collection_uuid in collections:
-        print(f"\n{'='*60}")
-        print(f"Processing collection: {collection_uuid}")
-        print(f"{'='*60}")
+    def __init__(self, rate, capacity=1):
+        self.rate = float(rate)  # tokens per second, <= 0 disables limiting
+        self.capacity = float(capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
 
-        base_url = f"https://api.repo.nypl.org/api/v2/items/{collection_uuid}"
+    def acquire(self):
+        """Block until a token is available, then take it."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_for = (1 - self.tokens) / self.rate
+            time.sleep(wait_for)
 
-        all_items = []
-        page = 1
-        per_page = 50  # Adjust if needed
 
-        print("Downloading metadata...")
+# --- Collection Harvester ---
+class CollectionHarvester:
+    """Fetches collections and their pages in parallel over one pooled HttpClient."""
 
-        while True:
-            print(f"\nFetching page {page}...")
+    def __init__(self, token, api_base=NYPL_API_BASE, concurrency=8, rate=5.0, burst=1, per_page=50, page_retries=2):
+        self.api_base = api_base.rstrip('/')
+        self.concurrency = max(1, int(concurrency))
+        self.per_page = per_page
+        self.page_retries = page_retries  # times a page is requeued after the client's own retries run out
+        self.limiter = TokenBucket(rate, burst)
+
+        # One keep-alive pool sized to the worker count, shared by all threads; transient
+        # failures (timeouts, 429/5xx) are retried with backoff before a page counts as failed.
+        # Every attempt, retries included, takes a token from the shared limiter
+        self.session = HttpClient(pool_size=self.concurrency, headers={'Authorization': f'Token token="{token}"'},
+                                  limiter=self.limiter)
+
+    def fetch_page(self, collection_uuid, page, delay=0):
+        """Fetch one page of captures (after `delay` seconds), returning (items, total_pages, num_results)."""
+        if delay:
+            time.sleep(delay)
+        with metrics.span('page_fetch'):
+            response = self.session.get(
+                f"{self.api_base}/items/{collection_uuid}",
+                params={'page': page, 'per_page': self.per_page},
+                timeout=(self.session.timeout[0], 60),
+            )
+            response.raise_for_status()
+            data = response.json()
+
+        items = data['nyplAPI']['response']['capture']
+        total_pages = int(data['nyplAPI']['request'].get('totalPages', 1))
+        num_results = int(data['nyplAPI']['response'].get('numResults', 0))
+        return items or [], total_pages, num_results
+
+    def sync(self, collections, checkpoints):
+        """
+        Bring every collection's checkpoint up to date. Page 1 of each
+        collection is always requested first: its totalPages/numResults are
+        compared with the checkpoint to decide which of the remaining pages
+        need (re)fetching, and those are queued on the same worker pool.
+        Returns (changed, incomplete) sets of collection UUIDs.
+        """
+        changed, incomplete = set(), set()
+        requeued = {}
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            pending = {}
+            for collection_uuid in collections:
+                future = executor.submit(self.fetch_page, collection_uuid, 1)
+                pending[future] = (collection_uuid, 1)
 
-            # Make API request
-            params = {
-                'page': page,
-                'per_page': per_page
-            }
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collection_uuid, page = pending.pop(future)
+                    try:
+                        items, total_pages, num_results = future.result()
+                    except KeyError as e:
+                        print(f"Unexpected response structure for {collection_uuid} page {page}. KeyError: {e}")
+                        metrics.count('page_failures')
+                        incomplete.add(collection_uuid)
+                        continue
+                    except (requests.exceptions.RequestException, ValueError) as e:
+                        if is_transient(e) and requeued.get((collection_uuid, page), 0) < self.page_retries:
+                            # Still failing after the client's retries: give the host a breather and try again
+                            requeued[(collection_uuid, page)] = requeued.get((collection_uuid, page), 0) + 1
+                            print(f"Collection {collection_uuid} page {page} failed ({e}); "
+                                  f"requeued in {self.session.reset_after:g}s")
+                            metrics.count('pages_requeued')
+                            future = executor.submit(self.fetch_page, collection_uuid, page, self.session.reset_after)
+                            pending[future] = (collection_uuid, page)
+                            continue
+                        print(f"Request failed for collection {collection_uuid} page {page}: {e}")
+                        metrics.count('page_failures')
+                        incomplete.add(collection_uuid)
+                        continue
 
+                    if page == 1:
+                        todo = checkpoints.plan(collection_uuid, total_pages, num_results, self.per_page)
+                        if todo or collection_uuid in checkpoints.moved:
+                            changed.add(collection_uuid)
+                            print(f"Collection {collection_uuid}: {len(todo)} of {total_pages} pages to fetch")
+                        for next_page in todo:
+                            future = executor.submit(self.fetch_page, collection_uuid, next_page)
+                            pending[future] = (collection_uuid, next_page)
+
+                    checkpoints.write_page(collection_uuid, page, items)
+                    metrics.count('pages_fetched')
+                    metrics.count('captures_fetched', len(items))
+
+        for collection_uuid in collections:
+            if not checkpoints.is_complete(collection_uuid):
+                incomplete.add(collection_uuid)
+        return changed, incomplete
+
+
+# --- Checkpoints ---
+class HarvestCheckpoints:
+    """
+    Per-collection page checkpoints on disk:
+      <root>/<collection_uuid>/state.json      totals seen and pages finished
+      <root>/<collection_uuid>/page_00001.jsonl captures for one page, one per line
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.states = {}
+        self.moved = set()  # collections whose totals differ from the last sync
+
+    def _dir(self, collection_uuid):
+        return self.root / collection_uuid
+
+    def _page_path(self, collection_uuid, page):
+        return self._dir(collection_uuid) / f"page_{page:05d}.jsonl"
+
+    def _write_atomic(self, path, data):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(path.suffix + '.tmp')
+        with tmp_path.open('w') as f: json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def _page_files(self, collection_uuid):
+        return self._dir(collection_uuid).glob('page_*.json*')
+
+    def load_state(self, collection_uuid):
+        """Load a collection's checkpoint state ({} if it has never been fetched)."""
+        if collection_uuid not in self.states:
             try:
-                response = requests.get(base_url, headers=headers, params=params)
-                response.raise_for_status()
-                data = response.json()
-
-                # Extract items from response
-                items = data['nyplAPI']['response']['capture']
-                if not items:
-                    print("No more items found.")
-                    break
-
-                print(f"Found {len(items)} items on this page")
-                all_items.extend(items)
-                print(f"Total items so far: {len(all_items)}")
-
-                # Check if we've reached the total number of pages
-                total_pages = int(data['nyplAPI']['request'].get('totalPages', 1))
-                if page >= total_pages:
-                    print(f"Reached last page ({total_pages})")
-                    break
-
-                page += 1
-                time.sleep(1)  # Be nice to the API
-
-            except KeyError as e:
-                print(f"Unexpected response structure. KeyError: {e}")
-                print("Full response:", json.dumps(data, indent=2))
-                break
-            except requests.exceptions.RequestException as e:
-                print(f"Request failed for collection {collection_uuid}: {e}")
-                break
-
-        # Store data for this collection
-        if all_items:
-            all_collections_data[collection_uuid] = {
-                "nyplAPI": {
-                    "response": {
-                        "capture": all_items
-                    }
-                }
-            }
-            print(f"Collection {collection_uuid}: {len(all_items)} items downloaded")
+                with (self._dir(collection_uuid) / 'state.json').open('r') as f:
+                    self.states[collection_uuid] = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                self.states[collection_uuid] = {}
+        return self.states[collection_uuid]
+
+    def save_state(self, collection_uuid):
+        self._write_atomic(self._dir(collection_uuid) / 'state.json', self.states[collection_uuid])
+
+    def reset(self, collection_uuid):
+        """Forget every finished page so the collection is fetched from scratch."""
+        self.states[collection_uuid] = {}
+        self.save_state(collection_uuid)  # before the pages go, so a crash never leaves state pointing at missing files
+        for path in self._page_files(collection_uuid):
+            path.unlink()
+
+    def is_complete(self, collection_uuid):
+        state = self.load_state(collection_uuid)
+        return bool(state) and len(state.get('pages', [])) >= state.get('total_pages', 1)
+
+    def plan(self, collection_uuid, total_pages, num_results, per_page):
+        """
+        Record the totals just reported by page 1 and return the other pages
+        that still need fetching. Finished pages are kept when nothing moved;
+        growth invalidates the old last page onwards, and any shrinkage (or a
+        different page size) invalidates everything since items will have shifted.
+        """
+        state = self.load_state(collection_uuid)
+        old_pages = state.get('total_pages', 0)
+        old_results = state.get('num_results', 0)
+        finished = set(state.get('pages', []))
+
+        if (state.get('per_page') != per_page or state.get('format') != 'jsonl'
+                or total_pages < old_pages or num_results < old_results):
+            finished = set()
+        elif total_pages > old_pages or num_results > old_results:
+            finished = {page for page in finished if page < old_pages}
+
+        for path in self._page_files(collection_uuid):
+            if path.suffix != '.jsonl' or int(path.stem.split('_')[1]) > total_pages:
+                path.unlink()
+
+        if (total_pages, num_results) != (old_pages, old_results):
+            self.moved.add(collection_uuid)
+
+        self.states[collection_uuid] = {
+            'format': 'jsonl',
+            'per_page': per_page,
+            'total_pages': total_pages,
+            'num_results': num_results,
+            'pages': sorted(finished - {1}),
+        }
+        self.save_state(collection_uuid)
+        return [page for page in range(2, total_pages + 1) if page not in finished]
+
+    def write_page(self, collection_uuid, page, items):
+        """Checkpoint one fetched page and mark it finished."""
+        path = self._page_path(collection_uuid, page)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix('.tmp')
+        with tmp_path.open('w') as f:
+            for item in items:
+                f.write(json.dumps(item) + '\n')
+        os.replace(tmp_path, path)
+        state = self.load_state(collection_uuid)
+        state['pages'] = sorted(set(state.get('pages', [])) | {page})
+        self.save_state(collection_uuid)
+
+    def iter_lines(self, collection_uuid):
+        """Yield a collection's checkpointed captures as raw JSON lines, in page order."""
+        for page in self.load_state(collection_uuid).get('pages', []):
+            with self._page_path(collection_uuid, page).open('r') as f:
+                for line in f:
+                    line = line.rstrip('\n')
+                    if line: yield line
+
+
+# --- Streaming Output ---
+class AtomicWriter:
+    """Write a file via a temporary sibling and move it into place on success."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.tmp_path = self.path.with_name(self.path.name + '.tmp')
+
+    def __enter__(self):
+        self.file = self.tmp_path.open('w')
+        return self.file
+
+    def __exit__(self, exc_type, exc, tb):
+        self.file.close()
+        if exc_type is None:
+            os.replace(self.tmp_path, self.path)
         else:
-            print(f"No items downloaded for collection {collection_uuid}")
-
-    # Save all collections data
-    if all_collections_data:
-        # Save individual collection files
-        for collection_uuid, metadata in all_collections_data.items():
-            output_path = Path(f"metadata_{collection_uuid}.json")
-            with open(output_path, 'w') as f:
-                json.dump(metadata, f, indent=2)
+            self.tmp_path.unlink(missing_ok=True)
+
+
+def write_capture_array(f, lines):
+    """Stream raw JSON capture lines into f as the body of a JSON array. Returns the count."""
+    count = 0
+    for line in lines:
+        f.write(',\n' if count else '\n')
+        f.write(line)
+        count += 1
+    f.write('\n')
+    return count
+
+
+def write_outputs(checkpoints, collections, changed, combined_path, jsonl_path):
+    """
+    Assemble the per-collection files, the combined JSON file and a combined
+    JSONL file (one capture per line, tagged with its collection) straight
+    from the checkpoint chunks, one line at a time.
+    Returns {collection_uuid: item_count} for collections with items.
+    """
+    counts = {}
+
+    # Individual collection files (only those that changed this run)
+    for collection_uuid in collections:
+        output_path = Path(f"metadata_{collection_uuid}.json")
+        if collection_uuid not in changed and output_path.exists():
+            continue
+        with AtomicWriter(output_path) as f:
+            f.write('{"nyplAPI": {"response": {"capture": [')
+            count = write_capture_array(f, checkpoints.iter_lines(collection_uuid))
+            f.write(']}}}\n')
+        if count:
             print(f"Collection {collection_uuid} saved to: {output_path}")
 
-        # Save combined file
-        combined_output_path = Path("metadata_all_collections.json")
-        with open(combined_output_path, 'w') as f:
-            json.dump(all_collections_data, f, indent=2)
+    # Combined files
+    with AtomicWriter(combined_path) as combined, AtomicWriter(jsonl_path) as jsonl:
+        combined.write('{')
+        for collection_uuid in collections:
+            lines = _tagged_lines(checkpoints.iter_lines(collection_uuid), collection_uuid, jsonl)
+            first = next(lines, None)
+            if first is None:
+                print(f"No items downloaded for collection {collection_uuid}")
+                continue
+            combined.write(',\n' if counts else '\n')
+            combined.write(f'{json.dumps(collection_uuid)}: {{"nyplAPI": {{"response": {{"capture": [')
+            counts[collection_uuid] = write_capture_array(combined, _prepend(first, lines))
+            combined.write(']}}}')
+        combined.write('\n}\n')
+
+    return counts
+
+
+def _tagged_lines(lines, collection_uuid, jsonl):
+    """Pass raw capture lines through, copying each to jsonl tagged with its collection."""
+    for line in lines:
+        item = json.loads(line)
+        item['collection'] = collection_uuid
+        jsonl.write(json.dumps(item) + '\n')
+        yield line
+
+
+def _prepend(first, rest):
+    yield first
+    yield from rest
 
+
+def download_metadata():
+    # Load environment variables
+    dotenv_path = find_dotenv()
+    print(f"Loading .env from: {dotenv_path}")
+    load_dotenv(dotenv_path)
+
+    # Get token from environment
+    token = os.getenv("NYPL_TOKEN")
+    if not token:
+        raise ValueError("NYPL_TOKEN not found in .env file")
+
+    # Harvester configuration (NYPL_API_BASE can point at stub_servers.py)
+    harvester = CollectionHarvester(
+        token,
+        api_base=os.getenv("NYPL_API_BASE", NYPL_API_BASE),
+        concurrency=int(os.getenv("HARVEST_CONCURRENCY", "8")),
+        rate=float(os.getenv("HARVEST_RATE", "5")),  # requests per second across all workers
+        burst=int(os.getenv("HARVEST_BURST", "1")),
+    )
+    checkpoints = HarvestCheckpoints(os.getenv("HARVEST_CHECKPOINT_DIR", "metadata_checkpoints"))
+    if os.getenv("HARVEST_FULL"):
+        print("HARVEST_FULL set: discarding checkpoints and re-fetching everything.")
+        for collection_uuid in COLLECTIONS:
+            checkpoints.reset(collection_uuid)
+
+    print(f"Syncing metadata for {len(COLLECTIONS)} collections "
+          f"({harvester.concurrency} workers, {harvester.limiter.rate:g} req/s)...")
+    started = time.monotonic()
+    with metrics.span('harvest'):
+        changed, incomplete = harvester.sync(COLLECTIONS, checkpoints)
+
+    combined_output_path = Path("metadata_all_collections.json")
+    jsonl_output_path = Path("metadata_all_collections.jsonl")
+    if not changed and combined_output_path.exists() and jsonl_output_path.exists():
+        print(f"\nNo collections changed since the last sync ({time.monotonic() - started:.1f}s).")
+        return not incomplete
+
+    # Save all collections data, streamed from the checkpoints
+    with metrics.span('write_outputs'):
+        counts = write_outputs(checkpoints, COLLECTIONS, changed, combined_output_path, jsonl_output_path)
+    if counts:
         print(f"\n{'='*60}")
-        print("Download complete!")
-        print(f"Total collections processed: {len(all_collections_data)}")
-        total_items = sum(len(data['nyplAPI']['response']['capture']) for data in all_collections_data.values())
-        print(f"Total items downloaded: {total_items}")
-        print(f"Combined metadata saved to: {combined_output_path}")
+        print(f"Sync complete in {time.monotonic() - started:.1f}s!")
+        print(f"Total collections processed: {len(counts)} ({len(changed)} changed)")
+        print(f"Total items downloaded: {sum(counts.values())}")
+        print(f"Combined metadata saved to: {combined_output_path} and {jsonl_output_path}")
         print(f"Individual collection files also saved.")
+
+        store_path = os.getenv("CARD_STORE_PATH", "cards.db")
+        with metrics.span('store_build'):
+            card_count = build_card_store([jsonl_output_path], store_path)
+        print(f"Card store with {card_count} cards compiled to: {store_path}")
     else:
         print("No items were downloaded from any collection. Please check the API response structure.")
 
+    if incomplete:
+        print(f"\nWarning: {len(incomplete)} collection(s) are incomplete; run again to resume from the last finished page:")
+        for collection_uuid in sorted(incomplete):
+            print(f"  {collection_uuid}")
+    return not incomplete
+
 if __name__ == "__main__":
-    download_metadata()
+    try:
+        with profile():
+            ok = download_metadata()
+    finally:
+        metrics.flush('harvest')
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,260 @@
+"""
+One HTTP layer for every outbound call: NYPL API paging, image probes and
+downloads, and Resend.
+
+HttpClient can stand in anywhere a requests.Session is used (get, post,
+request, headers). Each request is retried when the failure is transient:
+  - connection errors and timeouts
+  - 408, 425, 429, 500, 502, 503 and 504 responses
+
+The wait is exponential backoff with jitter, or the server's Retry-After if
+that is longer. Other failures are permanent and come back on the first try:
+  - 4xx responses, returned for the caller's raise_for_status()
+  - invalid URLs
+
+A POST is retried only when the server cannot have acted on it. That means
+the connection never opened, or the answer was 429 or 503. Retries can
+therefore never create a second broadcast.
+
+Each host gets its own connection pool and circuit breaker. After
+`failure_threshold` consecutive transient failures, the breaker fails calls
+to that host immediately for `reset_after` seconds. It then lets one trial
+request through. A dead upstream therefore costs a few connect timeouts,
+not a full round of retries for every card. Retries, breaker trips and
+give-ups are counted in metrics.
+
+An optional `limiter` (anything with acquire(), such as the harvester's
+TokenBucket) is acquired before every attempt, retries included. A caller's
+request budget therefore holds even while an upstream is failing.
+
+Defaults come from HTTP_RETRIES, HTTP_CONNECT_TIMEOUT and HTTP_READ_TIMEOUT.
+"""
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+from metrics import metrics
+
+TRANSIENT_STATUS = {408, 425, 429, 500, 502, 503, 504}
+# Statuses that mean the request was turned away before it was processed
+NOT_PROCESSED_STATUS = {429, 503}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """The host's circuit breaker is open: it has been failing, so the request wasn't attempted."""
+
+
+def backoff_delay(attempt, base=0.5, cap=30.0):
+    """Seconds to wait before retry `attempt` (1-based): exponential, capped, with jitter in its upper half."""
+    delay = min(cap, base * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def retry_after(response):
+    """Seconds the server asked us to wait (Retry-After as seconds or an HTTP date), or None."""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_transient(error):
+    """
+    Whether an exception (or anything in its cause chain) is worth retrying
+    later: a network failure, a timeout or a transient status. Handles
+    requests exceptions and Resend SDK errors, which carry the HTTP status
+    in .code.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                              requests.exceptions.ChunkedEncodingError)):
+            return True
+        if isinstance(error, requests.exceptions.HTTPError):
+            return error.response is not None and error.response.status_code in TRANSIENT_STATUS
+        code = getattr(error, 'code', None)
+        error_type = getattr(error, 'error_type', None)
+        # Resend wraps failures of its HTTP client as HttpClientError; the real error is the context
+        if error_type is not None and error_type != 'HttpClientError':
+            return str(code).isdigit() and int(code) in TRANSIENT_STATUS and 'quota' not in error_type
+        error = error.__cause__ or error.__context__
+    return False
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker for one host; thread-safe."""
+
+    def __init__(self, host, failure_threshold=10, reset_after=15.0):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """True if a request may go out now. Once reset_after has passed, one trial request is let through."""
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_after:
+                self.opened_at = time.monotonic()  # hold everyone else back until the trial reports
+                return True
+            return False
+
+    def record(self, ok):
+        with self.lock:
+            if ok:
+                self.failures, self.opened_at = 0, None
+                return
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    print(f"Circuit open for {self.host} after {self.failures} consecutive failures")
+                    metrics.count('http_circuit_opened')
+                self.opened_at = time.monotonic()
+
+
+class HttpClient:
+    """requests.Session stand-in with retries, backoff, per-host connection pools and circuit breakers."""
+
+    def __init__(self, retries=None, backoff=0.5, max_backoff=30.0, max_retry_after=120.0, timeout=None,
+                 pool_size=10, failure_threshold=10, reset_after=15.0, headers=None, limiter=None):
+        self.retries = int(os.getenv("HTTP_RETRIES", "4")) if retries is None else retries
+        self.timeout = timeout or (float(os.getenv("HTTP_CONNECT_TIMEOUT", "5")),
+                                   float(os.getenv("HTTP_READ_TIMEOUT", "30")))
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.limiter = limiter
+        self.breakers = {}
+        self.lock = threading.Lock()
+
+        # urllib3 keeps one pool per host (up to pool_connections hosts), each holding pool_size keep-alive connections
+        self.session = metrics.instrument(requests.Session())
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        if headers:
+            self.session.headers.update(headers)
+
+    @property
+    def headers(self):
+        return self.session.headers
+
+    def breaker(self, url):
+        host = urlsplit(url).netloc
+        with self.lock:
+            if host not in self.breakers:
+                self.breakers[host] = CircuitBreaker(host, self.failure_threshold, self.reset_after)
+            return self.breakers[host]
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request, retrying transient failures. Returns the response,
+        which may still be an error status: either a permanent one, or a
+        transient one that outlasted the retries. Raises a
+        requests.exceptions.RequestException if no response arrived at all.
+        """
+        method = method.upper()
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        idempotent = method in IDEMPOTENT_METHODS
+        breaker = self.breaker(url)
+
+        for attempt in range(1, self.retries + 2):
+            last_try = attempt > self.retries
+            if not breaker.allow():
+                metrics.count('http_circuit_rejected')
+                raise CircuitOpenError(f"Circuit open for {breaker.host}: not calling {method} {url}")
+            if self.limiter is not None:
+                self.limiter.acquire()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                transient = is_transient(e)
+                if transient:
+                    breaker.record(False)
+                # A refused or timed-out connect never reached the server, so even a POST can be retried
+                retryable = transient and (idempotent or isinstance(e, requests.exceptions.ConnectTimeout)
+                                           or _never_connected(e))
+                if not retryable or last_try:
+                    if retryable:
+                        metrics.count('http_gave_up')
+                    raise
+                delay, reason = backoff_delay(attempt, self.backoff, self.max_backoff), type(e).__name__
+            else:
+                status = response.status_code
+                if status not in TRANSIENT_STATUS:
+                    breaker.record(True)
+                    return response
+                if status != 429:  # throttling means the host is up
+                    breaker.record(False)
+                wait_for = retry_after(response)
+                if (not idempotent and status not in NOT_PROCESSED_STATUS) or last_try \
+                        or (wait_for or 0) > self.max_retry_after:
+                    metrics.count('http_gave_up')
+                    return response
+                response.close()
+                delay, reason = max(wait_for or 0, backoff_delay(attempt, self.backoff, self.max_backoff)), status
+
+            metrics.count('http_retries')
+            print(f"{method} {url} failed ({reason}); retry {attempt} of {self.retries} in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def _never_connected(error):
+    """True if a ConnectionError happened while opening the connection (nothing was sent)."""
+    reason = error.args[0] if error.args else None
+    reason = getattr(reason, 'reason', reason)  # MaxRetryError wraps the underlying urllib3 error
+    return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+
+class ResendTransport:
+    """Plugs an HttpClient into the Resend SDK (resend.default_http_client), whose own client never retries."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def request(self, method, url, headers, json=None, files=None, data=None):
+        if files is not None:
+            response = self.client.request(method, url, headers=headers, files=files, data=data)
+        else:
+            response = self.client.request(method, url, headers=headers, json=json if data is None else None, data=data)
+        return response.content, response.status_code, response.headers
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_client():
+    """The process-wide HttpClient, so every caller shares its pools and breakers."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = HttpClient()
+        return _shared
@@ -0,0 +1,208 @@
+"""
+Content-addressed on-disk cache of NYPL image derivatives.
+
+Entries are keyed by (imageID, derivative size), e.g. ('1234567', 'w') for
+the large image or 't' for a thumbnail, and point at blobs stored under the
+SHA-256 of their bytes, so identical images are kept once:
+
+  image_cache/index.db                 entries + blob sizes (SQLite)
+  image_cache/objects/ab/abcdef...     image bytes
+
+Fresh entries (younger than max_age) are served without touching the
+network; stale ones are revalidated with If-None-Match / If-Modified-Since.
+When the blobs exceed max_bytes the least recently used entries are evicted
+(never the one just stored, so a single image larger than the budget is
+still returned). A blob is deleted as soon as no entry points at it.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from image_probe import sniff_image, ImageProbeError
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    image_id TEXT NOT NULL,
+    size TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at REAL NOT NULL,
+    last_access REAL NOT NULL,
+    PRIMARY KEY (image_id, size)
+);
+CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access);
+CREATE INDEX IF NOT EXISTS entries_digest ON entries (digest);
+CREATE TABLE IF NOT EXISTS objects (digest TEXT PRIMARY KEY, bytes INTEGER NOT NULL);
+"""
+
+
+class ImageCache:
+    """Shared by the send path and batch tools; safe to use from worker threads."""
+
+    def __init__(self, root='image_cache', max_bytes=512 * 1024 * 1024, max_age=7 * 24 * 3600,
+                 image_base='https://images.nypl.org', session=None):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.image_base = image_base.rstrip('/')
+        self._session = session
+        self.lock = threading.Lock()
+        self._conn = None
+
+    @property
+    def session(self):
+        # Resolved on first download, so peek-only users never import requests
+        if self._session is None:
+            from http_client import shared_client
+            self._session = shared_client()
+        return self._session
+
+    @session.setter
+    def session(self, session):
+        self._session = session
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            (self.root / 'objects').mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.root / 'index.db', check_same_thread=False)
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def _blob_path(self, digest):
+        return self.root / 'objects' / digest[:2] / digest
+
+    def url(self, image_id, size='w'):
+        return f"{self.image_base}/index.php?id={image_id}&t={size}"
+
+    def peek(self, image_id, size='w'):
+        """Path of the cached image if present (fresh or not), without any network I/O."""
+        if self._conn is None and not (self.root / 'index.db').exists():
+            return None
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT digest FROM entries WHERE image_id = ? AND size = ?", (str(image_id), size)
+            ).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                "UPDATE entries SET last_access = ? WHERE image_id = ? AND size = ?", (time.time(), str(image_id), size)
+            )
+            self.conn.commit()
+        path = self._blob_path(row[0])
+        return path if path.exists() else None
+
+    def fetch(self, image_id, size='w', timeout=None):
+        """
+        Return the path to the cached image, downloading or revalidating it as
+        needed. Raises ImageProbeError if the server does not return an image.
+        """
+        image_id = str(image_id)
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT digest, etag, last_modified, fetched_at FROM entries WHERE image_id = ? AND size = ?",
+                (image_id, size),
+            ).fetchone()
+
+        headers = {}
+        if row is not None:
+            digest, etag, last_modified, fetched_at = row
+            if time.time() - fetched_at < self.max_age and self._blob_path(digest).exists():
+                self._touch(image_id, size)
+                return self._blob_path(digest)
+            if self._blob_path(digest).exists():
+                if etag: headers['If-None-Match'] = etag
+                if last_modified: headers['If-Modified-Since'] = last_modified
+
+        response = self.session.get(self.url(image_id, size), headers=headers, timeout=timeout)
+        if response.status_code == 304 and row is not None:
+            with self.lock:
+                updated = self.conn.execute(
+                    "UPDATE entries SET fetched_at = ?, last_access = ? WHERE image_id = ? AND size = ?",
+                    (time.time(), time.time(), image_id, size),
+                ).rowcount
+                self.conn.commit()
+            if updated and self._blob_path(row[0]).exists():
+                return self._blob_path(row[0])
+            # Evicted by another thread while we revalidated: download it again
+            response = self.session.get(self.url(image_id, size), timeout=timeout)
+        response.raise_for_status()
+
+        data = response.content
+        if not sniff_image(data):
+            raise ImageProbeError(f"Image {image_id} ({size}) is not a JPEG, PNG or GIF. "
+                                  f"Content-Type: {response.headers.get('Content-Type', '')}")
+        return self._store(image_id, size, data, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+
+    def _store(self, image_id, size, data, etag, last_modified):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+        now = time.time()
+        with self.lock:
+            # Written under the lock: another thread's eviction may have just unlinked this digest
+            if not path.exists():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = path.with_name(f"{digest}.{threading.get_ident()}.tmp")
+                tmp_path.write_bytes(data)
+                os.replace(tmp_path, path)
+            previous = self.conn.execute(
+                "SELECT digest FROM entries WHERE image_id = ? AND size = ?", (image_id, size)
+            ).fetchone()
+            self.conn.execute("INSERT OR IGNORE INTO objects VALUES (?, ?)", (digest, len(data)))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (image_id, size, digest, etag, last_modified, now, now),
+            )
+            # A revalidation that brought new bytes leaves the old blob behind
+            if previous is not None and previous[0] != digest:
+                self._drop_if_orphaned(previous[0])
+            self._evict(keep=(image_id, size))
+            self.conn.commit()
+        return path
+
+    def _touch(self, image_id, size):
+        with self.lock:
+            self.conn.execute(
+                "UPDATE entries SET last_access = ? WHERE image_id = ? AND size = ?", (time.time(), image_id, size)
+            )
+            self.conn.commit()
+
+    def total_bytes(self):
+        with self.lock:
+            return self.conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM objects").fetchone()[0]
+
+    def _drop_if_orphaned(self, digest):
+        """Delete a blob no entry points at any more. Returns the bytes freed. Caller holds the lock."""
+        if self.conn.execute("SELECT 1 FROM entries WHERE digest = ? LIMIT 1", (digest,)).fetchone() is not None:
+            return 0
+        row = self.conn.execute("SELECT bytes FROM objects WHERE digest = ?", (digest,)).fetchone()
+        self.conn.execute("DELETE FROM objects WHERE digest = ?", (digest,))
+        self._blob_path(digest).unlink(missing_ok=True)
+        return row[0] if row else 0
+
+    def _evict(self, keep=None):
+        """
+        Drop least recently used entries (and orphaned blobs) until under max_bytes.
+        The `keep` entry, the one just stored, is never evicted. Caller holds the lock.
+        """
+        keep_id, keep_size = keep or (None, None)
+        total = self.conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM objects").fetchone()[0]
+        while total > self.max_bytes:
+            row = self.conn.execute(
+                "SELECT image_id, size, digest FROM entries WHERE NOT (image_id IS ? AND size IS ?) "
+                "ORDER BY last_access LIMIT 1", (keep_id, keep_size)
+            ).fetchone()
+            if row is None:
+                break
+            image_id, size, digest = row
+            self.conn.execute("DELETE FROM entries WHERE image_id = ? AND size = ?", (image_id, size))
+            total -= self._drop_if_orphaned(digest)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
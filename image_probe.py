@@ -0,0 +1,98 @@
+"""
+Lightweight image verification: fetch only the first few KB of an image
+with a Range request and read its format and dimensions from the header
+bytes, instead of downloading the whole file.
+"""
+import struct
+
+PROBE_BYTES = 64 * 1024
+
+# JPEG start-of-frame markers carry the dimensions (C4, C8 and CC are not frames)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+class ImageProbeError(Exception):
+    """The URL did not serve a recognisable image."""
+
+
+def _jpeg_size(data):
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:  # markers without a length
+            i += 2
+            continue
+        length = struct.unpack('>H', data[i + 2:i + 4])[0]
+        if marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack('>HH', data[i + 5:i + 9])
+            return width, height
+        i += 2 + length
+    return None
+
+
+def sniff_image(data):
+    """
+    Identify an image from its leading bytes.
+    Returns {'format', 'content_type', 'width', 'height'} (dimensions may be
+    None if they lie beyond the bytes given), or None if it is not an image.
+    """
+    if data[:3] == b'\xff\xd8\xff':
+        size = _jpeg_size(data)
+        fmt, content_type = 'jpeg', 'image/jpeg'
+    elif data[:8] == b'\x89PNG\r\n\x1a\n':
+        size = struct.unpack('>II', data[16:24]) if len(data) >= 24 else None
+        fmt, content_type = 'png', 'image/png'
+    elif data[:6] in (b'GIF87a', b'GIF89a'):
+        size = struct.unpack('<HH', data[6:10]) if len(data) >= 10 else None
+        fmt, content_type = 'gif', 'image/gif'
+    else:
+        return None
+    width, height = size or (None, None)
+    return {'format': fmt, 'content_type': content_type, 'width': width, 'height': height}
+
+
+def _total_size(response):
+    """Full size of the remote file, from Content-Range (206) or Content-Length (200)."""
+    content_range = response.headers.get('Content-Range', '')
+    if '/' in content_range and not content_range.endswith('/*'):
+        return int(content_range.rsplit('/', 1)[1])
+    if response.status_code == 200 and response.headers.get('Content-Length'):
+        return int(response.headers['Content-Length'])
+    return None
+
+
+def probe_image(url, session=None, max_bytes=PROBE_BYTES, timeout=None):
+    """
+    Fetch the first max_bytes of url and confirm it is an image. Servers that
+    ignore the Range header are cut off after max_bytes all the same.
+    Returns the sniff_image() dict plus 'bytes' (full size, if known).
+    session defaults to the shared HttpClient, as does the timeout.
+    """
+    if session is None:
+        from http_client import shared_client  # deferred: sniff_image() alone is used on the cold-start path
+        session = shared_client()
+    response = session.get(url, headers={'Range': f'bytes=0-{max_bytes - 1}'}, stream=True, timeout=timeout)
+    try:
+        response.raise_for_status()
+        content_type = response.headers.get('Content-Type', '')
+        if not content_type.startswith('image/'):
+            raise ImageProbeError(f"Response is not an image. Content-Type: {content_type}")
+
+        data = b''
+        for chunk in response.iter_content(chunk_size=16 * 1024):
+            data += chunk
+            if len(data) >= max_bytes:
+                break
+    finally:
+        response.close()
+
+    info = sniff_image(data)
+    if not info:
+        raise ImageProbeError(f"Content-Type is {content_type} but the data is not a JPEG, PNG or GIF")
+    info['bytes'] = _total_size(response)
+    return info
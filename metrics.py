@@ -0,0 +1,165 @@
+"""
+Per-stage timing and counters for the daily send and the harvest.
+
+Code wraps each stage in a span and bumps counters on a process-wide
+Metrics instance; HTTP sessions passed to instrument() also record request
+latency (per host) and bytes received. At the end of a run flush() writes
+what was collected to METRICS_PATH, if set:
+
+  *.prom   Prometheus text exposition, overwritten each run (suitable for
+           node_exporter's textfile collector)
+  other    one JSON line per run appended: span timings with percentiles,
+           counters and HTTP latency percentiles
+
+With PROFILE_PATH set, profile() runs the wrapped block under cProfile and
+dumps the stats there (inspect with `python -m pstats <file>`).
+
+    METRICS_PATH=metrics.jsonl PROFILE_PATH=send.prof python broadcast_card.py
+"""
+import cProfile
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from urllib.parse import urlsplit
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def percentile(samples, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, max(0, round(q * len(samples)) - 1))]
+
+
+class Metrics:
+    """Span timings, counters and HTTP latencies for one run; safe to use from worker threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.spans = {}      # stage -> [seconds]
+            self.counters = {}   # name -> value
+            self.http = {}       # host -> [seconds]
+            self.started = time.time()
+
+    @contextmanager
+    def span(self, stage):
+        """Time the wrapped block under `stage`, whether or not it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.spans.setdefault(stage, []).append(elapsed)
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe_http(self, url, seconds, nbytes=0):
+        host = urlsplit(url).netloc
+        with self.lock:
+            self.http.setdefault(host, []).append(seconds)
+            self.counters['http_requests'] = self.counters.get('http_requests', 0) + 1
+            self.counters['http_bytes'] = self.counters.get('http_bytes', 0) + (nbytes or 0)
+
+    def _on_response(self, response, *args, **kwargs):
+        # Streamed bodies aren't read yet; Content-Length is what the server is sending
+        nbytes = int(response.headers.get('Content-Length') or 0)
+        self.observe_http(response.url, response.elapsed.total_seconds(), nbytes)
+
+    def instrument(self, session):
+        """Record latency and bytes for every response a requests.Session receives."""
+        session.hooks['response'].append(self._on_response)
+        return session
+
+    def summary(self):
+        with self.lock:
+            spans = {stage: sorted(samples) for stage, samples in self.spans.items()}
+            http = {host: sorted(samples) for host, samples in self.http.items()}
+            counters = dict(self.counters)
+
+        def describe(samples):
+            stats = {'count': len(samples), 'sum': sum(samples), 'max': samples[-1]}
+            stats.update({f"p{int(q * 100)}": percentile(samples, q) for q in QUANTILES})
+            return stats
+
+        return {
+            'spans': {stage: describe(samples) for stage, samples in spans.items()},
+            'http': {host: describe(samples) for host, samples in http.items()},
+            'counters': counters,
+        }
+
+    def write_jsonl(self, path, run):
+        record = {'run': run, 'timestamp': datetime.now(timezone.utc).isoformat(),
+                  'duration': time.time() - self.started}
+        record.update(self.summary())
+        with open(path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+    def write_prometheus(self, path, run):
+        summary = self.summary()
+        lines = []
+
+        def emit_summary(name, label, groups):
+            lines.append(f"# TYPE {name} summary")
+            for key, stats in groups.items():
+                labels = f'run="{run}",{label}="{key}"'
+                for q in QUANTILES:
+                    lines.append(f'{name}{{{labels},quantile="{q}"}} {stats[f"p{int(q * 100)}"]:.6f}')
+                lines.append(f"{name}_sum{{{labels}}} {stats['sum']:.6f}")
+                lines.append(f"{name}_count{{{labels}}} {stats['count']}")
+
+        emit_summary('cards_stage_seconds', 'stage', summary['spans'])
+        emit_summary('cards_http_request_seconds', 'host', summary['http'])
+        for name, value in sorted(summary['counters'].items()):
+            lines.append(f"# TYPE cards_{name}_total counter")
+            lines.append(f'cards_{name}_total{{run="{run}"}} {value}')
+        lines.append(f'cards_last_run_timestamp_seconds{{run="{run}"}} {time.time():.0f}')
+
+        tmp_path = Path(f"{path}.tmp")
+        tmp_path.write_text('\n'.join(lines) + '\n')
+        os.replace(tmp_path, path)
+
+    def flush(self, run, path=None):
+        """Write the run's metrics to `path` (default METRICS_PATH); does nothing if neither is set."""
+        path = path or os.getenv("METRICS_PATH")
+        if not path:
+            return
+        try:
+            if str(path).endswith('.prom'):
+                self.write_prometheus(path, run)
+            else:
+                self.write_jsonl(path, run)
+            print(f"Metrics written to {path}")
+        except OSError as e:
+            print(f"Warning: could not write metrics to {path}: {e}")
+
+
+@contextmanager
+def profile(path=None):
+    """Run the wrapped block under cProfile when `path` (default PROFILE_PATH) is set."""
+    path = path or os.getenv("PROFILE_PATH")
+    if not path:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        print(f"Profile written to {path}")
+
+
+metrics = Metrics()
@@ -0,0 +1,171 @@
+"""
+Posted-cards ledger: an append-only log of recent sends plus a compact
+binary set of everything older.
+
+  posted_cards.log  one "<uuid> <YYYY-MM-DD>" line per send, only ever appended
+  posted_cards.bin  sorted 20-byte records: 16-byte UUID + uint32 date ordinal
+
+Membership checks bisect the binary file and the (short) log, so loading
+and lookups stay cheap after years of daily sends. Once the log reaches
+`compact_every` lines it is merged into the binary set and truncated.
+A legacy posted_cards.json list is imported on first use.
+
+    python posted_ledger.py compact posted_cards.json
+"""
+import argparse
+import bisect
+import json
+import os
+import struct
+import uuid
+from datetime import date
+from pathlib import Path
+
+RECORD = struct.Struct('>16sI')
+# Ordinals below this are not dates: legacy imports are numbered 1, 2, ... in list order
+UNDATED_BEFORE = date(1900, 1, 1).toordinal()
+
+
+class _RecordKeys:
+    """Sequence view of the UUID keys in a packed record buffer, for bisect."""
+
+    def __init__(self, data):
+        self.data = data
+
+    def __len__(self):
+        return len(self.data) // RECORD.size
+
+    def __getitem__(self, i):
+        offset = i * RECORD.size
+        return self.data[offset:offset + 16]
+
+
+class PostedLedger:
+    """Set of posted card UUIDs, each with the date it was sent."""
+
+    def __init__(self, posted_path, compact_every=64):
+        base = Path(posted_path).with_suffix('')
+        self.log_path = base.with_suffix('.log')
+        self.bin_path = base.with_suffix('.bin')
+        self.legacy_path = base.with_suffix('.json')
+        self.compact_every = compact_every
+        self._data = None    # packed, sorted records from the .bin file
+        self._recent = None  # {uuid bytes: date ordinal} from the .log file
+
+    def _load(self):
+        if self._data is not None:
+            return
+        try:
+            self._data = self.bin_path.read_bytes()
+        except FileNotFoundError:
+            self._data = b''
+        self._recent = {}
+        try:
+            with self.log_path.open('r') as f:
+                for line in f:
+                    parts = line.split()
+                    if parts:
+                        key = uuid.UUID(parts[0]).bytes
+                        day = date.fromisoformat(parts[1]).toordinal() if len(parts) > 1 else 0
+                        self._recent.setdefault(key, day)
+        except FileNotFoundError:
+            pass
+
+        if not self._data and not self._recent and self.legacy_path.exists():
+            self._import_legacy()
+
+    def _import_legacy(self):
+        """
+        Bring in UUIDs from the old posted_cards.json list. Send dates are unknown,
+        so each gets its position in the list instead, which sorts before any real date.
+        """
+        try:
+            with self.legacy_path.open('r') as f: legacy = json.load(f)
+        except json.JSONDecodeError:
+            print(f"Warning: JSON decode error {self.legacy_path}"); return
+        for card_uuid in legacy:
+            try:
+                self._recent.setdefault(uuid.UUID(card_uuid).bytes, len(self._recent) + 1)
+            except (ValueError, TypeError, AttributeError):
+                print(f"Warning: skipping non-UUID entry in {self.legacy_path}: {card_uuid!r}")
+        print(f"Imported {len(self._recent)} posted cards from {self.legacy_path}")
+        self.compact()
+
+    def _bin_lookup(self, key):
+        keys = _RecordKeys(self._data)
+        i = bisect.bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            return RECORD.unpack_from(self._data, i * RECORD.size)[1]
+        return None
+
+    def __contains__(self, card_uuid):
+        self._load()
+        try:
+            key = uuid.UUID(card_uuid).bytes
+        except (ValueError, TypeError, AttributeError):
+            return False
+        return key in self._recent or self._bin_lookup(key) is not None
+
+    def __len__(self):
+        self._load()
+        return len(self._data) // RECORD.size + sum(1 for key in self._recent if self._bin_lookup(key) is None)
+
+    def __iter__(self):
+        """Yield every posted card UUID as a string."""
+        for card_uuid, _ in self._records():
+            yield card_uuid
+
+    def _records(self):
+        self._load()
+        for key, day in RECORD.iter_unpack(self._data):
+            yield str(uuid.UUID(bytes=key)), day
+        for key, day in self._recent.items():
+            if self._bin_lookup(key) is None:
+                yield str(uuid.UUID(bytes=key)), day
+
+    def entries(self):
+        """Return [(uuid, date or None)] in the order the cards were sent; legacy cards come first, undated."""
+        return [
+            (card_uuid, date.fromordinal(day) if day >= UNDATED_BEFORE else None)
+            for card_uuid, day in sorted(self._records(), key=lambda record: record[1])
+        ]
+
+    def append(self, card_uuid, sent_on=None):
+        """Record a card as posted, compacting the log when it gets long."""
+        self._load()
+        key = uuid.UUID(card_uuid).bytes
+        if key in self._recent or self._bin_lookup(key) is not None:
+            return
+        sent_on = sent_on or date.today()
+        with self.log_path.open('a') as f:
+            f.write(f"{card_uuid} {sent_on.isoformat()}\n")
+        self._recent[key] = sent_on.toordinal()
+        if len(self._recent) >= self.compact_every:
+            self.compact()
+
+    def compact(self):
+        """Merge the log into the sorted binary set, then truncate the log."""
+        self._load()
+        records = dict(RECORD.iter_unpack(self._data))
+        for key, day in self._recent.items():
+            records.setdefault(key, day)
+        data = b''.join(RECORD.pack(key, records[key]) for key in sorted(records))
+
+        tmp_path = self.bin_path.with_name(self.bin_path.name + '.tmp')
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, self.bin_path)
+        # A crash before this point only leaves entries in both files, which is harmless
+        self.log_path.write_text('')
+        self._data, self._recent = data, {}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or compact the posted-cards ledger.")
+    parser.add_argument('command', choices=['compact', 'stats'])
+    parser.add_argument('posted_path', nargs='?', default=os.getenv("POSTED_PATH", "posted_cards.json"))
+    args = parser.parse_args()
+
+    ledger = PostedLedger(args.posted_path)
+    if args.command == 'compact':
+        ledger.compact()
+    print(f"{len(ledger)} posted cards ({ledger.bin_path}: {ledger.bin_path.stat().st_size if ledger.bin_path.exists() else 0} bytes)")
@@ -0,0 +1,71 @@
+"""
+Prepare the send queue: pick, verify and render the next N days of cards
+so the scheduled run only has to pop one entry and call Resend.
+
+    python prepare_queue.py --days 7
+"""
+import argparse
+import os
+from datetime import date, datetime, timedelta
+
+from dotenv import load_dotenv
+
+from broadcast_card import NYPLCardFetcher, ResendBroadcastSender
+from send_queue import SendQueue
+
+
+def prepare(card_fetcher, send_queue, days):
+    """Top the queue up to `days` entries. Returns how many were added."""
+    queued = send_queue.entries()
+    # Cards already waiting in the queue must not be picked again
+    card_fetcher.retire_cards(entry['card_uuid'] for entry in queued)
+
+    if queued:
+        next_date = date.fromisoformat(queued[-1]['send_date']) + timedelta(days=1)
+    else:
+        next_date = date.today() + timedelta(days=1)
+
+    added = 0
+    max_attempts = days * 5
+    attempts = 0
+    while len(queued) + added < days and attempts < max_attempts:
+        attempts += 1
+        card_data = card_fetcher.get_random_unposted_card()
+        card_uuid = card_data['uuid']
+        try:
+            image_info, card_title, nypl_image_url = card_fetcher.verify_and_get_info(card_uuid)
+        except Exception as e:
+            print(f"Skipping card {card_uuid}: {e}")
+            continue
+
+        send_date = datetime.combine(next_date, datetime.min.time())
+        # Written before the card is reserved, so a run that dies part-way never
+        # leaves a card retired from the store without an entry that sends it
+        send_queue.extend([{
+            "card_uuid": card_uuid,
+            "card_title": card_title,
+            "image_url": nypl_image_url,
+            "image_info": image_info,
+            "send_date": next_date.isoformat(),
+            "rendered": ResendBroadcastSender.render_broadcast(card_title, nypl_image_url, send_date),
+        }])
+        added += 1
+        # Reserve the card (and its near-duplicates) so the next pick (and the next prepare run) skips it
+        card_fetcher.retire_cards([card_uuid])
+        print(f"Queued '{card_title}' for {next_date.isoformat()}")
+        next_date += timedelta(days=1)
+
+    return added
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Pick, verify and render the next N days of cards.")
+    parser.add_argument('--days', type=int, default=7, help="number of entries to keep queued")
+    parser.add_argument('--queue', default=os.getenv("SEND_QUEUE_PATH", "send_queue.jsonl"))
+    args = parser.parse_args()
+
+    card_fetcher = NYPLCardFetcher.from_env()
+    send_queue = SendQueue(args.queue)
+    added = prepare(card_fetcher, send_queue, args.days)
+    print(f"Added {added} cards; {len(send_queue)} queued in {args.queue}")
@@ -0,0 +1,52 @@
+"""
+On-disk queue of pre-rendered broadcasts.
+
+prepare_queue.py picks, verifies and renders the next few days of cards
+ahead of time; the daily run only pops the head of the queue and hands it
+to Resend. One JSON object per line:
+
+    {"card_uuid", "card_title", "image_url", "image_info", "send_date", "rendered": {"subject", "html", "tags"}}
+"""
+import json
+import os
+from pathlib import Path
+
+
+class SendQueue:
+    """FIFO of prepared broadcasts stored as JSON lines."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def entries(self):
+        try:
+            with self.path.open('r') as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def __len__(self):
+        return len(self.entries())
+
+    def peek(self):
+        """Return the next entry to send, or None if the queue is empty."""
+        entries = self.entries()
+        return entries[0] if entries else None
+
+    def pop(self):
+        """Remove and return the head of the queue (after it has been sent)."""
+        entries = self.entries()
+        if not entries:
+            return None
+        self._write(entries[1:])
+        return entries[0]
+
+    def extend(self, new_entries):
+        self._write(self.entries() + list(new_entries))
+
+    def _write(self, entries):
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with tmp_path.open('w') as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + '\n')
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,242 @@
+"""
+Local stand-ins for the remote services these scripts talk to, so the
+harvester, image checks and broadcasts can be exercised without hitting
+NYPL or Resend.
+
+    python stub_servers.py --port 8765 --items 500 --resend-port 8766
+    NYPL_API_BASE=http://127.0.0.1:8765/api/v2 NYPL_TOKEN=stub python download_metadata.py
+    NYPL_IMAGE_BASE=http://127.0.0.1:8765 RESEND_API_URL=http://127.0.0.1:8766 POSTED_PATH=stub_posted.json python broadcast_card.py
+
+Images are served from /index.php?id=<imageID>&t=<size> and honour Range
+and If-None-Match requests. Every image whose ID is 7 modulo 50 answers with an HTML error
+page instead, like NYPL does for withdrawn images. With --fail-rate, that
+fraction of API pages, images and Resend calls get a 503 instead (API pages
+with a Retry-After), which exercises the retry and circuit-breaker paths.
+
+API page requests are recorded as (collection_uuid, page) on
+server.api_requests, so tests can check which pages a sync fetched.
+
+The Resend stub implements create, send, get and list for broadcasts and
+keeps what it was sent on server.broadcasts. Sending a broadcast that is
+no longer a draft is rejected, so double sends show up as errors.
+"""
+import argparse
+import json
+import math
+import random
+import struct
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+def synthetic_capture(collection_uuid, index):
+    """Build a deterministic capture record shaped like the NYPL API's."""
+    card_uuid = str(uuid.uuid5(uuid.UUID(collection_uuid), str(index)))
+    return {
+        "uuid": card_uuid,
+        "imageID": str(1000000 + index),
+        "title": f"Card {index + 1} from collection {collection_uuid[:8]}",
+        "typeOfResource": "still image",
+        "itemLink": f"https://digitalcollections.nypl.org/items/{card_uuid}",
+    }
+
+
+def synthetic_jpeg(image_id, size=48 * 1024):
+    """A JPEG-shaped payload (SOI, JFIF, SOF0 with dimensions, padding) for an image ID."""
+    width, height = 760, 400 + int(image_id) % 200
+    app0 = b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00'
+    sof0 = b'\xff\xc0' + struct.pack('>HBHHB', 11, 8, height, width, 1) + b'\x01\x11\x00'
+    body = b'\xff\xd8' + app0 + sof0
+    return body + bytes(size - len(body) - 2) + b'\xff\xd9'
+
+
+def is_broken_image(image_id):
+    return int(image_id) % 50 == 7
+
+
+class StubNYPLHandler(BaseHTTPRequestHandler):
+    """Serves /api/v2/items/<collection_uuid>?page=&per_page= and /index.php images from synthetic data."""
+
+    # Set on the server class by start_stub_nypl()
+    items_per_collection = 500
+    latency = 0.0
+    fail_rate = 0.0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/index.php':
+            self.serve_image(parse_qs(url.query))
+            return
+
+        parts = url.path.strip('/').split('/')
+        if len(parts) != 4 or parts[:3] != ['api', 'v2', 'items']:
+            self.send_error(404)
+            return
+
+        collection_uuid = parts[3]
+        query = parse_qs(url.query)
+        page = int(query.get('page', ['1'])[0])
+        per_page = int(query.get('per_page', ['50'])[0])
+        self.server.api_requests.append((collection_uuid, page))
+
+        total = self.server.items_per_collection
+        total_pages = max(1, math.ceil(total / per_page))
+        start = (page - 1) * per_page
+        captures = [synthetic_capture(collection_uuid, i) for i in range(start, min(start + per_page, total))]
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if random.random() < self.server.fail_rate:
+            self.send_body(503, b'Service Unavailable', 'text/plain', {'Retry-After': '1'})
+            return
+
+        body = json.dumps({
+            "nyplAPI": {
+                "request": {"page": str(page), "perPage": str(per_page), "totalPages": str(total_pages), "uuid": collection_uuid},
+                "response": {"numResults": str(total), "capture": captures},
+            }
+        }).encode()
+        self.send_body(200, body, 'application/json')
+
+    def serve_image(self, query):
+        image_id = query.get('id', ['0'])[0]
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if random.random() < self.server.fail_rate:
+            self.send_body(503, b'Service Unavailable', 'text/plain')
+            return
+        if not image_id.isdigit() or is_broken_image(image_id):
+            self.send_body(200, b'<html><body>Image not available</body></html>', 'text/html')
+            return
+
+        data = synthetic_jpeg(image_id)
+        etag = f'"{image_id}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_body(304, b'', 'image/jpeg', {'ETag': etag})
+            return
+        range_header = self.headers.get('Range', '')
+        if range_header.startswith('bytes='):
+            first, _, last = range_header[len('bytes='):].partition('-')
+            first, last = int(first or 0), min(int(last or len(data) - 1), len(data) - 1)
+            self.send_body(206, data[first:last + 1], 'image/jpeg',
+                           {'Content-Range': f'bytes {first}-{last}/{len(data)}', 'ETag': etag})
+        else:
+            self.send_body(200, data, 'image/jpeg', {'ETag': etag})
+
+    def send_body(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Keep harvester output readable
+
+
+class StubResendHandler(BaseHTTPRequestHandler):
+    """Answers the Resend broadcast endpoints the sender and scheduler use."""
+
+    def do_GET(self):
+        parts = self.path.split('?')[0].strip('/').split('/')
+        with self.server.lock:
+            if parts == ['broadcasts']:
+                self.reply(200, {"object": "list", "data": [
+                    {"id": broadcast_id, "name": broadcast["params"].get("name"), "status": broadcast["status"]}
+                    for broadcast_id, broadcast in self.server.broadcasts.items()
+                ]})
+            elif len(parts) == 2 and parts[0] == 'broadcasts' and parts[1] in self.server.broadcasts:
+                broadcast = self.server.broadcasts[parts[1]]
+                self.reply(200, {"object": "broadcast", "id": parts[1], "name": broadcast["params"].get("name"),
+                                 "status": broadcast["status"]})
+            else:
+                self.reply(404, {"name": "not_found", "message": "Broadcast not found", "statusCode": 404})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        params = json.loads(self.rfile.read(length) or b'{}')
+        parts = self.path.strip('/').split('/')
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if random.random() < self.server.fail_rate:
+            self.reply(503, {"name": "internal_server_error", "message": "Stub failure", "statusCode": 503})
+            return
+
+        with self.server.lock:
+            if parts == ['broadcasts']:
+                broadcast_id = str(uuid.uuid4())
+                self.server.broadcasts[broadcast_id] = {"params": params, "status": "draft"}
+                self.reply(200, {"id": broadcast_id})
+            elif len(parts) == 3 and parts[0] == 'broadcasts' and parts[2] == 'send':
+                broadcast = self.server.broadcasts.get(parts[1])
+                if broadcast is None:
+                    self.reply(404, {"name": "not_found", "message": "Broadcast not found", "statusCode": 404})
+                    return
+                if broadcast["status"] != "draft":
+                    self.reply(422, {"name": "validation_error", "message": "Broadcast already sent", "statusCode": 422})
+                    return
+                broadcast["status"] = "queued" if params.get("scheduled_at") else "sent"
+                broadcast["send_params"] = params
+                self.reply(200, {"id": parts[1]})
+            else:
+                self.reply(404, {"name": "not_found", "message": "Unknown endpoint", "statusCode": 404})
+
+    def reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_nypl(port=0, items_per_collection=500, latency=0.0, fail_rate=0.0):
+    """Start the stub NYPL API and image server on a background thread. Returns (server, api_base)."""
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubNYPLHandler)
+    server.items_per_collection = items_per_collection
+    server.latency = latency
+    server.fail_rate = fail_rate
+    server.api_requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/api/v2"
+
+
+def start_stub_resend(port=0, latency=0.0, fail_rate=0.0):
+    """Start the stub Resend API on a background thread. Returns (server, api_url) for RESEND_API_URL."""
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubResendHandler)
+    server.latency = latency
+    server.fail_rate = fail_rate
+    server.broadcasts = {}
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run local stubs of the NYPL and Resend APIs.")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--items', type=int, default=500, help="captures served per collection")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds to delay each response")
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="fraction of requests answered with a 503")
+    parser.add_argument('--resend-port', type=int, help="also run the Resend stub on this port")
+    args = parser.parse_args()
+
+    server, api_base = start_stub_nypl(args.port, args.items, args.latency, args.fail_rate)
+    print(f"Stub NYPL API listening at {api_base}, images at http://127.0.0.1:{server.server_port}")
+    if args.resend_port is not None:
+        resend_server, resend_url = start_stub_resend(args.resend_port, args.latency, args.fail_rate)
+        print(f"Stub Resend API listening at {resend_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
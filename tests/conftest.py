@@ -0,0 +1,17 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# The scripts live at the repository root, not in a package
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from stub_servers import start_stub_nypl  # noqa: E402
+
+
+@pytest.fixture
+def stub():
+    """The stub NYPL API with 500 captures per collection: (server, api_base)."""
+    server, api_base = start_stub_nypl(items_per_collection=500)
+    yield server, api_base
+    server.shutdown()
@@ -0,0 +1,30 @@
+"""Shared helpers for the harvester tests."""
+import json
+
+from download_metadata import CollectionHarvester
+from stub_servers import synthetic_capture
+
+COLLECTION = "b2d37b40-c52d-012f-f8ec-58d385a7bc34"
+OTHER = "b686cfd0-c52b-012f-c9e6-58d385a7bc34"
+
+
+def make_harvester(api_base, page_retries=0):
+    """No client retries or backoff, so every stub failure reaches sync()."""
+    harvester = CollectionHarvester('stub', api_base=api_base, concurrency=4, rate=0, page_retries=page_retries)
+    harvester.session.retries = 0
+    harvester.session.reset_after = 0.01
+    return harvester
+
+
+def pages_requested(server, collection_uuid=COLLECTION):
+    pages = sorted(page for uuid, page in server.api_requests if uuid == collection_uuid)
+    server.api_requests.clear()
+    return pages
+
+
+def harvested(checkpoints, collection_uuid=COLLECTION):
+    return [json.loads(line) for line in checkpoints.iter_lines(collection_uuid)]
+
+
+def expected(count, collection_uuid=COLLECTION):
+    return [synthetic_capture(collection_uuid, i) for i in range(count)]
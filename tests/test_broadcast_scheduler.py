@@ -0,0 +1,105 @@
+"""broadcast_scheduler: job keys, duplicates and resuming a batch against the stub Resend API."""
+import json
+
+import pytest
+import resend
+
+from broadcast_card import NYPLCardFetcher, ResendBroadcastSender
+from broadcast_scheduler import JobJournal, job_key, run_jobs
+from http_client import HttpClient
+from stub_servers import start_stub_resend, synthetic_capture
+
+COLLECTION = "b2d37b40-c52d-012f-f8ec-58d385a7bc34"
+JOBS = [{"audience_id": "aud-1", "collection": COLLECTION}, {"audience_id": "aud-2", "collection": COLLECTION}]
+
+
+@pytest.fixture
+def resend_stub(monkeypatch):
+    server, api_url = start_stub_resend()
+    monkeypatch.setattr(resend, 'api_url', api_url)
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def scheduler(tmp_path, stub, resend_stub):
+    """run(jobs, batch) against both stubs, with a card store of 20 cards and a journal in tmp_path."""
+    server, _ = stub
+    captures = [synthetic_capture(COLLECTION, i) for i in range(20)]
+    (tmp_path / 'metadata.json').write_text(json.dumps({COLLECTION: {"nyplAPI": {"response": {"capture": captures}}}}))
+    fetcher = NYPLCardFetcher('stub', tmp_path / 'metadata.json', tmp_path / 'posted_cards.json', tmp_path / 'cards.db',
+                              f"http://127.0.0.1:{server.server_port}", validity_path=None, dedup_path=None,
+                              queue_path=None)
+    sender = ResendBroadcastSender('re_test', 'cards@example.com', None, http=HttpClient(retries=0))
+    journal = JobJournal(tmp_path / 'journal.jsonl')
+
+    def run(jobs, batch='batch-1', dry_run=False):
+        return run_jobs(jobs, batch, fetcher, sender, journal, workers=2, create_rate=0, send_rate=0, lookup_rate=0,
+                        dry_run=dry_run)
+
+    run.fetcher, run.sender, run.journal, run.resend = fetcher, sender, journal, resend_stub
+    return run
+
+
+def test_job_keys():
+    job = {"audience_id": "aud-1", "card_uuid": "card-1"}
+    assert job_key(job, 'a') == job_key(dict(job), 'a')
+    assert job_key(job, 'a') != job_key(job, 'b')  # keyed on the batch without send_at
+    scheduled = {**job, "send_at": "2025-06-01T08:00:00+02:00"}
+    assert job_key(scheduled, 'a') == job_key(scheduled, 'b')
+    assert job_key({**job, "id": "welcome"}, 'a') == 'welcome'
+
+
+def test_rerunning_a_batch_sends_nothing_twice(scheduler):
+    assert scheduler(JOBS) == {'sent': 2}
+    broadcasts = scheduler.resend.broadcasts
+    assert sorted(b['params']['audience_id'] for b in broadcasts.values()) == ['aud-1', 'aud-2']
+    assert all(b['status'] == 'sent' for b in broadcasts.values())
+    cards = {b['params']['tags'][1]['value'] for b in broadcasts.values()}
+    assert len(cards) == 2  # each job reserved its own card
+    assert len(scheduler.fetcher.posted_cards) == 2
+
+    assert scheduler(JOBS) == {'already sent': 2}
+    assert len(broadcasts) == 2
+    # A new batch sends the same file again
+    assert scheduler(JOBS, batch='batch-2') == {'sent': 2}
+    assert len(broadcasts) == 4
+
+
+def test_duplicate_jobs_in_a_batch_are_sent_once(scheduler):
+    assert scheduler([JOBS[0], dict(JOBS[0]), JOBS[1]]) == {'duplicate': 1, 'sent': 2}
+    assert len(scheduler.resend.broadcasts) == 2
+
+
+def test_resuming_a_job_that_died_mid_create_finds_its_broadcast(scheduler):
+    scheduler(JOBS[:1], dry_run=True)
+    job_id = job_key(JOBS[0], 'batch-1')
+    state = scheduler.journal.get(job_id)
+    # The last run journaled 'creating', created the broadcast and died before journaling its ID
+    scheduler.journal.record(job_id, 'creating')
+    rendered = ResendBroadcastSender.render_broadcast(state['card_title'], state['image_url'])
+    broadcast_id = scheduler.sender.create_broadcast(rendered, audience_id='aud-1', name=job_id)
+
+    assert scheduler(JOBS[:1]) == {'sent': 1}
+    assert list(scheduler.resend.broadcasts) == [broadcast_id]
+    assert scheduler.resend.broadcasts[broadcast_id]['status'] == 'sent'
+    assert scheduler.journal.get(job_id)['broadcast_id'] == broadcast_id
+
+
+def test_resuming_a_created_job_that_was_already_sent_does_not_send_again(scheduler):
+    scheduler(JOBS, dry_run=True)
+    sent_id, draft_id = (job_key(job, 'batch-1') for job in JOBS)
+    for job_id, job in zip((sent_id, draft_id), JOBS):
+        state = scheduler.journal.get(job_id)
+        rendered = ResendBroadcastSender.render_broadcast(state['card_title'], state['image_url'])
+        scheduler.journal.record(job_id, 'creating')
+        broadcast_id = scheduler.sender.create_broadcast(rendered, audience_id=job['audience_id'], name=job_id)
+        scheduler.journal.record(job_id, 'created', broadcast_id=broadcast_id)
+    # The first job's send went through, but the run died before journaling it
+    scheduler.sender.send_broadcast(scheduler.journal.get(sent_id)['broadcast_id'])
+
+    # A second send would be rejected (422) and the job marked failed
+    assert scheduler(JOBS) == {'sent': 2}
+    assert len(scheduler.resend.broadcasts) == 2
+    assert all(b['status'] == 'sent' for b in scheduler.resend.broadcasts.values())
+    assert scheduler.journal.get(sent_id)['state'] == scheduler.journal.get(draft_id)['state'] == 'sent'
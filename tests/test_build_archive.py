@@ -0,0 +1,107 @@
+"""build_archive: incremental page planning and thumbnails."""
+import io
+import json
+from datetime import date, timedelta
+
+import pytest
+
+from build_archive import ArchiveBuilder
+from image_cache import ImageCache
+
+COLLECTION = "b2d37b40-c52d-012f-f8ec-58d385a7bc34"
+
+
+def posted(count):
+    first_day = date(2025, 1, 1)
+    return [{'uuid': f"card-{i}", 'title': f"Card {i}", 'imageID': str(1000000 + i), 'collection': COLLECTION,
+             'sent': (first_day + timedelta(days=i)).isoformat()} for i in range(count)]
+
+
+def build(out_dir, cards, full=False, per_page=4):
+    return ArchiveBuilder(out_dir, cards, per_page=per_page).build(full)
+
+
+def test_first_build_writes_everything_and_a_rerun_nothing(tmp_path):
+    cards = posted(10)
+    assert build(tmp_path, cards) == (10, 3)
+    assert sorted(path.name for path in (tmp_path / 'page').iterdir()) == ['1.html', '2.html', '3.html']
+    assert len(list((tmp_path / 'cards').iterdir())) == 10
+    assert "Every card sent so far: 10 and counting" in (tmp_path / 'index.html').read_text()
+
+    index_written = (tmp_path / 'index.html').stat().st_mtime_ns
+    assert build(tmp_path, cards) == (0, 0)
+    assert (tmp_path / 'index.html').stat().st_mtime_ns == index_written
+
+
+def test_a_new_send_rewrites_only_the_last_pages(tmp_path):
+    build(tmp_path, posted(11))
+    # Card 11 fills page 3 and links back to card 10
+    assert build(tmp_path, posted(12)) == (2, 1)
+    # Card 12 starts page 4; page 3 gains its "newer" link
+    assert build(tmp_path, posted(13)) == (2, 2)
+    assert 'href="4.html"' in (tmp_path / 'page' / '3.html').read_text()
+
+
+def test_an_edited_card_rewrites_its_neighbours_and_its_page(tmp_path):
+    cards = posted(10)
+    build(tmp_path, cards)
+    cards[5] = dict(cards[5], title='Card 5, corrected')
+    assert build(tmp_path, cards) == (3, 1)
+    assert 'Card 5, corrected →' in (tmp_path / 'cards' / 'card-4.html').read_text()
+
+
+def test_new_settings_or_a_full_build_rewrite_everything(tmp_path):
+    build(tmp_path, posted(10))
+    assert build(tmp_path, posted(10), per_page=8) == (10, 2)
+    assert not (tmp_path / 'page' / '3.html').exists()  # stale page from the old layout
+    assert build(tmp_path, posted(10), full=True, per_page=8) == (10, 2)
+
+
+class FakeResponse:
+    def __init__(self, content, content_type):
+        self.status_code = 200
+        self.content = content
+        self.headers = {'Content-Type': content_type}
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeImages:
+    """Serves a real JPEG for every imageID except `broken`, which gets an HTML error page."""
+
+    def __init__(self, broken=()):
+        from PIL import Image
+
+        buffer = io.BytesIO()
+        Image.new('RGB', (600, 900), (120, 80, 40)).save(buffer, 'JPEG')
+        self.jpeg = buffer.getvalue()
+        self.broken = set(broken)
+
+    def get(self, url, headers=None, timeout=None):
+        image_id = url.split('id=')[1].split('&')[0]
+        if image_id in self.broken:
+            return FakeResponse(b'<html>Gone</html>', 'text/html')
+        return FakeResponse(self.jpeg, 'image/jpeg')
+
+
+def test_thumbnails_are_made_once_and_failures_remembered(tmp_path):
+    pytest.importorskip('PIL')
+    out_dir, cards = tmp_path / 'archive', posted(4)
+    image_cache = ImageCache(tmp_path / 'image_cache', session=FakeImages(broken={'1000002'}))
+    builder = ArchiveBuilder(out_dir, cards, per_page=4)
+    assert builder.build_thumbnails(image_cache, workers=1) == 3
+    builder.build()
+    assert sorted(path.name for path in (out_dir / 'thumbs').iterdir()) == ['1000000.jpg', '1000001.jpg', '1000003.jpg']
+    assert json.loads((out_dir / 'build.json').read_text())['thumb_failures'] == ['1000002']
+    assert 'src="../thumbs/1000000.jpg"' in (out_dir / 'page' / '1.html').read_text()
+    assert 'id=1000002&amp;t=t' in (out_dir / 'page' / '1.html').read_text()  # NYPL's thumbnail instead
+
+    # The next build makes nothing new and rewrites nothing; a full build retries the failure
+    builder = ArchiveBuilder(out_dir, cards, per_page=4)
+    assert builder.build_thumbnails(image_cache) == 0
+    assert builder.build() == (0, 0)
+    image_cache.session.broken.clear()
+    builder = ArchiveBuilder(out_dir, cards, per_page=4)
+    assert builder.build_thumbnails(image_cache, retry_failures=True) == 1
+    assert builder.build() == (3, 1)  # card 2's page, its neighbours and page 1 now use the local thumbnail
@@ -0,0 +1,106 @@
+"""CardStore: compiling, lookups and the swap-remove selection pool."""
+import random
+
+import pytest
+
+from card_store import CardStore, compile_cards
+from stub_servers import synthetic_capture
+
+COLLECTION = "b2d37b40-c52d-012f-f8ec-58d385a7bc34"
+
+
+@pytest.fixture
+def store(tmp_path):
+    captures = [(synthetic_capture(COLLECTION, i), COLLECTION) for i in range(100)]
+    captures.append(({'uuid': 'no-image', 'title': 'No image'}, COLLECTION))  # skipped: no imageID
+    compile_cards(captures, tmp_path / 'cards.db')
+    store = CardStore(tmp_path / 'cards.db')
+    yield store
+    store.close()
+
+
+def test_compile_keeps_cards_with_an_image(store):
+    assert store.count() == 100
+    assert store.pool_size() == 100
+    card = synthetic_capture(COLLECTION, 7)
+    assert store.get(card['uuid']) == {'uuid': card['uuid'], 'imageID': card['imageID'], 'title': card['title'],
+                                       'collection': COLLECTION}
+    assert store.get('no-image') is None
+
+
+def test_pool_slots_stay_dense_as_cards_are_retired(store):
+    uuids = [synthetic_capture(COLLECTION, i)['uuid'] for i in range(100)]
+    random.seed(5)
+    retired = set(random.sample(uuids, 60))
+    assert store.retire_many(retired) == 60
+    assert not store.retire(next(iter(retired)))  # already out
+
+    assert store.pool_size() == 40
+    slots = [row[0] for row in store.conn.execute("SELECT slot FROM pool ORDER BY slot")]
+    assert slots == list(range(40))
+    in_pool = {row[0] for row in store.conn.execute("SELECT cards.uuid FROM pool JOIN cards ON cards.id = pool.card_id")}
+    assert in_pool == set(uuids) - retired
+
+
+def test_random_card_only_picks_from_the_pool(store):
+    uuids = [synthetic_capture(COLLECTION, i)['uuid'] for i in range(100)]
+    store.retire_many(uuids[:97])
+    picked = {store.random_card()['uuid'] for _ in range(200)}
+    assert picked == set(uuids[97:])
+
+    store.retire_many(uuids[97:])
+    assert store.random_card() is None
+
+
+@pytest.fixture
+def subjects(tmp_path):
+    """Two collections of 200 cards; every 4th title is an aeroplane, the rest footballers."""
+    others = "b686cfd0-c52b-012f-c9e6-58d385a7bc34"
+    captures = [({'uuid': f"card-{i}", 'imageID': str(i),
+                  'title': f"{'Aeroplanes' if i % 4 == 0 else 'Footballer'}, No. {i}"}, COLLECTION if i < 200 else others)
+                for i in range(400)]
+    compile_cards(captures, tmp_path / 'cards.db')
+    store = CardStore(tmp_path / 'cards.db')
+    yield store
+    store.close()
+
+
+def test_search_matches_every_word_and_facet(subjects):
+    results = subjects.search('aeroplane', limit=500, collection=COLLECTION)
+    assert [card['uuid'] for card in results] == [f"card-{i}" for i in range(0, 200, 4)]
+    assert subjects.search('zeppelin') == []
+    assert subjects.facet_counts('collection')[COLLECTION] == 200
+
+
+def test_random_matching_picks_only_unposted_matches(subjects):
+    matches = {f"card-{i}" for i in range(0, 200, 4)}
+    subjects.retire_many(sorted(matches)[:40])
+    picked = {subjects.random_matching('aeroplanes', collection=COLLECTION)['uuid'] for _ in range(300)}
+    assert picked == set(sorted(matches)[40:])
+
+    subjects.retire_many(sorted(matches)[40:])
+    assert subjects.random_matching('aeroplanes', collection=COLLECTION) is None
+    assert subjects.random_matching('zeppelin') is None
+
+
+def test_random_matching_stays_uniform_when_a_facet_is_mostly_posted(subjects):
+    in_collection = [f"card-{i}" for i in range(200)]
+    subjects.retire_many(in_collection[:-5])
+    random.seed(11)
+    counts = {}
+    for _ in range(2000):
+        card_uuid = subjects.random_matching(collection=COLLECTION)['uuid']
+        counts[card_uuid] = counts.get(card_uuid, 0) + 1
+
+    # Each of the 5 left should come up about 400 times
+    assert set(counts) == set(in_collection[-5:])
+    assert min(counts.values()) > 300
+
+
+def test_retire_keeps_every_key_pool_dense(subjects):
+    random.seed(2)
+    subjects.retire_many(random.sample([f"card-{i}" for i in range(400)], 250))
+    for key, size, max_slot in subjects.conn.execute("SELECT key, COUNT(*), MAX(slot) FROM key_pool GROUP BY key"):
+        assert max_slot == size - 1, key
+    pooled = {row[0] for row in subjects.conn.execute("SELECT DISTINCT card_id FROM key_pool")}
+    assert pooled == {row[0] for row in subjects.conn.execute("SELECT card_id FROM pool")}
@@ -0,0 +1,128 @@
+"""HarvestCheckpoints: incremental syncs, resuming and HARVEST_FULL against the stub NYPL API."""
+import functools
+import json
+import random
+
+import pytest
+
+import download_metadata
+from download_metadata import HarvestCheckpoints
+from harvest_helpers import COLLECTION, OTHER, expected, harvested, make_harvester, pages_requested
+from http_client import HttpClient
+
+
+def test_unchanged_collection_only_refetches_page_one(stub, tmp_path):
+    server, api_base = stub
+    harvester = make_harvester(api_base)
+    harvester.sync([COLLECTION], HarvestCheckpoints(tmp_path))
+    server.api_requests.clear()
+
+    checkpoints = HarvestCheckpoints(tmp_path)
+    changed, incomplete = harvester.sync([COLLECTION], checkpoints)
+
+    assert (changed, incomplete) == (set(), set())
+    assert pages_requested(server) == [1]
+    assert harvested(checkpoints) == expected(500)
+
+
+def test_failed_pages_are_resumed(stub, tmp_path):
+    server, api_base = stub
+    server.fail_rate = 0.5
+    random.seed(7)
+    harvester = make_harvester(api_base)
+
+    runs = 0
+    incomplete = {COLLECTION}
+    while incomplete:
+        runs += 1
+        assert runs <= 30, "collection never completed"
+        checkpoints = HarvestCheckpoints(tmp_path)
+        finished = set(checkpoints.load_state(COLLECTION).get('pages', []))
+        _, incomplete = harvester.sync([COLLECTION], checkpoints)
+        # Page 1 is always asked for; otherwise only pages not finished by an earlier run
+        assert not finished & set(pages_requested(server)) - {1}
+
+    assert runs > 1
+    assert harvested(HarvestCheckpoints(tmp_path)) == expected(500)
+
+
+def test_growth_refetches_from_the_old_last_page(stub, tmp_path):
+    server, api_base = stub
+    server.items_per_collection = 120  # pages 1-3, the last one partial
+    harvester = make_harvester(api_base)
+    harvester.sync([COLLECTION], HarvestCheckpoints(tmp_path))
+    server.api_requests.clear()
+
+    server.items_per_collection = 170
+    checkpoints = HarvestCheckpoints(tmp_path)
+    changed, incomplete = harvester.sync([COLLECTION], checkpoints)
+
+    assert (changed, incomplete) == ({COLLECTION}, set())
+    assert pages_requested(server) == [1, 3, 4]
+    assert harvested(checkpoints) == expected(170)
+
+
+def test_shrink_refetches_everything(stub, tmp_path):
+    server, api_base = stub
+    harvester = make_harvester(api_base)
+    harvester.sync([COLLECTION], HarvestCheckpoints(tmp_path))
+    server.api_requests.clear()
+
+    server.items_per_collection = 60
+    checkpoints = HarvestCheckpoints(tmp_path)
+    changed, incomplete = harvester.sync([COLLECTION], checkpoints)
+
+    assert (changed, incomplete) == ({COLLECTION}, set())
+    assert pages_requested(server) == [1, 2]
+    assert harvested(checkpoints) == expected(60)
+    assert sorted(path.name for path in (tmp_path / COLLECTION).glob('page_*')) == ['page_00001.jsonl', 'page_00002.jsonl']
+
+
+@pytest.fixture
+def harvest_env(stub, tmp_path, monkeypatch):
+    """Run download_metadata() in tmp_path against the stub, for two collections."""
+    server, api_base = stub
+    server.items_per_collection = 120
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(download_metadata, 'COLLECTIONS', [COLLECTION, OTHER])
+    monkeypatch.setattr(download_metadata, 'HttpClient', functools.partial(HttpClient, retries=0, reset_after=0.01))
+    for name, value in {'NYPL_TOKEN': 'stub', 'NYPL_API_BASE': api_base, 'HARVEST_RATE': '0',
+                        'HARVEST_CHECKPOINT_DIR': str(tmp_path / 'checkpoints'),
+                        'CARD_STORE_PATH': str(tmp_path / 'cards.db')}.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.delenv('HARVEST_FULL', raising=False)
+    return server
+
+
+def output_uuids(tmp_path):
+    with (tmp_path / 'metadata_all_collections.jsonl').open() as f:
+        return sorted(json.loads(line)['uuid'] for line in f)
+
+
+def test_harvest_full_refetches_everything(harvest_env, tmp_path, monkeypatch):
+    server = harvest_env
+    assert download_metadata.download_metadata()
+    server.api_requests.clear()
+
+    monkeypatch.setenv('HARVEST_FULL', '1')
+    assert download_metadata.download_metadata()
+    assert pages_requested(server) == [1, 2, 3]
+    assert len(output_uuids(tmp_path)) == 240
+
+
+def test_failed_harvest_full_leaves_no_stale_checkpoints(harvest_env, tmp_path, monkeypatch):
+    server = harvest_env
+    assert download_metadata.download_metadata()
+
+    # The full run fails on page 1, after its checkpoints were discarded
+    monkeypatch.setenv('HARVEST_FULL', '1')
+    server.fail_rate = 1.0
+    assert not download_metadata.download_metadata()
+
+    # The next normal sync must fetch everything again, not trust the old state
+    monkeypatch.delenv('HARVEST_FULL')
+    server.fail_rate = 0.0
+    server.api_requests.clear()
+    assert download_metadata.download_metadata()
+    assert pages_requested(server) == [1, 2, 3]
+    assert len(output_uuids(tmp_path)) == 240
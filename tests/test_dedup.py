@@ -0,0 +1,78 @@
+"""dedup_cards: candidate pairs, clustering and image hashing."""
+import random
+
+import pytest
+
+from dedup_cards import DuplicateClusters, cluster_pairs, dhash, near_duplicate_pairs
+
+
+def flip(value, *bits):
+    for bit in bits:
+        value ^= 1 << bit
+    return value
+
+
+def test_near_duplicate_pairs_finds_every_close_pair():
+    random.seed(3)
+    hashes = {}
+    for i in range(200):
+        base = random.getrandbits(64)
+        hashes[f"{i}a"] = base
+        hashes[f"{i}b"] = flip(base, *random.sample(range(64), random.randint(0, 6)))
+
+    found = {tuple(sorted(pair)) for pair in near_duplicate_pairs(hashes, max_distance=4)}
+    ids = sorted(hashes)
+    expected = {(a, b) for i, a in enumerate(ids) for b in ids[i + 1:] if (hashes[a] ^ hashes[b]).bit_count() <= 4}
+    assert found == expected
+
+
+def test_clusters_group_close_hashes():
+    base = random.Random(1).getrandbits(64)
+    hashes = {'front': base, 'back': flip(base, 1), 'reprint': flip(base, 2, 3), 'other': ~base & (2 ** 64 - 1)}
+    clusters = cluster_pairs(near_duplicate_pairs(hashes), hashes)
+    assert clusters == [['back', 'front', 'reprint']]
+
+
+def test_a_chain_of_small_differences_is_not_one_cluster():
+    # Each link is 3 bits from the next; the ends are 15 bits apart
+    hashes = {f"card-{i}": flip(0, *range(3 * i)) for i in range(6)}
+    clusters = cluster_pairs(near_duplicate_pairs(hashes, max_distance=4), hashes, max_distance=4)
+
+    assert len(clusters) > 1
+    assert not any({'card-0', 'card-5'} <= set(cluster) for cluster in clusters)
+    for cluster in clusters:
+        for a in cluster:
+            for b in cluster:
+                assert (hashes[a] ^ hashes[b]).bit_count() <= 2 * 4
+
+
+def test_clusters_round_trip(tmp_path):
+    dups = DuplicateClusters(tmp_path / 'card_dups.db')
+    dups.record_hashes([('1', 0xff), ('2', 0xfe), ('3', None)])
+    assert dups.hashed_ids() == {'1', '2', '3'}
+    assert dups.hashes() == {'1': 0xff, '2': 0xfe}
+
+    dups.write_clusters([['1', '2']])
+    dups.write_clusters([['1', '2'], ['4', '5']])
+    assert dups.clusters() == [['1', '2'], ['4', '5']]
+    assert dups.generation == 2
+
+
+def test_dhash_survives_resizing_but_not_a_different_image(tmp_path):
+    Image = pytest.importorskip('PIL.Image')
+
+    def gradient(width, height, flipped=False):
+        image = Image.new('L', (width, height))
+        image.putdata([((width - x if flipped else x) * 255 // width + (y % 7) * 3) % 256
+                       for y in range(height) for x in range(width)])
+        return image
+
+    gradient(400, 600).save(tmp_path / 'card.jpg')
+    gradient(200, 300).save(tmp_path / 'smaller.png')
+    gradient(400, 600, flipped=True).save(tmp_path / 'other.jpg')
+    (tmp_path / 'broken.jpg').write_bytes(b'<html>Not found</html>')
+
+    card, smaller, other = (dhash(tmp_path / name) for name in ('card.jpg', 'smaller.png', 'other.jpg'))
+    assert (card ^ smaller).bit_count() <= 4
+    assert (card ^ other).bit_count() > 16
+    assert dhash(tmp_path / 'broken.jpg') is None
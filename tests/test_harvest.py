@@ -0,0 +1,28 @@
+"""CollectionHarvester: concurrent, rate-limited harvesting against the stub NYPL API."""
+import time
+
+from download_metadata import CollectionHarvester, HarvestCheckpoints
+from harvest_helpers import COLLECTION, OTHER, expected, harvested, make_harvester
+
+
+def test_sync_fetches_every_page(stub, tmp_path):
+    server, api_base = stub
+    checkpoints = HarvestCheckpoints(tmp_path)
+    changed, incomplete = make_harvester(api_base).sync([COLLECTION, OTHER], checkpoints)
+
+    assert changed == {COLLECTION, OTHER}
+    assert incomplete == set()
+    assert harvested(checkpoints) == expected(500)
+    assert harvested(checkpoints, OTHER) == expected(500, OTHER)
+
+
+def test_requests_stay_within_the_rate_limit(stub, tmp_path):
+    server, api_base = stub
+    harvester = CollectionHarvester('stub', api_base=api_base, concurrency=8, rate=20)
+    started = time.monotonic()
+    harvester.sync([COLLECTION], HarvestCheckpoints(tmp_path))
+    elapsed = time.monotonic() - started
+
+    # 10 pages from 8 workers, but one token every 1/20 s: at least 9 gaps
+    assert len(server.api_requests) == 10
+    assert elapsed >= 9 / 20 * 0.9
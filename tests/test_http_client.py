@@ -0,0 +1,67 @@
+"""HttpClient retries and circuit breaking, and the harvester's page requeues, against the stub NYPL API."""
+import random
+
+import pytest
+
+from download_metadata import HarvestCheckpoints
+from harvest_helpers import COLLECTION, expected, harvested, make_harvester
+from http_client import CircuitBreaker, CircuitOpenError, HttpClient
+
+
+@pytest.fixture
+def items(stub):
+    server, api_base = stub
+    return server, f"{api_base}/items/{COLLECTION}"
+
+
+def test_breaker_opens_after_consecutive_failures_and_lets_one_trial_through():
+    breaker = CircuitBreaker('host', failure_threshold=3, reset_after=0.0)
+    for _ in range(2):
+        breaker.record(False)
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.opened_at is not None
+
+    assert breaker.allow()  # reset_after has passed: one trial request
+    breaker.record(True)
+    assert (breaker.failures, breaker.opened_at) == (0, None)
+
+
+def test_open_circuit_rejects_without_calling(items):
+    server, url = items
+    server.fail_rate = 1.0
+    client = HttpClient(retries=0, failure_threshold=3, reset_after=60)
+
+    for _ in range(3):
+        assert client.get(url).status_code == 503
+    with pytest.raises(CircuitOpenError):
+        client.get(url)
+    assert len(server.api_requests) == 3
+
+
+def test_retries_take_a_limiter_token_per_attempt(items):
+    server, url = items
+
+    class FailFirstLimiter:
+        calls = 0
+
+        def acquire(self):
+            self.calls += 1
+            server.fail_rate = 1.0 if self.calls == 1 else 0.0  # the first attempt gets a 503, the retry succeeds
+
+    limiter = FailFirstLimiter()
+    response = HttpClient(retries=2, backoff=0.01, limiter=limiter).get(url)
+
+    assert response.status_code == 200
+    assert limiter.calls == len(server.api_requests) == 2
+
+
+def test_requeued_pages_survive_transient_failures(stub, tmp_path):
+    server, api_base = stub
+    server.fail_rate = 0.3
+    random.seed(3)
+    checkpoints = HarvestCheckpoints(tmp_path)
+    changed, incomplete = make_harvester(api_base, page_retries=10).sync([COLLECTION], checkpoints)
+
+    assert incomplete == set()
+    assert harvested(checkpoints) == expected(500)
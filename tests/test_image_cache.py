@@ -0,0 +1,116 @@
+"""ImageCache: downloads, revalidation, blob bookkeeping and eviction."""
+import time
+
+from image_cache import ImageCache
+from stub_servers import synthetic_jpeg
+
+
+class FakeResponse:
+    def __init__(self, status_code, content=b'', headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise Exception(f"HTTP {self.status_code}")
+
+
+class FakeImages:
+    """Serves the bytes in `images` by ID, with an ETag that changes when they do."""
+
+    def __init__(self):
+        self.images = {}
+        self.requests = 0
+
+    def get(self, url, headers=None, timeout=None):
+        self.requests += 1
+        image_id = url.split('id=')[1].split('&')[0]
+        data = self.images[image_id]
+        etag = f'"{hash(data)}"'
+        if (headers or {}).get('If-None-Match') == etag:
+            return FakeResponse(304, headers={'ETag': etag})
+        return FakeResponse(200, data, {'ETag': etag})
+
+
+def make_cache(tmp_path, **kwargs):
+    return ImageCache(tmp_path / 'image_cache', session=FakeImages(), **kwargs)
+
+
+def blob_files(cache):
+    return sorted(path.name for path in (cache.root / 'objects').rglob('*') if path.is_file())
+
+
+def expire(cache):
+    cache.conn.execute("UPDATE entries SET fetched_at = 0")
+    cache.conn.commit()
+
+
+def test_fresh_entries_are_served_without_a_request(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.session.images['1000001'] = synthetic_jpeg('1000001')
+    path = cache.fetch('1000001')
+    assert path.read_bytes() == synthetic_jpeg('1000001')
+    assert cache.fetch('1000001') == path
+    assert cache.session.requests == 1
+
+    expire(cache)
+    assert cache.fetch('1000001') == path  # revalidated: 304
+    assert cache.session.requests == 2
+    assert cache.peek('1000001') == path
+
+
+def test_a_changed_image_replaces_its_old_blob(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.session.images['1000001'] = synthetic_jpeg('1000001')
+    old_path = cache.fetch('1000001')
+
+    expire(cache)
+    cache.session.images['1000001'] = synthetic_jpeg('1000001', size=64 * 1024)
+    new_path = cache.fetch('1000001')
+    assert new_path != old_path
+    assert not old_path.exists()
+    assert blob_files(cache) == [new_path.name]
+    assert cache.total_bytes() == 64 * 1024
+
+
+def test_a_blob_shared_by_two_entries_survives_one_changing(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.session.images['1000001'] = cache.session.images['1000002'] = synthetic_jpeg('1000001')
+    shared = cache.fetch('1000001')
+    assert cache.fetch('1000002') == shared
+
+    expire(cache)
+    cache.session.images['1000001'] = synthetic_jpeg('1000003')
+    cache.fetch('1000001')
+    assert shared.exists()
+    assert cache.peek('1000002') == shared
+    assert len(blob_files(cache)) == 2
+
+
+def test_eviction_drops_the_least_recently_used(tmp_path):
+    cache = make_cache(tmp_path, max_bytes=100 * 1024)
+    for image_id in ('1000001', '1000002', '1000003'):
+        cache.session.images[image_id] = synthetic_jpeg(image_id)
+    first = cache.fetch('1000001')
+    cache.fetch('1000002')
+    time.sleep(0.01)
+    cache.peek('1000001')  # now more recent than 1000002
+    cache.fetch('1000003')
+
+    assert cache.peek('1000002') is None
+    assert cache.peek('1000001') == first
+    assert cache.total_bytes() <= 100 * 1024
+    assert len(blob_files(cache)) == 2
+
+
+def test_an_image_larger_than_the_budget_is_still_returned(tmp_path):
+    cache = make_cache(tmp_path, max_bytes=32 * 1024)
+    cache.session.images['1000001'] = synthetic_jpeg('1000001')
+    cache.session.images['1000002'] = synthetic_jpeg('1000002')
+    cache.fetch('1000001')
+    path = cache.fetch('1000002')
+
+    assert path.exists()
+    assert cache.peek('1000002') == path
+    assert cache.peek('1000001') is None
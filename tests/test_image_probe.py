@@ -0,0 +1,47 @@
+"""image_probe: reading formats and dimensions from header bytes, and Range probes against the stub."""
+import struct
+
+import pytest
+
+from http_client import HttpClient
+from image_probe import ImageProbeError, probe_image, sniff_image
+from stub_servers import synthetic_jpeg
+
+
+def test_sniff_image_reads_each_format():
+    assert sniff_image(synthetic_jpeg('1000001')) == {'format': 'jpeg', 'content_type': 'image/jpeg',
+                                                      'width': 760, 'height': 401}
+    png = b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' + struct.pack('>II', 640, 480)
+    assert sniff_image(png)['format'] == 'png'
+    assert (sniff_image(png)['width'], sniff_image(png)['height']) == (640, 480)
+    gif = b'GIF89a' + struct.pack('<HH', 32, 16)
+    assert (sniff_image(gif)['width'], sniff_image(gif)['height']) == (32, 16)
+    assert sniff_image(b'<html><body>Image not available</body></html>') is None
+    assert sniff_image(b'') is None
+
+
+def test_sniff_image_skips_segments_before_the_frame():
+    jpeg = synthetic_jpeg('1000002')
+    exif = b'\xff\xe1' + struct.pack('>H', 2 + 1000) + bytes(1000)
+    padded = jpeg[:2] + exif + jpeg[2:]
+    assert (sniff_image(padded)['width'], sniff_image(padded)['height']) == (760, 402)
+    # The frame header lies beyond the bytes given: still a JPEG, size unknown
+    assert sniff_image(padded[:500]) == {'format': 'jpeg', 'content_type': 'image/jpeg', 'width': None, 'height': None}
+
+
+@pytest.fixture
+def image_base(stub):
+    server, _ = stub
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def test_probe_takes_the_full_size_from_a_range_response(image_base):
+    session = HttpClient(retries=0)
+    info = probe_image(f"{image_base}/index.php?id=1000003&t=w", session=session, max_bytes=1024)
+    assert info == {'format': 'jpeg', 'content_type': 'image/jpeg', 'width': 760, 'height': 403,
+                    'bytes': len(synthetic_jpeg('1000003'))}
+
+
+def test_probe_rejects_an_html_error_page(image_base):
+    with pytest.raises(ImageProbeError):
+        probe_image(f"{image_base}/index.php?id=1000007&t=w", session=HttpClient(retries=0))
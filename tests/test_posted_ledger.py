@@ -0,0 +1,61 @@
+"""PostedLedger: log and binary set round-trips, compaction and legacy import."""
+import json
+import uuid
+from datetime import date, timedelta
+
+from posted_ledger import RECORD, PostedLedger
+
+
+def card(i):
+    return str(uuid.UUID(int=i + 1))
+
+
+def test_round_trip_through_log_and_binary_set(tmp_path):
+    path = tmp_path / 'posted_cards.json'
+    first_day = date(2025, 1, 1)
+    ledger = PostedLedger(path, compact_every=10)
+    for i in range(25):
+        ledger.append(card(i), first_day + timedelta(days=i))
+    ledger.append(card(3), first_day)  # already posted: ignored
+
+    reopened = PostedLedger(path, compact_every=10)
+    assert len(reopened) == 25
+    assert all(card(i) in reopened for i in range(25))
+    assert card(25) not in reopened
+    assert 'not-a-uuid' not in reopened
+    assert reopened.entries() == [(card(i), first_day + timedelta(days=i)) for i in range(25)]
+    # Two compactions of 10, five sends still in the log
+    assert (tmp_path / 'posted_cards.bin').stat().st_size == 20 * RECORD.size
+    assert len((tmp_path / 'posted_cards.log').read_text().splitlines()) == 5
+
+
+def test_compact_merges_the_log(tmp_path):
+    path = tmp_path / 'posted_cards.json'
+    ledger = PostedLedger(path)
+    for i in range(5):
+        ledger.append(card(i), date(2025, 1, 1))
+    ledger.compact()
+
+    assert (tmp_path / 'posted_cards.log').read_text() == ''
+    reopened = PostedLedger(path)
+    assert sorted(reopened) == sorted(card(i) for i in range(5))
+
+
+def test_legacy_json_list_is_imported_once(tmp_path):
+    path = tmp_path / 'posted_cards.json'
+    legacy = [card(i) for i in (2, 0, 1)]
+    path.write_text(json.dumps(legacy + ['not-a-uuid', card(0)]))
+
+    ledger = PostedLedger(path)
+    assert sorted(ledger) == sorted(legacy)
+    # Send dates are unknown, but the list was in send order
+    assert ledger.entries() == [(card_uuid, None) for card_uuid in legacy]
+    assert (tmp_path / 'posted_cards.bin').stat().st_size == 3 * RECORD.size
+
+    # Later sends go to the log; the legacy file is not read again
+    ledger.append(card(10), date(2025, 6, 1))
+    path.write_text(json.dumps([card(99)]))
+    reopened = PostedLedger(path)
+    assert len(reopened) == 4
+    assert card(99) not in reopened
+    assert reopened.entries() == [(card_uuid, None) for card_uuid in legacy] + [(card(10), date(2025, 6, 1))]
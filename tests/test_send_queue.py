@@ -0,0 +1,93 @@
+"""The send queue: preparing entries ahead of time and sending them from the daily run."""
+import json
+from datetime import date, timedelta
+
+import pytest
+
+import broadcast_card
+import prepare_queue
+from broadcast_card import NYPLCardFetcher
+from posted_ledger import PostedLedger
+from send_queue import SendQueue
+from stub_servers import synthetic_capture, is_broken_image
+
+COLLECTION = "b2d37b40-c52d-012f-f8ec-58d385a7bc34"
+
+
+@pytest.fixture
+def workdir(tmp_path, stub, monkeypatch):
+    """A metadata.json of 20 cards and the env the daily run reads, with images served by the stub."""
+    server, _ = stub
+    captures = [synthetic_capture(COLLECTION, i) for i in range(20)]
+    (tmp_path / 'metadata.json').write_text(json.dumps({COLLECTION: {"nyplAPI": {"response": {"capture": captures}}}}))
+    monkeypatch.chdir(tmp_path)
+    for name, value in {'METADATA_PATH': 'metadata.json', 'POSTED_PATH': 'posted_cards.json',
+                        'CARD_STORE_PATH': 'cards.db', 'VALIDITY_PATH': 'card_validity.db',
+                        'DEDUP_PATH': 'card_dups.db', 'SEND_QUEUE_PATH': 'send_queue.jsonl',
+                        'IMAGE_CACHE_DIR': 'image_cache',
+                        'NYPL_IMAGE_BASE': f"http://127.0.0.1:{server.server_port}"}.items():
+        monkeypatch.setenv(name, value)
+    return tmp_path
+
+
+def pooled(store):
+    return {row[0] for row in store.conn.execute("SELECT cards.uuid FROM pool JOIN cards ON cards.id = pool.card_id")}
+
+
+def test_prepare_queues_consecutive_days_of_distinct_good_cards(workdir):
+    fetcher, queue = NYPLCardFetcher.from_env(), SendQueue('send_queue.jsonl')
+    assert prepare_queue.prepare(fetcher, queue, 5) == 5
+
+    entries = queue.entries()
+    queued = {entry['card_uuid'] for entry in entries}
+    tomorrow = date.today() + timedelta(days=1)
+    assert [entry['send_date'] for entry in entries] == [(tomorrow + timedelta(days=i)).isoformat() for i in range(5)]
+    assert len(queued) == 5
+    assert not any(is_broken_image(fetcher.store.get(card_uuid)['imageID']) for card_uuid in queued)
+    assert not queued & pooled(fetcher.store)
+
+    # Topping up a full queue adds nothing; a rebuilt store still knows the queued cards are reserved
+    assert prepare_queue.prepare(NYPLCardFetcher.from_env(), queue, 5) == 0
+    fetcher.store.close()
+    (workdir / 'cards.db').unlink()
+    assert prepare_queue.prepare(NYPLCardFetcher.from_env(), queue, 8) == 3
+    assert len({entry['card_uuid'] for entry in queue.entries()}) == 8
+
+
+def test_an_interrupted_prepare_keeps_the_cards_it_reserved(workdir, monkeypatch):
+    fetcher, queue = NYPLCardFetcher.from_env(), SendQueue('send_queue.jsonl')
+    verify = fetcher.verify_and_get_info
+    picked = []
+
+    def verify_then_die(card_uuid):
+        picked.append(card_uuid)
+        if len(picked) == 3:
+            raise KeyboardInterrupt
+        return verify(card_uuid)
+
+    monkeypatch.setattr(fetcher, 'verify_and_get_info', verify_then_die)
+    with pytest.raises(KeyboardInterrupt):
+        prepare_queue.prepare(fetcher, queue, 5)
+
+    # Every card reserved before the interrupt has an entry that will send it
+    verified = [card_uuid for card_uuid in picked[:2] if not is_broken_image(fetcher.store.get(card_uuid)['imageID'])]
+    assert [entry['card_uuid'] for entry in queue.entries()] == verified
+    assert not set(picked[:2]) & pooled(fetcher.store)
+    assert picked[2] in pooled(fetcher.store)
+
+
+def test_the_daily_run_drops_queued_cards_that_were_already_posted(workdir, capsys):
+    fetcher, queue = NYPLCardFetcher.from_env(), SendQueue('send_queue.jsonl')
+    prepare_queue.prepare(fetcher, queue, 3)
+    first, second, third = queue.entries()
+    fetcher.store.close()
+
+    # Posted by another tool after it was queued
+    PostedLedger(workdir / 'posted_cards.json').append(first['card_uuid'])
+    broadcast_card.main(['--dry-run'])
+
+    out = capsys.readouterr().out
+    assert f"Dropping queued card {first['card_uuid']}" in out
+    assert f"for card '{second['card_title']}'" in out
+    # A dry run sends nothing, so the next card stays at the head
+    assert queue.entries() == [second, third]
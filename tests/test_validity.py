@@ -0,0 +1,80 @@
+"""The validity cache's effect on the card store's selection pool."""
+import json
+
+from broadcast_card import NYPLCardFetcher
+from card_store import CardStore
+from stub_servers import synthetic_capture
+from validate_cards import validate_catalogue
+from validity_cache import ValidityCache
+
+COLLECTION = "b2d37b40-c52d-012f-f8ec-58d385a7bc34"
+
+
+def write_metadata(path, count):
+    captures = [synthetic_capture(COLLECTION, i) for i in range(count)]
+    path.write_text(json.dumps({COLLECTION: {"nyplAPI": {"response": {"capture": captures}}}}))
+    return captures
+
+
+def make_fetcher(tmp_path):
+    return NYPLCardFetcher('stub', tmp_path / 'metadata.json', tmp_path / 'posted_cards.json', tmp_path / 'cards.db',
+                           validity_path=tmp_path / 'card_validity.db', dedup_path=None, queue_path=None)
+
+
+def test_bad_images_are_retired_and_unchecked_cards_kept(tmp_path):
+    captures = write_metadata(tmp_path / 'metadata.json', 4)
+    cache = ValidityCache(tmp_path / 'card_validity.db')
+    cache.record(captures[0]['imageID'], 'ok')
+    cache.record(captures[1]['imageID'], 'missing')
+    cache.record(captures[2]['imageID'], 'non-image')
+    cache.finish_pass(complete=False)
+
+    fetcher = make_fetcher(tmp_path)
+    assert fetcher.store.pool_size() == 2  # the ok card and the unchecked one
+
+
+def test_cards_added_after_a_complete_pass_stay_selectable(tmp_path):
+    captures = write_metadata(tmp_path / 'metadata.json', 2)
+    cache = ValidityCache(tmp_path / 'card_validity.db')
+    for capture in captures:
+        cache.record(capture['imageID'], 'ok')
+    cache.finish_pass(complete=True)
+    assert make_fetcher(tmp_path).store.pool_size() == 2
+
+    # A harvest adds two cards and the store is rebuilt before they are validated
+    (tmp_path / 'cards.db').unlink()
+    captures = write_metadata(tmp_path / 'metadata.json', 4)
+    assert make_fetcher(tmp_path).store.pool_size() == 4
+
+    # The next pass marks them ok: they are still in the pool
+    for capture in captures[2:]:
+        cache.record(capture['imageID'], 'ok')
+    cache.finish_pass(complete=True)
+    fetcher = make_fetcher(tmp_path)
+    assert fetcher.store.pool_size() == 4
+
+
+def test_retire_invalid_ignores_unchecked_images(tmp_path):
+    captures = write_metadata(tmp_path / 'metadata.json', 3)
+    make_fetcher(tmp_path)  # compiles the store
+    cache = ValidityCache(tmp_path / 'card_validity.db')
+    cache.record(captures[1]['imageID'], 'missing')
+    cache.close()
+
+    store = CardStore(tmp_path / 'cards.db')
+    assert store.retire_invalid(tmp_path / 'card_validity.db') == 1
+    assert store.pool_size() == 2
+
+
+def test_a_timed_out_pass_publishes_its_results(tmp_path, stub):
+    server, _ = stub
+    image_base = f"http://127.0.0.1:{server.server_port}"
+    write_metadata(tmp_path / 'metadata.json', 10)
+    store = make_fetcher(tmp_path).store
+    cache = ValidityCache(tmp_path / 'card_validity.db')
+
+    assert validate_catalogue(store, cache, image_base, workers=2, max_seconds=1e-9) == {}
+    assert (cache.generation, cache.complete) == (1, False)
+
+    assert validate_catalogue(store, cache, image_base, workers=2) == {'ok': 9, 'non-image': 1}
+    assert (cache.generation, cache.complete) == (2, True)
@@ -0,0 +1,147 @@
+"""
+Offline pre-validation of every card image in the catalogue.
+
+Streams each distinct imageID out of the card store through a bounded
+pool of workers sharing one pooled HttpClient (retries, circuit breaker). Each image is probed once
+(see image_probe.py) and the result lands in a persistent validity cache:
+
+  ok         a JPEG/PNG/GIF was served (dimensions and byte size recorded)
+  missing    the image host answered 404/410
+  non-image  something other than an image came back
+  error      network failure or server error; re-checked on the next run
+
+NYPLCardFetcher retires cards with missing/non-image images from its pool
+and skips the live image check for ones known to be ok. Cards not checked
+yet stay selectable and are probed when picked.
+
+Images already in the local image cache are checked from disk. With
+--fetch-images, full images are downloaded into the cache instead of
+probed, warming it for tools that need the pixels.
+
+    python validate_cards.py --workers 16
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+
+from card_store import CardStore
+from download_metadata import TokenBucket
+from http_client import HttpClient
+from image_cache import ImageCache
+from image_probe import probe_image, sniff_image, ImageProbeError, PROBE_BYTES
+from validity_cache import ValidityCache
+
+
+def _cached_info(path):
+    with path.open('rb') as f: info = sniff_image(f.read(PROBE_BYTES))
+    if info:
+        info['bytes'] = path.stat().st_size
+    return info
+
+
+def check_image(image_id, image_base, session, image_cache=None, fetch_images=False):
+    """Check one image and classify it. Returns (status, info)."""
+    cached_path = image_cache.peek(image_id, 'w') if image_cache else None
+    if cached_path:
+        info = _cached_info(cached_path)
+        if info:
+            return 'ok', info
+
+    try:
+        if image_cache and fetch_images:
+            return 'ok', _cached_info(image_cache.fetch(image_id, 'w'))
+        info = probe_image(f"{image_base}/index.php?id={image_id}&t=w", session=session)
+        return 'ok', info
+    except ImageProbeError:
+        return 'non-image', None
+    except requests.exceptions.HTTPError as e:
+        status_code = e.response.status_code if e.response is not None else None
+        return ('missing' if status_code in (404, 410) else 'error'), None
+    except requests.exceptions.RequestException:
+        return 'error', None
+
+
+def validate_catalogue(store, cache, image_base, workers=16, rate=0.0, recheck=False, image_cache=None, fetch_images=False,
+                       max_seconds=None):
+    """
+    Run every not-yet-validated image in the store through the worker pool,
+    keeping at most 2 x workers probes in flight. With max_seconds, stop
+    submitting probes once that much time has passed; the results so far are
+    still published and the next run carries on. Returns {status: count}.
+    """
+    # The rate limit applies to every attempt, retries included
+    session = HttpClient(pool_size=workers, limiter=TokenBucket(rate))
+    if image_cache:
+        image_cache.session = session
+
+    counts = {}
+    skipped = 0
+    out_of_time = False
+    started = time.monotonic()
+    image_ids = (row[0] for row in store.conn.execute("SELECT DISTINCT image_id FROM cards"))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+
+        def drain(block_until):
+            while len(pending) > block_until:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    image_id = pending.pop(future)
+                    status, info = future.result()
+                    cache.record(image_id, status, info, commit=False)
+                    counts[status] = counts.get(status, 0) + 1
+                    checked = sum(counts.values())
+                    if checked % 500 == 0:
+                        cache.commit()
+                        print(f"Checked {checked} images ({checked / (time.monotonic() - started):.1f}/s): {counts}")
+
+        for image_id in image_ids:
+            previous = cache.get(image_id)
+            if previous and previous['status'] != 'error' and not recheck:
+                skipped += 1
+                continue
+            if max_seconds and time.monotonic() - started > max_seconds:
+                out_of_time = True
+                break
+            future = executor.submit(check_image, image_id, image_base, session, image_cache, fetch_images)
+            pending[future] = image_id
+            drain(block_until=2 * workers)
+        drain(block_until=0)
+
+    cache.commit()
+    # Nothing left unknown or transient: every card's image has a result
+    unresolved = counts.get('error', 0)
+    cache.finish_pass(complete=unresolved == 0 and not out_of_time)
+    if out_of_time:
+        print(f"Stopped after {max_seconds:.0f}s with images left to check; the next run continues from here")
+    if skipped:
+        print(f"Skipped {skipped} images already validated (use --recheck to probe them again)")
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate every card image and record the results.")
+    parser.add_argument('--store', default=os.getenv("CARD_STORE_PATH", "cards.db"))
+    parser.add_argument('--cache', default=os.getenv("VALIDITY_PATH", "card_validity.db"))
+    parser.add_argument('--image-base', default=os.getenv("NYPL_IMAGE_BASE", "https://images.nypl.org"))
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--rate', type=float, default=0.0, help="max probes per second (0 = unlimited)")
+    parser.add_argument('--recheck', action='store_true', help="probe images that already have a result")
+    parser.add_argument('--image-cache', default=os.getenv("IMAGE_CACHE_DIR", "image_cache"))
+    parser.add_argument('--fetch-images', action='store_true', help="download full images into the image cache")
+    parser.add_argument('--max-seconds', type=float, help="stop probing after this long, keeping the results so far")
+    args = parser.parse_args()
+
+    image_base = args.image_base.rstrip('/')
+    store, cache = CardStore(args.store), ValidityCache(args.cache)
+    image_cache = ImageCache(args.image_cache, max_bytes=int(os.getenv("IMAGE_CACHE_MAX_MB", "512")) * 1024 * 1024,
+                             image_base=image_base)
+    started = time.monotonic()
+    counts = validate_catalogue(store, cache, image_base, args.workers, args.rate, args.recheck,
+                                image_cache, args.fetch_images, args.max_seconds)
+    print(f"Validation finished in {time.monotonic() - started:.1f}s: {counts}")
+    print(f"Results saved to {args.cache}" + ("" if cache.complete else " (some images need re-checking)"))
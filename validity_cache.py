@@ -0,0 +1,80 @@
+"""
+Persistent record of which card images are known to be good, written by
+validate_cards.py and read by NYPLCardFetcher on every run. Kept free of
+network dependencies so that reading it costs the daily run nothing at
+start-up.
+"""
+import sqlite3
+import time
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    image_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    content_type TEXT,
+    width INTEGER,
+    height INTEGER,
+    bytes INTEGER,
+    checked_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+class ValidityCache:
+    """Persistent record of which card images are known to be good."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._conn = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def get(self, image_id):
+        """Return the recorded result for an image as a dict, or None if never checked."""
+        row = self.conn.execute("SELECT * FROM images WHERE image_id = ?", (str(image_id),)).fetchone()
+        return dict(row) if row else None
+
+    def record(self, image_id, status, info=None, commit=True):
+        info = info or {}
+        self.conn.execute(
+            "INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (str(image_id), status, info.get('content_type'), info.get('width'), info.get('height'),
+             info.get('bytes'), time.time()),
+        )
+        if commit:
+            self.conn.commit()
+
+    def commit(self):
+        self.conn.commit()
+
+    def _meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    @property
+    def generation(self):
+        """Bumped at the end of every validation pass."""
+        return int(self._meta('generation', 0))
+
+    @property
+    def complete(self):
+        """True once a pass has covered every card in the catalogue."""
+        return self._meta('complete') == '1'
+
+    def finish_pass(self, complete):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('generation', ?)", (str(self.generation + 1),))
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('complete', ?)", ('1' if complete else '0',))
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None